@@ -0,0 +1,97 @@
+"""
+Bit operations on string values. Bit 0 is the most significant bit of the first byte, as in Redis.
+Work on large ranges is done a chunk at a time through int.from_bytes, which keeps the per-byte loops in C.
+"""
+
+from collections.abc import Sequence
+
+from cachica import protocol
+
+# Bytes converted to an int at a time, big enough to amortize the call overhead
+CHUNK_SIZE = 1 << 16
+# Largest bit offset SETBIT accepts, bitmaps are capped at 512 MB
+MAX_BIT_OFFSET = (1 << 32) - 1
+
+
+def get_bit(data: bytes | bytearray, offset: int) -> int:
+    byte = offset >> 3
+    if byte >= len(data):
+        return 0
+    return (data[byte] >> (7 - (offset & 7))) & 1
+
+
+def set_bit(data: bytearray, offset: int, value: int) -> int:
+    """Sets a bit in place, growing `data` with zero bytes if needed. Returns the bit's previous value."""
+    byte = offset >> 3
+    if byte >= len(data):
+        data.extend(bytes(byte + 1 - len(data)))
+    mask = 1 << (7 - (offset & 7))
+    old = data[byte] & mask
+    if value:
+        data[byte] |= mask
+    else:
+        data[byte] &= ~mask
+    return 1 if old else 0
+
+
+def count_bits(data: bytes | bytearray, start: int = 0, end: int | None = None) -> int:
+    """Counts the set bits of data[start:end]."""
+    view = memoryview(data)[start:end]
+    return sum(int.from_bytes(view[i : i + CHUNK_SIZE], "big").bit_count() for i in range(0, len(view), CHUNK_SIZE))
+
+
+def encode_bit_count(data: bytes, start_bit: int, end_bit: int) -> bytes:
+    """RESP integer with the set bits between the (inclusive) bit offsets. Runs on the executor for big ranges."""
+    if start_bit > end_bit:
+        return protocol.encode_integer(0)
+    first, last = start_bit >> 3, end_bit >> 3
+    total = count_bits(data, first, last + 1)
+    # Drop the bits of the edge bytes outside the range
+    total -= (data[first] >> (8 - (start_bit & 7))).bit_count()
+    total -= (data[last] & (0xFF >> ((end_bit & 7) + 1))).bit_count()
+    return protocol.encode_integer(total)
+
+
+def find_bit(data: bytes | bytearray, bit: int, start_bit: int, end_bit: int) -> int:
+    """Returns the offset of the first bit equal to `bit` between the (inclusive) bit offsets, or -1."""
+    if start_bit > end_bit:
+        return -1
+    first, last = start_bit >> 3, end_bit >> 3
+    view = memoryview(data)
+    for chunk_start in range(first, last + 1, CHUNK_SIZE):
+        chunk = view[chunk_start : min(chunk_start + CHUNK_SIZE, last + 1)]
+        bits = len(chunk) * 8
+        value = int.from_bytes(chunk, "big")
+        if not bit:
+            value ^= (1 << bits) - 1
+        # Ignore the bits before start_bit and after end_bit
+        if chunk_start == first:
+            value &= (1 << (bits - (start_bit & 7))) - 1
+        if chunk_start + len(chunk) == last + 1:
+            value &= ~((1 << (7 - (end_bit & 7))) - 1)
+        if value:
+            return chunk_start * 8 + bits - value.bit_length()
+    return -1
+
+
+def bit_op(operation: str, values: Sequence[bytes | bytearray]) -> bytearray:
+    """
+    AND, OR, XOR or NOT of the values, shorter ones padded with zero bytes. NOT takes a single value.
+    Whole values are combined as ints, so the work is a handful of C-level passes.
+    """
+    length = max((len(value) for value in values), default=0)
+    if not length:
+        return bytearray()
+    ints = [int.from_bytes(value, "big") << (8 * (length - len(value))) for value in values]
+    if operation == "NOT":
+        result = ints[0] ^ ((1 << (8 * length)) - 1)
+    else:
+        result = ints[0]
+        for value in ints[1:]:
+            if operation == "AND":
+                result &= value
+            elif operation == "OR":
+                result |= value
+            else:
+                result ^= value
+    return bytearray(result.to_bytes(length, "big"))
@@ -0,0 +1,141 @@
+"""
+Traffic capture: records the commands clients send, with a timestamp and connection ID, to a binary
+file that tests/load_test/replay.py can play back against a server.
+
+The file starts with MAGIC, followed by one record per command: a RECORD header (nanoseconds since the
+capture started, connection ID, payload length) and the command as a RESP array, ready to be resent.
+"""
+
+import logging
+import struct
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from typing import NamedTuple
+
+from cachica import protocol
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CACHICA-CAPTURE\x01"
+RECORD = struct.Struct("<QII")
+# Commands waiting for the writer thread, more are dropped
+CAPTURE_BUFFER_SIZE = 100_000
+# How long the writer thread sleeps when there is nothing to write
+FLUSH_INTERVAL = 0.05
+# Commands written at once
+WRITE_BATCH_SIZE = 4096
+
+
+class CapturedCommand(NamedTuple):
+    offset_ns: int
+    connection_id: int
+    payload: bytes
+
+
+class CommandCapture:
+    """
+    Records commands to a capture file. `record` runs on the event loop and only appends to a bounded
+    buffer; a writer thread opens the file, encodes the commands and writes them out. Commands that
+    arrive while the buffer is full are dropped and counted rather than slowing down the clients.
+    Neither `start` nor `stop` waits for the file, `wait` does.
+    """
+
+    def __init__(self, buffer_size: int = CAPTURE_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.enabled = False
+        self.captured = 0
+        self.dropped = 0
+        self.path: str | None = None
+        self._buffer: deque[tuple[int, int, list[str]]] = deque()
+        self._stop = threading.Event()
+        # Writer threads that may still be writing out a stopped capture, the current one last
+        self._writers: list[threading.Thread] = []
+
+    def start(self, path: str) -> None:
+        """Starts capturing to `path`, replacing the file. A running capture is stopped first."""
+        self.stop()
+        self.path = path
+        self.captured = self.dropped = 0
+        # A new buffer, the previous capture's writer is still draining the old one
+        self._buffer = buffer = deque()
+        self._stop = stop = threading.Event()
+        writer = threading.Thread(
+            target=self._write, args=(path, buffer, time.monotonic_ns(), stop), name="cachica-capture", daemon=True
+        )
+        # Before the thread starts, so a file it can't open turns capturing back off
+        self.enabled = True
+        self._writers = [thread for thread in self._writers if thread.is_alive()]
+        self._writers.append(writer)
+        writer.start()
+        logger.info("Capturing commands to %s", path)
+
+    def stop(self) -> None:
+        """Stops capturing, the writer thread writes out the buffered commands in the background."""
+        if self._stop.is_set() or not self._writers:
+            return
+        self.enabled = False
+        self._stop.set()
+        logger.info("Captured %d commands to %s, dropped %d", self.captured, self.path, self.dropped)
+
+    def wait(self, timeout: float | None = None) -> None:
+        """Blocks until stopped captures are written out, e.g. before the server exits."""
+        for thread in self._writers:
+            thread.join(timeout)
+
+    def set_path(self, path: str) -> None:
+        """Config callback, an empty path stops capturing."""
+        if path:
+            self.start(path)
+        else:
+            self.stop()
+
+    def record(self, connection_id: int, command: list[str]) -> None:
+        if len(self._buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+        self._buffer.append((time.monotonic_ns(), connection_id, command))
+        self.captured += 1
+
+    def _write(self, path: str, buffer: deque, started_ns: int, stop: threading.Event) -> None:
+        pack, encode = RECORD.pack, protocol.encode_array
+        try:
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+                while True:
+                    stopping = stop.is_set()
+                    chunks = []
+                    for _ in range(min(len(buffer), WRITE_BATCH_SIZE)):
+                        timestamp, connection_id, command = buffer.popleft()
+                        payload = encode(command)
+                        chunks.append(pack(timestamp - started_ns, connection_id, len(payload)))
+                        chunks.append(payload)
+                    if chunks:
+                        f.write(b"".join(chunks))
+                    elif stopping:
+                        return
+                    else:
+                        f.flush()
+                        stop.wait(FLUSH_INTERVAL)
+        except Exception:
+            logger.exception("Capturing commands to %s failed, capturing is off", path)
+            if not stop.is_set():
+                # Still the current capture
+                self.enabled = False
+                stop.set()
+            buffer.clear()
+
+
+def read_capture(path: str) -> Iterator[CapturedCommand]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a cachica capture file")
+        while header := f.read(RECORD.size):
+            offset_ns, connection_id, length = RECORD.unpack(header) if len(header) == RECORD.size else (0, 0, 0)
+            payload = f.read(length)
+            if not length or len(payload) < length:
+                # The server was killed mid-write, the records before are intact
+                logger.warning("%s ends with a truncated record, ignoring it", path)
+                return
+            yield CapturedCommand(offset_ns, connection_id, payload)
@@ -1,99 +1,595 @@
+import asyncio
+import hashlib
+import math
+import queue
+import random
 import socket
+import threading
+import time
+import uuid
+from bisect import bisect, insort
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from cachica import protocol
+from cachica.config import parse_bind_addresses
+from cachica.protocol import ResponseError
 
+# Leases guarding a key's recomputation are stored under this prefix
+LEASE_PREFIX = "lease:"
+# How long a lease lasts unless get_or_set is told otherwise, in milliseconds
+DEFAULT_LEASE_MS = 5000
+# Waiting for another process's recomputation polls the key with this backoff, in seconds
+LEASE_POLL_MIN = 0.005
+LEASE_POLL_MAX = 0.05
+# Recompute times remembered for early refresh decisions, oldest are forgotten first
+MAX_TRACKED_DELTAS = 10_000
+# Points each node gets on the hash ring per unit of weight
+DEFAULT_VNODES = 160
+# Connections kept open per node by a ShardedClient
+DEFAULT_POOL_SIZE = 4
 
-class Client:
-    def __init__(self, client_id="cachica-client", host="127.0.0.1", port=8888):
+
+def should_refresh_early(remaining_ms: int, delta: float, beta: float = 1.0) -> bool:
+    """
+    XFetch: decides whether to recompute a value before it expires. `delta` is how long the last
+    recomputation took, in seconds. The probability grows as the expiry nears, so under load one
+    caller refreshes the value ahead of time instead of all of them missing at once.
+    """
+    if remaining_ms < 0 or delta <= 0:
+        # No TTL, or nothing measured yet
+        return False
+    return delta * beta * -math.log(1.0 - random.random()) * 1000 >= remaining_ms
+
+
+class _Flight:
+    """A recomputation in progress, shared by the threads that missed the same key."""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _remember_delta(deltas: dict[str, float], key: str, delta: float) -> None:
+    deltas.pop(key, None)
+    deltas[key] = delta
+    if len(deltas) > MAX_TRACKED_DELTAS:
+        del deltas[next(iter(deltas))]
+
+
+class _GetOrSet:
+    """
+    Blocking get_or_set, shared by Client and ShardedClient. Subclasses implement `_call_on(key, commands)`,
+    which sends the commands to the server holding `key` and returns their replies.
+    """
+
+    def __init__(self, client_id: str):
         self._client_id = client_id
+        self._flights: dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        self._deltas: dict[str, float] = {}
+
+    def get_or_set(self, key: str, loader, ttl: float, beta: float = 1.0, lease_ms: int = DEFAULT_LEASE_MS) -> str:
+        """
+        Returns the cached value of `key`, computing it with `loader()` and caching it for `ttl`
+        seconds on a miss. Concurrent misses in this process share one `loader()` call, and a
+        short lease on the server keeps other processes from recomputing the key at the same
+        time. Values may be recomputed shortly before they expire (see should_refresh_early),
+        `beta` above 1 favours refreshing earlier.
+        """
+        value, remaining_ms = self._call_on(key, [["GET", key], ["PTTL", key]])
+        if value is not None and not should_refresh_early(remaining_ms, self._deltas.get(key, 0.0), beta):
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._load(key, loader, ttl, lease_ms, stale=value)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def _call_on(self, key: str, commands: list[list[str]]) -> list:
+        raise NotImplementedError
+
+    def _load(self, key: str, loader, ttl: float, lease_ms: int, stale: str | None) -> str:
+        # The lease lives next to the key, so both are on the same server
+        lease = LEASE_PREFIX + key
+        token = f"{self._client_id}:{uuid.uuid4().hex}"
+        poll = LEASE_POLL_MIN
+        while self._call_on(key, [["SET", lease, token, "NX", "PX", str(lease_ms)]])[0] is None:
+            # Another process is recomputing, keep serving the old value if there is one
+            if stale is not None:
+                return stale
+            time.sleep(poll)
+            poll = min(poll * 2, LEASE_POLL_MAX)
+            value = self._call_on(key, [["GET", key]])[0]
+            if value is not None:
+                return value
+        try:
+            start = time.perf_counter()
+            value = loader()
+            _remember_delta(self._deltas, key, time.perf_counter() - start)
+            self._call_on(key, [["SET", key, value, "PX", str(max(int(ttl * 1000), 1))]])
+        finally:
+            self._release_lease(key, lease, token)
+        return value
+
+    def _release_lease(self, key: str, lease: str, token: str) -> None:
+        # Compare-and-delete: if the lease ran out during a slow load another process may hold it by now
+        if self._call_on(key, [["GET", lease]])[0] == token:
+            self._call_on(key, [["DEL", lease]])
+
+
+class Client(_GetOrSet):
+    """
+    Blocking client. Commands are serialized over a single connection, so one instance
+    can be shared between threads.
+    """
+
+    def __init__(self, client_id="cachica-client", host="127.0.0.1", port=8888, unix_socket_path=None):
+        super().__init__(client_id)
         self._server_host = host
         self._server_port = port
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.connect((self._server_host, self._server_port))
+        self._unix_socket_path = unix_socket_path
+        if unix_socket_path is not None:
+            # Same-host servers: skips the TCP/IP stack entirely
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(unix_socket_path)
+        else:
+            self._socket = socket.create_connection((self._server_host, self._server_port))
+            # Requests are small and latency bound, don't let Nagle hold them back
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self._parser = protocol.Parser(is_client=True)
+        self._io_lock = threading.Lock()
 
     def PING(self, message=None):
         arr = ["PING"]
         if message is not None:
             arr.append(message)
-        self._socket.sendall(protocol.encode_array(arr))
-        return self._recv()
+        return self._call(arr)
 
     def SET(self, *args):
-        self._socket.sendall(protocol.encode_array(["SET", *args]))
-        return self._recv()
+        return self._call(["SET", *args])
 
     def GET(self, key):
-        self._socket.sendall(protocol.encode_array(["GET", key]))
-        return self._recv()
+        return self._call(["GET", key])
 
     def DEL(self, keys: list[str]):
-        self._socket.sendall(protocol.encode_array(["DEL", *keys]))
-        return self._recv()
+        return self._call(["DEL", *keys])
+
+    def PTTL(self, key):
+        return self._call(["PTTL", key])
 
     def LPUSH(self, args):
-        self._socket.sendall(protocol.encode_array(["LPUSH", *args]))
-        return self._recv()
+        return self._call(["LPUSH", *args])
 
     def LPOP(self, args):
-        self._socket.sendall(protocol.encode_array(["LPOP", *args]))
-        return self._recv()
+        return self._call(["LPOP", *args])
+
+    def _call_on(self, key: str, commands: list[list[str]]) -> list:
+        return self._call_many(commands)
+
+    def _call(self, command: list[str]):
+        return self._call_many([command])[0]
+
+    def _call_many(self, commands: list[list[str]]) -> list:
+        """Sends the commands in one write and returns their replies, raising the first error reply."""
+        with self._io_lock:
+            self._socket.sendall(b"".join(protocol.encode_array(command) for command in commands))
+            replies = [self._recv() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, ResponseError):
+                raise reply
+        return replies
+
+    def close(self):
+        self._socket.close()
 
     def _recv(self, num_bytes=1024):
-        resp_data = self._socket.recv(num_bytes)
-        self._parser.feed(resp_data)
+        while not self._parser.ready:
+            resp_data = self._socket.recv(num_bytes)
+            if not resp_data:
+                raise ConnectionError("Connection closed by the server")
+            self._parser.feed(resp_data)
         return self._parser.get_command()
 
 
+class AsyncClient:
+    """
+    asyncio client, create one with `await AsyncClient.connect(...)`.
+    Commands are serialized over a single connection, so one instance can be shared between tasks.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_id="cachica-client"):
+        self._client_id = client_id
+        self._reader = reader
+        self._writer = writer
+        self._parser = protocol.Parser(is_client=True)
+        self._io_lock = asyncio.Lock()
+        self._flights: dict[str, asyncio.Future] = {}
+        self._deltas: dict[str, float] = {}
+
+    @classmethod
+    async def connect(cls, client_id="cachica-client", host="127.0.0.1", port=8888, unix_socket_path=None):
+        if unix_socket_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_socket_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer, client_id)
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def PING(self, message=None):
+        arr = ["PING"]
+        if message is not None:
+            arr.append(message)
+        return await self._call(arr)
+
+    async def SET(self, *args):
+        return await self._call(["SET", *args])
+
+    async def GET(self, key):
+        return await self._call(["GET", key])
+
+    async def DEL(self, keys: list[str]):
+        return await self._call(["DEL", *keys])
+
+    async def PTTL(self, key):
+        return await self._call(["PTTL", key])
+
+    async def get_or_set(
+        self, key: str, loader, ttl: float, beta: float = 1.0, lease_ms: int = DEFAULT_LEASE_MS
+    ) -> str:
+        """Same as Client.get_or_set, `loader` may be a plain or a coroutine function."""
+        value, remaining_ms = await self._call_many([["GET", key], ["PTTL", key]])
+        if value is not None and not should_refresh_early(remaining_ms, self._deltas.get(key, 0.0), beta):
+            return value
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            # shield: a cancelled waiter must not cancel the load the others are waiting for
+            return await asyncio.shield(flight)
+        flight = self._flights[key] = asyncio.ensure_future(self._load(key, loader, ttl, lease_ms, stale=value))
+        flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        return await asyncio.shield(flight)
+
+    async def _load(self, key: str, loader, ttl: float, lease_ms: int, stale: str | None) -> str:
+        lease = LEASE_PREFIX + key
+        token = f"{self._client_id}:{uuid.uuid4().hex}"
+        poll = LEASE_POLL_MIN
+        while await self.SET(lease, token, "NX", "PX", str(lease_ms)) is None:
+            if stale is not None:
+                return stale
+            await asyncio.sleep(poll)
+            poll = min(poll * 2, LEASE_POLL_MAX)
+            value = await self.GET(key)
+            if value is not None:
+                return value
+        try:
+            start = time.perf_counter()
+            value = loader()
+            if asyncio.iscoroutine(value):
+                value = await value
+            _remember_delta(self._deltas, key, time.perf_counter() - start)
+            await self.SET(key, value, "PX", str(max(int(ttl * 1000), 1)))
+        finally:
+            await self._release_lease(lease, token)
+        return value
+
+    async def _release_lease(self, lease: str, token: str) -> None:
+        if await self.GET(lease) == token:
+            await self.DEL([lease])
+
+    async def _call(self, command: list[str]):
+        return (await self._call_many([command]))[0]
+
+    async def _call_many(self, commands: list[list[str]]) -> list:
+        async with self._io_lock:
+            self._writer.write(b"".join(protocol.encode_array(command) for command in commands))
+            await self._writer.drain()
+            replies = [await self._recv() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, ResponseError):
+                raise reply
+        return replies
+
+    async def _recv(self, num_bytes=1024):
+        while not self._parser.ready:
+            resp_data = await self._reader.read(num_bytes)
+            if not resp_data:
+                raise ConnectionError("Connection closed by the server")
+            self._parser.feed(resp_data)
+        return self._parser.get_command()
+
+
+def _ring_hash(data: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping keys to node names. Each node gets `vnodes * weight` points
+    on the ring and owns the keys hashing between its points and the preceding ones, so adding
+    or removing a node only moves the keys of the ring segments it gains or loses.
+    """
+
+    def __init__(self, nodes: dict[str, int] | Iterable[str] = (), vnodes: int = DEFAULT_VNODES):
+        self._vnodes = vnodes
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        self._weights: dict[str, int] = {}
+        weights = nodes if isinstance(nodes, dict) else dict.fromkeys(nodes, 1)
+        for node, weight in weights.items():
+            self.add_node(node, weight)
+
+    def __len__(self) -> int:
+        return len(self._weights)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._weights
+
+    @property
+    def nodes(self) -> list[str]:
+        return list(self._weights)
+
+    def add_node(self, node: str, weight: int = 1) -> None:
+        if weight < 1:
+            raise ValueError(f"Node weight must be at least 1, got {weight}")
+        if node in self._weights:
+            self.remove_node(node)
+        self._weights[node] = weight
+        for i in range(self._vnodes * weight):
+            point = _ring_hash(f"{node}#{i}")
+            # On the (unlikely) collision the first node keeps the point
+            if point not in self._owners:
+                self._owners[point] = node
+                insort(self._points, point)
+
+    def remove_node(self, node: str) -> None:
+        if self._weights.pop(node, None) is None:
+            raise KeyError(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("The hash ring has no nodes")
+        i = bisect(self._points, _ring_hash(key))
+        return self._owners[self._points[i % len(self._points)]]
+
+    def split(self, keys: Iterable[str]) -> dict[str, list[str]]:
+        """Groups keys by the node owning them."""
+        groups: dict[str, list[str]] = {}
+        for key in keys:
+            groups.setdefault(self.node_for(key), []).append(key)
+        return groups
+
+
+class ClientPool:
+    """Up to `size` open Clients to one node, each handed out to one caller at a time."""
+
+    def __init__(self, address: str, size: int = DEFAULT_POOL_SIZE, client_id="cachica-client"):
+        self.address = address
+        if address.startswith("/"):
+            self._connect_args = {"unix_socket_path": address}
+        else:
+            host, port = parse_bind_addresses(address)[0]
+            self._connect_args = {"host": host, "port": port}
+        self._client_id = client_id
+        self._idle: queue.LifoQueue[Client] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                client = Client(self._client_id, **self._connect_args)
+            reusable = False
+            try:
+                yield client
+                reusable = True
+            except ResponseError:
+                # The whole error reply was read, the connection is fine
+                reusable = True
+                raise
+            finally:
+                if reusable and not self._closed:
+                    self._idle.put(client)
+                else:
+                    # Anything else may have left half a reply on the connection, don't reuse it
+                    client.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ShardedClient(_GetOrSet):
+    """
+    Spreads keys over several servers with a HashRing. Nodes are "host:port" addresses or unix socket paths,
+    optionally mapped to weights. Multi-key commands are split per node and sent to the nodes in parallel.
+    get_or_set coalesces concurrent misses across all of the client's connections, which are only checked
+    out for each round trip, not for the whole load.
+    """
+
+    def __init__(
+        self,
+        nodes: dict[str, int] | Iterable[str],
+        vnodes: int = DEFAULT_VNODES,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        client_id="cachica-client",
+    ):
+        super().__init__(client_id)
+        weights = nodes if isinstance(nodes, dict) else dict.fromkeys(nodes, 1)
+        self._pool_size = pool_size
+        self._ring = HashRing(vnodes=vnodes)
+        self._pools: dict[str, ClientPool] = {}
+        for node, weight in weights.items():
+            self.add_node(node, weight)
+        self._fanout = ThreadPoolExecutor(thread_name_prefix="cachica-shard")
+
+    @property
+    def nodes(self) -> list[str]:
+        return self._ring.nodes
+
+    def node_for(self, key: str) -> str:
+        return self._ring.node_for(key)
+
+    def add_node(self, node: str, weight: int = 1) -> None:
+        pool = ClientPool(node, self._pool_size, self._client_id)
+        self._ring.add_node(node, weight)
+        old = self._pools.pop(node, None)
+        self._pools[node] = pool
+        if old is not None:
+            old.close()
+
+    def remove_node(self, node: str) -> None:
+        """Stops routing keys to `node`. Only its keys move, to the nodes next to its ring points."""
+        self._ring.remove_node(node)
+        self._pools.pop(node).close()
+
+    def close(self) -> None:
+        self._fanout.shutdown()
+        for pool in self._pools.values():
+            pool.close()
+
+    def PING(self) -> dict[str, str]:
+        return dict(zip(self.nodes, self._map(self.nodes, lambda client, _: client.PING()), strict=True))
+
+    def SET(self, key, *args):
+        return self._on(key, lambda client: client.SET(key, *args))
+
+    def GET(self, key):
+        return self._on(key, lambda client: client.GET(key))
+
+    def PTTL(self, key):
+        return self._on(key, lambda client: client.PTTL(key))
+
+    def MGET(self, keys: list[str]) -> list[str | None]:
+        groups = self._ring.split(keys)
+        replies = self._map(groups, lambda client, node: client._call(["MGET", *groups[node]]))
+        values = {}
+        for node, reply in zip(groups, replies, strict=True):
+            values.update(zip(groups[node], reply, strict=True))
+        return [values[key] for key in keys]
+
+    def MSET(self, mapping: dict[str, str]) -> str:
+        groups = self._ring.split(mapping)
+        self._map(
+            groups,
+            lambda client, node: client._call(["MSET", *(x for key in groups[node] for x in (key, mapping[key]))]),
+        )
+        return "OK"
+
+    def DEL(self, keys: list[str]) -> int:
+        groups = self._ring.split(keys)
+        return sum(self._map(groups, lambda client, node: client.DEL(groups[node])))
+
+    def _call_on(self, key: str, commands: list[list[str]]) -> list:
+        return self._on(key, lambda client: client._call_many(commands))
+
+    def _on(self, key: str, fn):
+        with self._pools[self._ring.node_for(key)].connection() as client:
+            return fn(client)
+
+    def _call_node(self, node: str, fn):
+        with self._pools[node].connection() as client:
+            return fn(client, node)
+
+    def _map(self, nodes: Iterable[str], fn) -> list:
+        """Runs `fn(client, node)` for every node, in parallel when there are several."""
+        nodes = list(nodes)
+        if len(nodes) == 1:
+            return [self._call_node(nodes[0], fn)]
+        return list(self._fanout.map(lambda node: self._call_node(node, fn), nodes))
+
+
 def main():
     client = Client()
     while True:
         prompt = input("cachica> ").strip().split(" ")
-        match prompt[0].upper():
-            case "SET":
-                match len(prompt):
-                    case 3:
-                        resp = client.SET(*prompt[1:])
-                    case 5:
-                        if prompt[3].upper() in ("PX", "EX") and prompt[4].isdigit():
+        try:
+            match prompt[0].upper():
+                case "SET":
+                    match len(prompt):
+                        case 3:
                             resp = client.SET(*prompt[1:])
-                    case _:
-                        print("Incorrect args for 'set' command")
+                        case 5:
+                            if prompt[3].upper() in ("PX", "EX") and prompt[4].isdigit():
+                                resp = client.SET(*prompt[1:])
+                        case _:
+                            print("Incorrect args for 'set' command")
+                            continue
+                case "GET":
+                    if len(prompt) != 2:
+                        print("Incorrect number of args for 'get' command")
                         continue
-            case "GET":
-                if len(prompt) != 2:
-                    print("Incorrect number of args for 'get' command")
-                    continue
-                resp = client.GET(prompt[1])
-            case "PING":
-                if len(prompt) > 2:
-                    print("Incorrect number of args for 'PING' command")
-                    continue
-                if len(prompt) == 1:
-                    resp = client.PING()
-                else:
-                    resp = client.PING(prompt[1])
-            case "DEL":
-                if len(prompt) < 2:
-                    print("Incorrect number of args for 'del' command")
-                    continue
-                else:
-                    resp = client.DEL(prompt[1:])
-            case "LPUSH":
-                if len(prompt) < 3:
-                    print("Incorrect number of args for 'lpush' command")
-                    continue
-                else:
-                    resp = client.LPUSH(prompt[1:])
-            case "LPOP":
-                if len(prompt) < 2:
-                    print("Incorrect number of args for 'lpop' command")
+                    resp = client.GET(prompt[1])
+                case "PING":
+                    if len(prompt) > 2:
+                        print("Incorrect number of args for 'PING' command")
+                        continue
+                    if len(prompt) == 1:
+                        resp = client.PING()
+                    else:
+                        resp = client.PING(prompt[1])
+                case "DEL":
+                    if len(prompt) < 2:
+                        print("Incorrect number of args for 'del' command")
+                        continue
+                    else:
+                        resp = client.DEL(prompt[1:])
+                case "LPUSH":
+                    if len(prompt) < 3:
+                        print("Incorrect number of args for 'lpush' command")
+                        continue
+                    else:
+                        resp = client.LPUSH(prompt[1:])
+                case "LPOP":
+                    if len(prompt) < 2:
+                        print("Incorrect number of args for 'lpop' command")
+                        continue
+                    else:
+                        resp = client.LPOP(prompt[1:])
+                case _:
+                    print("Unknown command.")
                     continue
-                else:
-                    resp = client.LPOP(prompt[1:])
-            case _:
-                print("Unknown command.")
-                continue
+        except ResponseError as e:
+            print(f"(error) {e}")
+            continue
         print(resp)
 
 
@@ -0,0 +1,474 @@
+import logging
+import struct
+import time
+from array import array
+from collections.abc import Callable
+
+from cachica import protocol
+from cachica.config import Config
+from cachica.datastore import CacheValue, DataStore, DataType, KeySnapshot
+from cachica.executor import CommandExecutor
+
+logger = logging.getLogger(__name__)
+
+# Record layout in an arena segment: key length, value length, key bytes, value bytes
+HEADER = struct.Struct("<II")
+HEADER_SIZE = HEADER.size
+SEGMENT_SIZE = 1 << 20
+# Segments whose live bytes drop below this fraction of what was written are defragmented
+DEFRAG_LIVE_RATIO = 0.5
+# Index slots scanned per active expiry cycle
+EXPIRY_WINDOW = 256
+
+EMPTY = -1
+TOMBSTONE = -2
+POS_MASK = 0xFFFFFFFF
+
+
+class CompactKeyspace:
+    """
+    String keyspace stored in large bytearray arenas instead of per-key Python objects.
+
+    Records are appended to fixed-size arena segments and addressed by a packed
+    (segment << 32 | position) offset. An open-addressing index maps keys to offsets,
+    with the key hashes and expiry times kept in parallel arrays, so an entry costs
+    its encoded bytes plus 24 bytes per index slot.
+
+    Overwrites and deletes leave dead records behind; `defragment` moves live records
+    out of mostly-dead segments in bounded steps and releases them. Growing the index
+    is a full (C-speed) rehash of the parallel arrays.
+    """
+
+    def __init__(self, capacity: int = 1024, segment_size: int = SEGMENT_SIZE):
+        self._segment_size = segment_size
+        self._segments: list[bytearray | None] = []
+        self._views: list[memoryview | None] = []
+        self._filled: list[int] = []  # bytes written per segment
+        self._live: list[int] = []  # bytes still referenced by the index per segment
+        self._free_segments: list[int] = []
+        self._current = -1
+        self._defrag_segment = -1
+        self._defrag_pos = 0
+        self._expiry_cursor = 0
+        self._used = 0
+        self._tombstones = 0
+        self._volatile = 0
+        # Called with the key of every key deleted because it expired, if set
+        self.on_expired: Callable[[str], None] | None = None
+        self._allocate_index(max(8, 1 << (capacity - 1).bit_length()))
+
+    def __len__(self) -> int:
+        return self._used
+
+    def __contains__(self, key: str) -> bool:
+        return self._slot(key.encode(), hash(key)) >= 0
+
+    # --- Public API ---
+    def get(self, key: str, now: float | None = None) -> str | None:
+        i = self._slot(key.encode(), hash(key))
+        if i < 0:
+            return None
+        expire_at = self._ttls[i]
+        if expire_at and (now or time.monotonic()) > expire_at:
+            logger.debug("PASSIVE EVICTION: deleting expired key %s", key)
+            self._delete_slot(i)
+            if self.on_expired is not None:
+                self.on_expired(key)
+            return None
+        offset = self._offsets[i]
+        view = self._views[offset >> 32]
+        pos = offset & POS_MASK
+        key_len, value_len = HEADER.unpack_from(view, pos)
+        start = pos + HEADER_SIZE + key_len
+        return str(view[start : start + value_len], "utf-8")
+
+    def set(self, key: str, value: str, expire_at: float = 0.0) -> None:
+        key_bytes = key.encode()
+        h = hash(key)
+        offset = self._append(key_bytes, value.encode())
+        i = self._slot(key_bytes, h)
+        if i >= 0:
+            self._discard(self._offsets[i])
+            self._offsets[i] = offset
+            self._set_ttl(i, expire_at)
+            return
+        if (self._used + self._tombstones + 1) * 3 >= len(self._offsets) * 2:
+            self._resize()
+        i = self._insert_slot(h)
+        if self._offsets[i] == TOMBSTONE:
+            self._tombstones -= 1
+        self._offsets[i] = offset
+        self._hashes[i] = h
+        self._ttls[i] = 0.0
+        self._set_ttl(i, expire_at)
+        self._used += 1
+
+    def delete(self, key: str) -> bool:
+        i = self._slot(key.encode(), hash(key))
+        if i < 0:
+            return False
+        self._delete_slot(i)
+        return True
+
+    def get_expiry(self, key: str) -> float | None:
+        """Returns the key's expiry time, 0.0 if it has none, or None if the key does not exist."""
+        i = self._slot(key.encode(), hash(key))
+        return self._ttls[i] if i >= 0 else None
+
+    def set_expiry(self, key: str, expire_at: float) -> bool:
+        i = self._slot(key.encode(), hash(key))
+        if i < 0:
+            return False
+        self._set_ttl(i, expire_at)
+        return True
+
+    def keys(self):
+        offsets = self._offsets
+        for i in range(len(offsets)):
+            offset = offsets[i]
+            if offset >= 0:
+                yield self._key_at(offset)
+
+    def evict_expired(self, now: float | None = None, window: int = EXPIRY_WINDOW) -> int:
+        """Scans the next `window` index slots and deletes expired keys. Returns how many were deleted."""
+        if not self._volatile:
+            return 0
+        now = now or time.monotonic()
+        offsets, ttls = self._offsets, self._ttls
+        size = len(offsets)
+        start = self._expiry_cursor
+        evicted = 0
+        on_expired = self.on_expired
+        for n in range(min(window, size)):
+            i = (start + n) & (size - 1)
+            expire_at = ttls[i]
+            if expire_at and offsets[i] >= 0 and now > expire_at:
+                # Decoded before the slot is deleted, and only when someone listens
+                key = self._key_at(offsets[i]) if on_expired is not None else None
+                self._delete_slot(i)
+                evicted += 1
+                if on_expired is not None:
+                    on_expired(key)
+        self._expiry_cursor = (start + window) & (size - 1)
+        return evicted
+
+    def defragment(self, budget: int = 1000) -> int:
+        """
+        Moves up to `budget` records out of the most fragmented segment, releasing it once empty.
+        Returns the number of records examined, 0 when there is nothing to defragment.
+        """
+        if self._defrag_segment < 0 or self._segments[self._defrag_segment] is None:
+            self._defrag_segment = self._pick_defrag_segment()
+            self._defrag_pos = 0
+            if self._defrag_segment < 0:
+                return 0
+        seg = self._defrag_segment
+        view = self._views[seg]
+        pos = self._defrag_pos
+        filled = self._filled[seg]
+        examined = 0
+        while pos < filled and examined < budget:
+            key_len, value_len = HEADER.unpack_from(view, pos)
+            size = HEADER_SIZE + key_len + value_len
+            offset = (seg << 32) | pos
+            key_bytes = view[pos + HEADER_SIZE : pos + HEADER_SIZE + key_len].tobytes()
+            i = self._slot_of_offset(hash(str(key_bytes, "utf-8")), offset)
+            if i >= 0:
+                start = pos + HEADER_SIZE + key_len
+                self._offsets[i] = self._append(key_bytes, view[start : start + value_len].tobytes())
+                self._discard(offset)
+            pos += size
+            examined += 1
+        self._defrag_pos = pos
+        if self._segments[seg] is not None and pos >= filled and self._live[seg] == 0:
+            self._release_segment(seg)
+        return examined
+
+    def info(self) -> dict[str, str]:
+        arena = sum(len(seg) for seg in self._segments if seg is not None)
+        filled = sum(self._filled)
+        live = sum(self._live)
+        return {
+            "compact_keys": str(self._used),
+            "compact_volatile_keys": str(self._volatile),
+            "compact_index_slots": str(len(self._offsets)),
+            "compact_index_bytes": str(len(self._offsets) * 24),
+            "compact_arena_segments": str(len(self._segments) - len(self._free_segments)),
+            "compact_arena_bytes": str(arena),
+            "compact_live_bytes": str(live),
+            "compact_garbage_bytes": str(filled - live),
+        }
+
+    # --- Index ---
+    def _allocate_index(self, size: int) -> None:
+        self._offsets = array("q", [EMPTY]) * size
+        self._hashes = array("q", [0]) * size
+        self._ttls = array("d", [0.0]) * size
+
+    def _slot(self, key_bytes: bytes, h: int) -> int:
+        offsets, hashes, views = self._offsets, self._hashes, self._views
+        mask = len(offsets) - 1
+        i = h & mask
+        while True:
+            offset = offsets[i]
+            if offset == EMPTY:
+                return -1
+            if offset >= 0 and hashes[i] == h:
+                view = views[offset >> 32]
+                pos = offset & POS_MASK
+                key_len, _ = HEADER.unpack_from(view, pos)
+                if key_len == len(key_bytes) and view[pos + HEADER_SIZE : pos + HEADER_SIZE + key_len] == key_bytes:
+                    return i
+            i = (i + 1) & mask
+
+    def _slot_of_offset(self, h: int, target: int) -> int:
+        offsets = self._offsets
+        mask = len(offsets) - 1
+        i = h & mask
+        while True:
+            offset = offsets[i]
+            if offset == EMPTY:
+                return -1
+            if offset == target:
+                return i
+            i = (i + 1) & mask
+
+    def _insert_slot(self, h: int) -> int:
+        offsets = self._offsets
+        mask = len(offsets) - 1
+        i = h & mask
+        while offsets[i] >= 0:
+            i = (i + 1) & mask
+        return i
+
+    def _set_ttl(self, i: int, expire_at: float) -> None:
+        if self._ttls[i]:
+            self._volatile -= 1
+        if expire_at:
+            self._volatile += 1
+        self._ttls[i] = expire_at
+
+    def _delete_slot(self, i: int) -> None:
+        self._discard(self._offsets[i])
+        self._set_ttl(i, 0.0)
+        self._offsets[i] = TOMBSTONE
+        self._used -= 1
+        self._tombstones += 1
+
+    def _resize(self) -> None:
+        old_offsets, old_hashes, old_ttls = self._offsets, self._hashes, self._ttls
+        size = len(old_offsets)
+        # Only grow if live keys need it, otherwise this just clears out tombstones
+        if self._used * 3 >= size:
+            size *= 2
+        self._allocate_index(size)
+        offsets, hashes, ttls = self._offsets, self._hashes, self._ttls
+        mask = size - 1
+        for j in range(len(old_offsets)):
+            if old_offsets[j] >= 0:
+                h = old_hashes[j]
+                i = h & mask
+                while offsets[i] != EMPTY:
+                    i = (i + 1) & mask
+                offsets[i] = old_offsets[j]
+                hashes[i] = h
+                ttls[i] = old_ttls[j]
+        self._tombstones = 0
+        self._expiry_cursor = 0
+
+    # --- Arena ---
+    def _append(self, key_bytes: bytes, value_bytes: bytes) -> int:
+        size = HEADER_SIZE + len(key_bytes) + len(value_bytes)
+        if size > self._segment_size:
+            # Oversized records get a segment of their own
+            seg = self._new_segment(size)
+        else:
+            seg = self._current
+            if seg < 0 or self._filled[seg] + size > self._segment_size:
+                seg = self._current = self._new_segment(self._segment_size)
+        buffer = self._segments[seg]
+        pos = self._filled[seg]
+        HEADER.pack_into(buffer, pos, len(key_bytes), len(value_bytes))
+        start = pos + HEADER_SIZE
+        buffer[start : start + len(key_bytes)] = key_bytes
+        start += len(key_bytes)
+        buffer[start : start + len(value_bytes)] = value_bytes
+        self._filled[seg] = pos + size
+        self._live[seg] += size
+        return (seg << 32) | pos
+
+    def _key_at(self, offset: int) -> str:
+        view = self._views[offset >> 32]
+        pos = offset & POS_MASK
+        key_len, _ = HEADER.unpack_from(view, pos)
+        return str(view[pos + HEADER_SIZE : pos + HEADER_SIZE + key_len], "utf-8")
+
+    def _discard(self, offset: int) -> None:
+        seg = offset >> 32
+        key_len, value_len = HEADER.unpack_from(self._views[seg], offset & POS_MASK)
+        self._live[seg] -= HEADER_SIZE + key_len + value_len
+        if self._live[seg] == 0 and seg != self._current and seg != self._defrag_segment:
+            self._release_segment(seg)
+
+    def _new_segment(self, size: int) -> int:
+        buffer = bytearray(size)
+        if self._free_segments:
+            seg = self._free_segments.pop()
+            self._segments[seg] = buffer
+            self._views[seg] = memoryview(buffer)
+            self._filled[seg] = 0
+            self._live[seg] = 0
+        else:
+            seg = len(self._segments)
+            self._segments.append(buffer)
+            self._views.append(memoryview(buffer))
+            self._filled.append(0)
+            self._live.append(0)
+        return seg
+
+    def _release_segment(self, seg: int) -> None:
+        self._views[seg].release()
+        self._views[seg] = None
+        self._segments[seg] = None
+        self._filled[seg] = 0
+        self._live[seg] = 0
+        self._free_segments.append(seg)
+        if seg == self._defrag_segment:
+            self._defrag_segment = -1
+
+    def _pick_defrag_segment(self) -> int:
+        best, best_ratio = -1, DEFRAG_LIVE_RATIO
+        for seg, filled in enumerate(self._filled):
+            if seg == self._current or self._segments[seg] is None or not filled:
+                continue
+            ratio = self._live[seg] / filled
+            if ratio < best_ratio:
+                best, best_ratio = seg, ratio
+        return best
+
+
+class CompactKeySnapshot:
+    """
+    Copy of a CompactKeyspace's index for iterating its keys off the event loop.
+    Arena segments are never written at positions already handed out, so they are shared rather than copied.
+    """
+
+    __slots__ = ("_offsets", "_ttls", "_segments", "_now", "_others")
+
+    def __init__(self, keyspace: CompactKeyspace, now: float, others: KeySnapshot):
+        self._offsets = array("q", keyspace._offsets)
+        self._ttls = array("d", keyspace._ttls)
+        self._segments = list(keyspace._segments)
+        self._now = now
+        self._others = others
+
+    def __iter__(self):
+        yield from self._others
+        ttls, segments, now = self._ttls, self._segments, self._now
+        for i, offset in enumerate(self._offsets):
+            if offset < 0 or (ttls[i] and now > ttls[i]):
+                continue
+            segment = segments[offset >> 32]
+            pos = offset & POS_MASK
+            key_len, _ = HEADER.unpack_from(segment, pos)
+            yield str(segment[pos + HEADER_SIZE : pos + HEADER_SIZE + key_len], "utf-8")
+
+
+class CompactDataStore(DataStore):
+    """
+    DataStore that keeps plain string values in a CompactKeyspace. Other data types,
+    and string values that need a richer representation, stay in the regular dict.
+    """
+
+    def __init__(
+        self,
+        lazyfree: bool = False,
+        keyspace: CompactKeyspace | None = None,
+        executor: CommandExecutor | None = None,
+        config: Config | None = None,
+    ):
+        # Set first, the base class applies the notification settings to it
+        self._strings = keyspace or CompactKeyspace()
+        super().__init__(lazyfree=lazyfree, executor=executor, config=config)
+
+    def _handle_lpush(self, args: list):
+        if args and self._is_string(args[0]):
+            return protocol.encode_simple_error("wrong type")
+        return super()._handle_lpush(args)
+
+    def _handle_lpop(self, args: list):
+        if len(args) == 1 and self._is_string(args[0]):
+            return protocol.encode_simple_error("wrong type")
+        return super()._handle_lpop(args)
+
+    def _handle_lrange(self, args: list):
+        if len(args) == 3 and self._is_string(args[0]):
+            return protocol.encode_simple_error("wrong type")
+        return super()._handle_lrange(args)
+
+    def _is_string(self, key: str) -> bool:
+        # Through get, so an expired string is deleted instead of counting as a string
+        return self._strings.get(key) is not None
+
+    def _lookup(self, key: str) -> CacheValue | None:
+        # Strings are only looked up for their type here, a detached entry is enough
+        value = self._strings.get(key)
+        if value is not None:
+            return CacheValue(DataType.STRING, value, self._strings.get_expiry(key))
+        return super()._lookup(key)
+
+    def _set_notify_keyspace_events(self, spec: str):
+        super()._set_notify_keyspace_events(spec)
+        # The keyspace only decodes the keys it expires when someone listens
+        self._strings.on_expired = self._expired if "x" in self._notify_classes else None
+
+    def _key_count(self) -> int:
+        return super()._key_count() + len(self._strings)
+
+    def _key_snapshot(self) -> CompactKeySnapshot:
+        return CompactKeySnapshot(self._strings, time.monotonic(), super()._key_snapshot())
+
+    def _get_expiry(self, key: str) -> float | None:
+        expires_at = self._strings.get_expiry(key)
+        if expires_at is None:
+            return super()._get_expiry(key)
+        if expires_at and time.monotonic() > expires_at:
+            self._strings.delete(key)
+            self._expired(key)
+            return None
+        return expires_at
+
+    def _set_expiry(self, key: str, ex: float) -> bool:
+        return self._strings.set_expiry(key, ex) or super()._set_expiry(key, ex)
+
+    def _set(self, key: str, value: CacheValue):
+        if value.value_type == DataType.STRING and type(value.value) is str:
+            self._strings.set(key, value.value, value.expires_at)
+            if key in self._data:
+                super()._remove(key, self._lazyfree)
+            return
+        self._strings.delete(key)
+        super()._set(key, value)
+
+    def _remove(self, key: str, lazy: bool) -> bool:
+        if self._strings.delete(key):
+            return True
+        return super()._remove(key, lazy)
+
+    def _get(self, key: str):
+        value = self._strings.get(key)
+        if value is not None:
+            return value
+        return super()._get(key)
+
+    def _info_sections(self) -> dict:
+        sections = super()._info_sections()
+        sections["storage"] = lambda: {"storage_engine": "compact", **self._strings.info()}
+        return sections
+
+    def evict_expired_keys(self):
+        super().evict_expired_keys()
+        self._strings.evict_expired()
+
+    def defragment(self, budget: int = 1000) -> int:
+        return self._strings.defragment(budget)
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+import zlib
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Protocol
+
+from cachica import protocol
+
+logger = logging.getLogger(__name__)
+
+# Values at least this big (in bytes) are compressed/decompressed on the executor, if one is set
+DEFAULT_OFFLOAD_THRESHOLD = 256 * 1024
+# Compressed payloads must be at most this fraction of the original to be kept
+MIN_SAVINGS_RATIO = 0.9
+
+
+class Codec(Protocol):
+    name: str
+
+    def compress(self, data: bytes) -> bytes: ...
+
+    def decompress(self, data: bytes) -> bytes: ...
+
+
+class ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+@dataclass
+class CompressedString:
+    __slots__ = ("codec", "payload", "size")
+    codec: Codec
+    payload: bytes
+    size: int  # length of the uncompressed value in bytes
+
+
+@dataclass
+class CompressionStats:
+    compressed: int = 0
+    skipped: int = 0
+    decompressed: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    compress_cpu: float = 0.0
+    decompress_cpu: float = 0.0
+    offloaded: int = 0
+
+    @property
+    def ratio(self) -> float:
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+
+def parse_rules(spec: str) -> dict[str, int | None]:
+    """
+    Parses per-prefix thresholds, e.g. "html:=512,session:=off".
+    A threshold of "off" disables compression for keys with that prefix.
+    """
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        prefix, sep, threshold = item.rpartition("=")
+        if not sep or not prefix:
+            raise ValueError(f"Invalid compression rule: {item!r}")
+        rules[prefix] = None if threshold.lower() == "off" else int(threshold)
+    return rules
+
+
+def _compress(codec: Codec, raw: bytes) -> tuple[bytes, float]:
+    start = time.thread_time()
+    payload = codec.compress(raw)
+    return payload, time.thread_time() - start
+
+
+def _decompress(value: CompressedString) -> tuple[bytes, float]:
+    start = time.thread_time()
+    raw = value.codec.decompress(value.payload)
+    return raw, time.thread_time() - start
+
+
+class Compressor:
+    """
+    Decides which string values get stored compressed and does the (de)compression.
+    Values bigger than `offload_threshold` are handled on `executor` so the event loop keeps serving clients.
+    """
+
+    def __init__(
+        self,
+        threshold: int | None = 1024,
+        rules: dict[str, int | None] | None = None,
+        codec: Codec | None = None,
+        executor: Executor | None = None,
+        offload_threshold: int = DEFAULT_OFFLOAD_THRESHOLD,
+    ):
+        self._threshold = threshold
+        self.set_rules(rules or {})
+        self._codec = codec or ZlibCodec()
+        self._executor = executor
+        self._offload_threshold = offload_threshold
+        self.stats = CompressionStats()
+
+    @property
+    def active(self) -> bool:
+        return self._threshold is not None or bool(self._rules)
+
+    def set_threshold(self, threshold: int | None) -> None:
+        self._threshold = threshold
+
+    def set_rules(self, rules: dict[str, int | None]) -> None:
+        # Longest prefix first, so the most specific rule wins
+        self._rules = sorted(rules.items(), key=lambda rule: len(rule[0]), reverse=True)
+
+    def set_codec(self, codec: Codec) -> None:
+        """Only affects values compressed from now on, existing payloads keep the codec they were written with."""
+        self._codec = codec
+
+    def threshold_for(self, key: str) -> int | None:
+        for prefix, threshold in self._rules:
+            if key.startswith(prefix):
+                return threshold
+        return self._threshold
+
+    def maybe_compress(self, key: str, entry) -> None:
+        """Replaces `entry.value` with its compressed form if the key's threshold calls for it."""
+        value = entry.value
+        threshold = self.threshold_for(key)
+        # len() counts characters, which is a lower bound of the encoded size
+        if threshold is None or type(value) is not str or len(value) < threshold:
+            return
+        raw = value.encode()
+        if len(raw) >= self._offload_threshold and self._executor is not None and _running_loop():
+            future = asyncio.get_running_loop().run_in_executor(self._executor, _compress, self._codec, raw)
+            future.add_done_callback(lambda f: self._compressed(entry, value, raw, f))
+            self.stats.offloaded += 1
+            return
+        payload, cpu = _compress(self._codec, raw)
+        self._store(entry, value, raw, payload, cpu)
+
+    def _compressed(self, entry, original: str, raw: bytes, future: asyncio.Future) -> None:
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Background compression failed: %s", future.exception())
+            return
+        payload, cpu = future.result()
+        # The value may have been overwritten or modified while we were compressing
+        if entry.value is original:
+            self._store(entry, original, raw, payload, cpu)
+
+    def _store(self, entry, original: str, raw: bytes, payload: bytes, cpu: float) -> None:
+        self.stats.compress_cpu += cpu
+        if len(payload) > len(raw) * MIN_SAVINGS_RATIO:
+            self.stats.skipped += 1
+            return
+        entry.value = CompressedString(self._codec, payload, len(raw))
+        self.stats.compressed += 1
+        self.stats.bytes_in += len(raw)
+        self.stats.bytes_out += len(payload)
+
+    def decompress(self, value: CompressedString) -> str:
+        raw, cpu = _decompress(value)
+        self._decompressed(cpu)
+        return raw.decode()
+
+    def encode_reply(self, value: CompressedString) -> bytes | asyncio.Future:
+        """
+        Returns the RESP bulk string for a compressed value. Large values are decompressed on the executor,
+        in which case a future resolving to the reply is returned instead.
+        """
+        if value.size >= self._offload_threshold and self._executor is not None and _running_loop():
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, _decompress, value)
+            self.stats.offloaded += 1
+            return asyncio.ensure_future(self._reply_when_done(future))
+        raw, cpu = _decompress(value)
+        self._decompressed(cpu)
+        return protocol.encode_bulk_string(raw)
+
+    async def _reply_when_done(self, future: asyncio.Future) -> bytes:
+        raw, cpu = await future
+        self._decompressed(cpu)
+        return protocol.encode_bulk_string(raw)
+
+    def _decompressed(self, cpu: float) -> None:
+        self.stats.decompressed += 1
+        self.stats.decompress_cpu += cpu
+
+    def info(self) -> dict[str, str]:
+        stats = self.stats
+        return {
+            "compression_codec": self._codec.name,
+            "compression_threshold": str(self._threshold) if self._threshold is not None else "off",
+            "compressed_values": str(stats.compressed),
+            "compression_skipped": str(stats.skipped),
+            "decompressed_values": str(stats.decompressed),
+            "compression_bytes_in": str(stats.bytes_in),
+            "compression_bytes_out": str(stats.bytes_out),
+            "compression_ratio": f"{stats.ratio:.2f}",
+            "compression_cpu_seconds": f"{stats.compress_cpu:.6f}",
+            "decompression_cpu_seconds": f"{stats.decompress_cpu:.6f}",
+            "compression_offloaded": str(stats.offloaded),
+        }
+
+
+def _running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
@@ -1,7 +1,24 @@
+import atexit
+import json
 import logging
+import logging.config
+import logging.handlers
 import os
+import queue
 import sys
-import json
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from cachica.capture import CAPTURE_BUFFER_SIZE
+from cachica.compression import parse_rules
+from cachica.keystats import TOP_K
+from cachica.pubsub import parse_notify_flags
+
+# Log records waiting for the writer thread, more are dropped
+LOG_QUEUE_SIZE = 10_000
+
 
 # Custom JSON Formatter
 class JsonFormatter(logging.Formatter):
@@ -17,14 +34,15 @@ class JsonFormatter(logging.Formatter):
         }
         # Add exception info if present
         if record.exc_info:
-            log_record['exc_info'] = self.formatException(record.exc_info)
-        
+            log_record["exc_info"] = self.formatException(record.exc_info)
+
         # Add extra fields passed to the logger
-        if hasattr(record, 'extra_data'):
+        if hasattr(record, "extra_data"):
             log_record.update(record.extra_data)
-            
+
         return json.dumps(log_record)
 
+
 def get_logging_config(log_level_str: str = "INFO"):
     """
     Returns a dictionary for logging.config.dictConfig.
@@ -46,16 +64,16 @@ def get_logging_config(log_level_str: str = "INFO"):
         "handlers": {
             "stdout": {
                 "class": "logging.StreamHandler",
-                "level": "DEBUG", # Let the logger control the level
+                "level": "DEBUG",  # Let the logger control the level
                 "formatter": "json" if os.getenv("LOG_FORMAT") == "json" else "simple",
                 "stream": sys.stdout,
             },
         },
         "loggers": {
-            "my_app": { # Your app's logger
+            "my_app": {  # Your app's logger
                 "handlers": ["stdout"],
                 "level": log_level,
-                "propagate": False, # Don't pass logs to the root logger
+                "propagate": False,  # Don't pass logs to the root logger
             },
             # Example for a noisy third-party library
             "uvicorn.access": {
@@ -64,9 +82,499 @@ def get_logging_config(log_level_str: str = "INFO"):
                 "propagate": False,
             },
         },
-        "root": { # Catch-all for everything else
+        "root": {  # Catch-all for everything else
             "handlers": ["stdout"],
             "level": log_level,
         },
     }
     return config
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener's writer thread instead of writing them inline.
+    Records are formatted on the writer thread, and dropped (and counted) when the queue is full
+    so a slow log sink can never block the event loop.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_level_str: str = "INFO", queue_size: int = LOG_QUEUE_SIZE) -> logging.handlers.QueueListener:
+    """
+    Applies get_logging_config, then moves the configured handlers behind a bounded queue
+    drained by a background writer thread. Returns the started listener.
+    """
+    logging_config = get_logging_config(log_level_str)
+    logging.config.dictConfig(logging_config)
+    loggers = [logging.getLogger()] + [logging.getLogger(name) for name in logging_config["loggers"]]
+    sinks = list(dict.fromkeys(handler for logger in loggers for handler in logger.handlers))
+    log_queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    for logger in loggers:
+        if logger.handlers:
+            logger.handlers = [queue_handler]
+    listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flushes what is still queued
+    return listener
+
+
+class CommandLogSampler:
+    """
+    Per-command debug logging that costs a single attribute check while disabled.
+    Logs one in `sample_rate` commands, and at most `max_per_second` of them.
+    """
+
+    def __init__(self, logger: logging.Logger, sample_rate: int = 1, max_per_second: int = 100):
+        self._logger = logger
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.suppressed = 0
+        self._seen = 0
+        self._window_end = 0.0
+        self._logged_in_window = 0
+        self.enabled = False
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Re-reads the logger's level, call after changing it."""
+        self.enabled = self._logger.isEnabledFor(logging.DEBUG) and self.sample_rate > 0
+
+    def log(self, addr, command: list[str]) -> None:
+        self._seen += 1
+        if self._seen % self.sample_rate:
+            return
+        now = time.monotonic()
+        if now >= self._window_end:
+            if self.suppressed:
+                self._logger.debug("Suppressed %d command log lines", self.suppressed)
+                self.suppressed = 0
+            self._window_end = now + 1
+            self._logged_in_window = 0
+        if self._logged_in_window >= self.max_per_second:
+            self.suppressed += 1
+            return
+        self._logged_in_window += 1
+        self._logger.debug("Processing command from %s: %s", addr, command)
+
+
+def parse_bool(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in ("1", "yes", "true", "on"):
+        return True
+    if lowered in ("0", "no", "false", "off", ""):
+        return False
+    raise ValueError(f"Invalid boolean: {value!r}")
+
+
+def format_bool(value: bool) -> str:
+    return "yes" if value else "no"
+
+
+def parse_optional_int(value: str) -> int | None:
+    """Parses an integer threshold where "off" (or an empty value) disables the feature."""
+    if value.strip().lower() in ("off", ""):
+        return None
+    return int(value)
+
+
+def format_optional_int(value: int | None) -> str:
+    return "off" if value is None else str(value)
+
+
+def parse_log_level(value: str) -> str:
+    level = value.strip().upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Invalid log level: {value!r}")
+    return level
+
+
+def parse_octal(value: str) -> int | None:
+    return int(value, 8) if value.strip() else None
+
+
+def format_octal(value: int | None) -> str:
+    return "" if value is None else format(value, "o")
+
+
+def parse_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def format_list(value: list[str]) -> str:
+    return ",".join(value)
+
+
+def choice(*options: str) -> Callable[[str], str]:
+    def parse(value: str) -> str:
+        lowered = value.strip().lower()
+        if lowered not in options:
+            raise ValueError(f"expected one of {', '.join(options)}, got {value!r}")
+        return lowered
+
+    return parse
+
+
+def bounded(parse: Callable[[str], Any], minimum=None, maximum=None) -> Callable[[str], Any]:
+    """Wraps a numeric parser to reject values outside [minimum, maximum], either bound may be omitted."""
+
+    def parse_bounded(value: str):
+        parsed = parse(value)
+        # Written as negations so NaN is rejected too
+        if minimum is not None and not parsed >= minimum:
+            raise ValueError(f"must be at least {minimum}, got {value!r}")
+        if maximum is not None and not parsed <= maximum:
+            raise ValueError(f"must be at most {maximum}, got {value!r}")
+        return parsed
+
+    return parse_bounded
+
+
+def parse_file_name(value: str) -> str:
+    """A file name without any directory part, so it can't point outside the directory it is joined to."""
+    name = value.strip()
+    if name in (".", "..") or os.sep in name or (os.altsep and os.altsep in name):
+        raise ValueError(f"expected a file name without a directory, got {value!r}")
+    return name
+
+
+def parse_compression_rules(value: str) -> str:
+    parse_rules(value)  # validates only, the Compressor parses the rules itself
+    return value
+
+
+def parse_keyspace_events(value: str) -> str:
+    parse_notify_flags(value)  # validates only, the DataStore parses the flags itself
+    return value
+
+
+def parse_bind_addresses(spec: str) -> list[tuple[str, int]]:
+    """
+    Parses a comma separated list of TCP listen addresses, e.g. "0.0.0.0:8888,[::1]:8889".
+    """
+    addresses = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        host, sep, port = item.rpartition(":")
+        if not sep or not port.isdigit():
+            raise ValueError(f"Invalid bind address: {item!r}")
+        addresses.append((host.strip("[]") or "0.0.0.0", int(port)))
+    return addresses
+
+
+def format_bind_addresses(addresses: list[tuple[str, int]]) -> str:
+    return ",".join(f"[{host}]:{port}" if ":" in host else f"{host}:{port}" for host, port in addresses)
+
+
+@dataclass(frozen=True)
+class Parameter:
+    name: str
+    default: str
+    parse: Callable[[str], Any] = str
+    format: Callable[[Any], str] = str
+    env: str | None = None
+    mutable: bool = True
+    description: str = ""
+
+    @property
+    def attr(self) -> str:
+        return self.name.replace("-", "_")
+
+
+PARAMETERS = (
+    # --- Expiry and background work ---
+    Parameter(
+        "active-expire-interval",
+        "0.1",
+        bounded(float, 0.001),
+        env="ACTIVE_EXPIRE_INTERVAL",
+        description="Seconds between active expiry cycles",
+    ),
+    Parameter(
+        "active-expire-samples",
+        "10",
+        bounded(int, 1),
+        env="ACTIVE_EXPIRE_SAMPLES",
+        description="Keys with a TTL checked per active expiry cycle",
+    ),
+    Parameter(
+        "lazyfree",
+        "no",
+        parse_bool,
+        format_bool,
+        env="LAZYFREE",
+        description="Free large values in the background on DEL, expiry and overwrite",
+    ),
+    # --- Client I/O ---
+    Parameter(
+        "read-buffer-size",
+        "1024",
+        bounded(int, 1),
+        env="READ_BUFFER_SIZE",
+        description="Bytes read from a client socket at once",
+    ),
+    Parameter(
+        "client-query-buffer-limit",
+        "1073741824",
+        bounded(int, 1),
+        env="CLIENT_QUERY_BUFFER_LIMIT",
+        description="Unparsed bytes a client may accumulate before it is disconnected",
+    ),
+    # --- Logging ---
+    Parameter("log-level", "INFO", parse_log_level, env="LOG_LEVEL"),
+    Parameter("log-queue-size", str(LOG_QUEUE_SIZE), bounded(int, 1), env="LOG_QUEUE_SIZE", mutable=False),
+    Parameter(
+        "command-log-sample-rate",
+        "1",
+        bounded(int, 0),
+        env="COMMAND_LOG_SAMPLE_RATE",
+        description="Log one in this many commands at DEBUG level, 0 disables command logging",
+    ),
+    Parameter("command-log-max-per-second", "100", bounded(int, 0), env="COMMAND_LOG_MAX_PER_SECOND"),
+    # --- Keyspace notifications ---
+    Parameter(
+        "notify-keyspace-events",
+        "",
+        parse_keyspace_events,
+        env="NOTIFY_KEYSPACE_EVENTS",
+        description="Keyspace events published to subscribers, e.g. 'Ex' or 'KEA', empty disables them",
+    ),
+    # --- Traffic capture ---
+    Parameter(
+        "capture-dir",
+        ".",
+        env="CAPTURE_DIR",
+        mutable=False,
+        description="Directory capture files are written to",
+    ),
+    Parameter(
+        "capture-file",
+        "",
+        parse_file_name,
+        env="CAPTURE_FILE",
+        description="Record the commands clients send to this file in capture-dir, empty disables capturing",
+    ),
+    Parameter(
+        "capture-buffer-size",
+        str(CAPTURE_BUFFER_SIZE),
+        bounded(int, 1),
+        env="CAPTURE_BUFFER_SIZE",
+        description="Commands waiting to be written to the capture file, more are dropped",
+    ),
+    # --- Key statistics ---
+    Parameter(
+        "key-stats-sample-rate",
+        "100",
+        bounded(int, 0),
+        env="KEY_STATS_SAMPLE_RATE",
+        description="Track the keys of one in this many commands for HOTKEYS and BIGKEYS, 0 disables tracking",
+    ),
+    Parameter(
+        "key-stats-top-k",
+        str(TOP_K),
+        bounded(int, 1),
+        env="KEY_STATS_TOP_K",
+        mutable=False,
+        description="Hot and big keys kept by HOTKEYS and BIGKEYS",
+    ),
+    # --- Storage ---
+    Parameter("storage-engine", "dict", choice("dict", "compact"), env="STORAGE_ENGINE", mutable=False),
+    Parameter("compression-threshold", "off", parse_optional_int, format_optional_int, env="COMPRESSION_THRESHOLD"),
+    Parameter("compression-rules", "", parse_compression_rules, env="COMPRESSION_RULES"),
+    Parameter("compression-level", "6", bounded(int, 0, 9), env="COMPRESSION_LEVEL"),
+    Parameter("offload-pool", "thread", choice("thread", "process", "none"), env="OFFLOAD_POOL", mutable=False),
+    Parameter("offload-threshold", "10000", bounded(int, 0), env="OFFLOAD_THRESHOLD"),
+    Parameter(
+        "offload-value-threshold",
+        "4194304",
+        bounded(int, 0),
+        env="OFFLOAD_VALUE_THRESHOLD",
+        description="Bytes from which a single value, e.g. a GET reply, is encoded on the offload pool",
+    ),
+    # --- Network ---
+    Parameter("bind", "0.0.0.0:8888", parse_bind_addresses, format_bind_addresses, env="BIND", mutable=False),
+    Parameter("unix-socket", "", parse_list, format_list, env="UNIX_SOCKET", mutable=False),
+    Parameter("unix-socket-permissions", "", parse_octal, format_octal, env="UNIX_SOCKET_PERMISSIONS", mutable=False),
+    Parameter("listen-backlog", "511", bounded(int, 0), env="LISTEN_BACKLOG", mutable=False),
+    Parameter(
+        "tcp-nodelay",
+        "yes",
+        parse_bool,
+        format_bool,
+        env="TCP_NODELAY",
+        description="Applies to connections accepted after the change",
+    ),
+    Parameter(
+        "tcp-keepalive",
+        "300",
+        bounded(int, 0),
+        env="TCP_KEEPALIVE",
+        description="Applies to connections accepted after the change",
+    ),
+    Parameter("so-sndbuf", "0", bounded(int, 0), env="SO_SNDBUF", mutable=False),
+    Parameter("so-rcvbuf", "0", bounded(int, 0), env="SO_RCVBUF", mutable=False),
+)
+
+
+class ConfigError(Exception):
+    pass
+
+
+class Config:
+    """
+    Server settings, resolved from defaults, then the config file, then environment variables.
+
+    Values are exposed as attributes named after their parameter (e.g. `config.read_buffer_size`)
+    so hot paths can read them cheaply. Mutable parameters can be changed on a running server with
+    `set`, which notifies the callbacks registered for them with `on_change`.
+
+    The config file holds one `name value` pair per line, `#` starts a comment.
+    """
+
+    def __init__(self, path: str | None = None, parameters: tuple[Parameter, ...] = PARAMETERS):
+        self.path = path
+        self._parameters = {parameter.name: parameter for parameter in parameters}
+        self._explicit: set[str] = set()
+        self._callbacks: dict[str, list[Callable[[Any], None]]] = {}
+        for parameter in parameters:
+            setattr(self, parameter.attr, parameter.parse(parameter.default))
+
+    @classmethod
+    def load(cls, path: str | None = None) -> "Config":
+        config = cls(path)
+        if path is not None and os.path.exists(path):
+            for name, value in _read_config_file(path):
+                config._assign(name, value)
+        for parameter in config._parameters.values():
+            if parameter.env is not None and os.getenv(parameter.env):
+                config._assign(parameter.name, os.environ[parameter.env])
+        return config
+
+    def names(self) -> list[str]:
+        return list(self._parameters)
+
+    def is_explicit(self, name: str) -> bool:
+        """Whether the parameter was set by the config file, the environment or at runtime."""
+        return name in self._explicit
+
+    def get(self, name: str) -> str:
+        parameter = self._parameter(name)
+        return parameter.format(getattr(self, parameter.attr))
+
+    def set(self, name: str, value: str) -> None:
+        parameter = self._parameter(name)
+        if not parameter.mutable:
+            raise ConfigError(f"can't set immutable config parameter '{name}'")
+        self._assign(name, value)
+        for callback in self._callbacks.get(parameter.name, ()):
+            callback(getattr(self, parameter.attr))
+
+    def validate(self, name: str, value: str) -> None:
+        parameter = self._parameter(name)
+        if not parameter.mutable:
+            raise ConfigError(f"can't set immutable config parameter '{name}'")
+        try:
+            parameter.parse(value)
+        except ValueError as e:
+            raise ConfigError(f"invalid value for '{name}': {e}") from None
+
+    def on_change(self, name: str, callback: Callable[[Any], None]) -> None:
+        self._callbacks.setdefault(self._parameter(name).name, []).append(callback)
+
+    def rewrite(self) -> None:
+        """
+        Writes the current settings to the config file. Existing lines are updated in place,
+        comments are kept and explicitly set parameters missing from the file are appended.
+        """
+        if self.path is None:
+            raise ConfigError("the server is running without a config file")
+        lines = []
+        written = set()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f.read().splitlines():
+                    name = line.split(maxsplit=1)[0].lower() if line.strip() else ""
+                    if name in self._parameters:
+                        if name in written:
+                            continue
+                        line = f"{name} {self.get(name)}"
+                        written.add(name)
+                    lines.append(line)
+        for name in self._parameters:
+            if name not in written and name in self._explicit:
+                lines.append(f"{name} {self.get(name)}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _parameter(self, name: str) -> Parameter:
+        parameter = self._parameters.get(name.lower())
+        if parameter is None:
+            raise ConfigError(f"unknown config parameter '{name}'")
+        return parameter
+
+    def _assign(self, name: str, value: str) -> None:
+        parameter = self._parameter(name)
+        try:
+            parsed = parameter.parse(value)
+        except ValueError as e:
+            raise ConfigError(f"invalid value for '{name}': {e}") from None
+        setattr(self, parameter.attr, parsed)
+        self._explicit.add(parameter.name)
+
+
+def _read_config_file(path: str) -> list[tuple[str, str]]:
+    entries = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, _, value = line.partition(" ")
+            if not name:
+                raise ConfigError(f"{path}:{number}: invalid line")
+            entries.append((name.lower(), value.strip().strip('"')))
+    return entries
+
+
+@dataclass
+class NetworkConfig:
+    """Where the server listens and how its sockets are tuned."""
+
+    bind: list[tuple[str, int]] = field(default_factory=lambda: [("0.0.0.0", 8888)])
+    unix_sockets: list[str] = field(default_factory=list)
+    unix_socket_permissions: int | None = None
+    backlog: int = 511
+    tcp_nodelay: bool = True
+    tcp_keepalive: int = 300  # seconds of idle time before probes start, 0 disables keepalive
+    send_buffer: int = 0  # SO_SNDBUF in bytes, 0 keeps the OS default
+    receive_buffer: int = 0  # SO_RCVBUF in bytes, 0 keeps the OS default
+
+    @classmethod
+    def from_config(cls, config: Config) -> "NetworkConfig":
+        """Setting only unix-socket disables TCP."""
+        bind = config.bind
+        if config.unix_socket and not config.is_explicit("bind"):
+            bind = []
+        return cls(
+            bind=bind,
+            unix_sockets=config.unix_socket,
+            unix_socket_permissions=config.unix_socket_permissions,
+            backlog=config.listen_backlog,
+            tcp_nodelay=config.tcp_nodelay,
+            tcp_keepalive=config.tcp_keepalive,
+            send_buffer=config.so_sndbuf,
+            receive_buffer=config.so_rcvbuf,
+        )
@@ -1,49 +1,275 @@
+import asyncio
 import logging
 import pdb
 import time
-from random import sample
+import sys
+from random import randint, sample
 from dataclasses import dataclass
-from cachica import protocol
+from cachica import bitmap, protocol
+from cachica.compression import CompressedString, Compressor
+from cachica.config import Config, ConfigError
+from cachica.executor import CommandExecutor, encode_matching_keys
+from cachica.keystats import DEFAULT_SAMPLES, DICT_ENTRY_BYTES, KeyStats, estimate_size
+from cachica.probabilistic import HyperLogLog, ScalableBloomFilter
+from cachica.pubsub import PubSub, parse_notify_flags
+from cachica.stream import Stream, StreamError, format_id, parse_id, parse_range_bound
 from enum import Enum, auto
 from collections import deque
-from typing import Any
+from fnmatch import fnmatchcase
+from itertools import islice
+from typing import Any, Awaitable
 
 logger = logging.getLogger(__name__)
 
+# Containers with more elements than this are released in the background when lazy freeing
+LAZYFREE_THRESHOLD = 64
+# How many elements a single lazy-free slice may release
+LAZYFREE_BATCH_SIZE = 2000
+
+# Where key statistics find the keys in a command's arguments, the first argument if not listed
+KEY_ARGUMENTS = {
+    "MGET": slice(None),
+    "MSET": slice(None, None, 2),
+    "DEL": slice(None),
+    "UNLINK": slice(None),
+    "BITOP": slice(1, None),
+    "PFCOUNT": slice(None),
+    "PFMERGE": slice(None),
+}
+FIRST_ARGUMENT = slice(0, 1)
+# Commands without key arguments, or whose keys key statistics ignore
+KEYLESS_COMMANDS = frozenset(
+    ("PING", "ECHO", "KEYS", "XREAD", "PUBLISH", "INFO", "CONFIG", "HOTKEYS", "BIGKEYS", "MEMORY")
+)
+# Commands that can't change a key's size, key statistics only count their accesses
+READ_ONLY_COMMANDS = frozenset(
+    (
+        "GET",
+        "MGET",
+        "GETBIT",
+        "BITCOUNT",
+        "BITPOS",
+        "TTL",
+        "PTTL",
+        "LRANGE",
+        "PFCOUNT",
+        "BF.EXISTS",
+        "XLEN",
+        "XRANGE",
+        "XREVRANGE",
+    )
+)
+
 class DataType(Enum):
     STRING = auto()
     LIST = auto()
+    HYPERLOGLOG = auto()
+    BLOOM = auto()
+    STREAM = auto()
 
-@dataclass
+@dataclass(slots=True)
 class CacheValue:
-    __slots__ = ('value_type', 'value')
     value_type: DataType
     value: Any
+    expires_at: float = 0.0  # time.monotonic() deadline, 0.0 when the key has no TTL
+
+
+# What a key costs besides its name and value: the keyspace slot and the CacheValue
+ENTRY_BYTES = DICT_ENTRY_BYTES + sys.getsizeof(CacheValue(DataType.STRING, None))
+
+
+class VolatileKeys:
+    """
+    The keys that have a TTL, kept in a list so active expiry can sample them without copying the keyspace.
+    Removal swaps the last key into the freed position.
+    """
+
+    __slots__ = ("_keys", "_positions")
 
-class DataStore:
     def __init__(self):
+        self._keys: list[str] = []
+        self._positions: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def add(self, key: str) -> None:
+        if key not in self._positions:
+            self._positions[key] = len(self._keys)
+            self._keys.append(key)
+
+    def discard(self, key: str) -> None:
+        pos = self._positions.pop(key, None)
+        if pos is None:
+            return
+        last = self._keys.pop()
+        if pos < len(self._keys):
+            self._keys[pos] = last
+            self._positions[last] = pos
+
+    def sample(self, k: int) -> list[str]:
+        keys = self._keys
+        return [keys[i] for i in sample(range(len(keys)), min(k, len(keys)))]
+
+
+def expire_at(unit: str, amount: str) -> float:
+    """
+    Converts a relative EX/PX expiry option to a time.monotonic() deadline.
+    Raises ValueError if the amount is not a positive integer.
+    """
+    ttl = int(amount)
+    if ttl <= 0:
+        raise ValueError(amount)
+    return time.monotonic() + (ttl if unit == "EX" else ttl / 1000)
+
+class KeySnapshot:
+    """Copy of the keyspace's keys that can be iterated off the event loop. Keys expired at `now` are skipped."""
+
+    __slots__ = ("_keys", "_expiry", "_now")
+
+    def __init__(self, keys: tuple[str, ...], expiry: dict[str, float], now: float):
+        # `expiry` only needs to hold the keys with a TTL
+        self._keys = keys
+        self._expiry = expiry
+        self._now = now
+
+    def __iter__(self):
+        expiry, now = self._expiry, self._now
+        for key in self._keys:
+            expire_at = expiry.get(key)
+            if expire_at is None or now <= expire_at:
+                yield key
+
+
+def _bit_offset(value: str) -> int | None:
+    try:
+        offset = int(value)
+    except ValueError:
+        return None
+    return offset if 0 <= offset <= bitmap.MAX_BIT_OFFSET else None
+
+
+def _bit_range(length: int, bounds: list[str], unit: str) -> tuple[int, int] | bytes:
+    """
+    Converts BITCOUNT/BITPOS style start and end arguments, in bytes or bits and possibly negative,
+    to an inclusive range of bit offsets within a value of `length` bytes. Returns an error reply if invalid.
+    """
+    unit = unit.upper()
+    if unit not in ("BYTE", "BIT"):
+        return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+    size = length * 8 if unit == "BIT" else length
+    try:
+        start, end = (int(bounds[0]), int(bounds[1])) if bounds else (0, size - 1)
+    except ValueError:
+        return protocol.encode_simple_error("value is not an integer or out of range", error_prefix="ERR")
+    if start < 0:
+        start = max(size + start, 0)
+    if end < 0:
+        end = size + end
+    end = min(end, size - 1)
+    if start > end:
+        return 1, 0
+    if unit == "BYTE":
+        return start * 8, end * 8 + 7
+    return start, end
+
+
+def _stream_entries(entries: list) -> list:
+    return [[format_id(stream_id), list(fields)] for stream_id, fields in entries]
+
+
+class DataStore:
+    def __init__(
+        self,
+        lazyfree: bool = False,
+        compressor: Compressor | None = None,
+        executor: CommandExecutor | None = None,
+        config: Config | None = None,
+    ):
         self._data: dict[str, CacheValue] = {}
-        self._expiry: dict[str, float] = {}
+        # TTLs live on the entries, this only tracks which keys have one
+        self._volatile = VolatileKeys()
+        # When set, DEL, expiry and overwrites hand large values to the lazy-free queue
+        self._lazyfree = lazyfree
+        self._lazyfree_pending: deque = deque()
+        # Stores large string values compressed, if configured
+        self._compressor = compressor
+        # Runs expensive read-only work off the event loop, if configured
+        self._executor = executor
+        # Futures of blocked XREADs, per stream key, resolved by the next XADD to it
+        self._stream_waiters: dict[str, set[asyncio.Future]] = {}
+        self._config = config or Config()
+        self._config.on_change("lazyfree", self._set_lazyfree)
+        # Subscriptions, and the keyspace events published to them
+        self.pubsub = PubSub()
+        self._set_notify_keyspace_events(self._config.notify_keyspace_events)
+        self._config.on_change("notify-keyspace-events", self._set_notify_keyspace_events)
+        # Hot and big keys, fed from a sample of the commands
+        self._keystats = KeyStats(self._config.key_stats_top_k)
+        self._key_sample_countdown = 0
+        self._set_key_stats_sample_rate(self._config.key_stats_sample_rate)
+        self._config.on_change("key-stats-sample-rate", self._set_key_stats_sample_rate)
         self._commands = {
             "PING": self._handle_ping,
             "ECHO": self._handle_echo,
             "SET": self._handle_set,
             "GET": self._handle_get,
+            "GETEX": self._handle_getex,
+            "MGET": self._handle_mget,
+            "MSET": self._handle_mset,
+            "SETBIT": self._handle_setbit,
+            "GETBIT": self._handle_getbit,
+            "BITCOUNT": self._handle_bitcount,
+            "BITPOS": self._handle_bitpos,
+            "BITOP": self._handle_bitop,
+            "EXPIRE": self._handle_expire,
+            "PEXPIRE": self._handle_pexpire,
+            "TTL": self._handle_ttl,
+            "PTTL": self._handle_pttl,
+            "PERSIST": self._handle_persist,
             "DEL": self._handle_del,
+            "UNLINK": self._handle_unlink,
             "LPUSH": self._handle_lpush,
             "LPOP": self._handle_lpop,
+            "LRANGE": self._handle_lrange,
+            "KEYS": self._handle_keys,
+            "PFADD": self._handle_pfadd,
+            "PFCOUNT": self._handle_pfcount,
+            "PFMERGE": self._handle_pfmerge,
+            "BF.RESERVE": self._handle_bf_reserve,
+            "BF.ADD": self._handle_bf_add,
+            "BF.MADD": self._handle_bf_madd,
+            "BF.EXISTS": self._handle_bf_exists,
+            "XADD": self._handle_xadd,
+            "XLEN": self._handle_xlen,
+            "XRANGE": self._handle_xrange,
+            "XREVRANGE": self._handle_xrevrange,
+            "XREAD": self._handle_xread,
+            "PUBLISH": self._handle_publish,
+            "HOTKEYS": self._handle_hotkeys,
+            "BIGKEYS": self._handle_bigkeys,
+            "MEMORY": self._handle_memory,
+            "INFO": self._handle_info,
+            "CONFIG": self._handle_config,
         }
 
     def _handle_lpush(self, args: list):
         logger.debug("LPUSH with args %s", args)
         if len(args) < 2:
             return protocol.encode_simple_error("wrong number of args")
-        if args[0] in self._data.keys():
+        if self._lookup(args[0]) is not None:
             if self._data[args[0]].value_type == DataType.LIST:
                 self._data[args[0]].value.appendleft(args[1])
+                if self._notify_classes:
+                    self._notify("l", "lpush", args[0])
                 return protocol.encode_integer(len(args)-1)
         else:
             self._data[args[0]] = CacheValue(DataType.LIST, deque(args[1:]))
+            if self._notify_classes:
+                self._notify("l", "lpush", args[0])
             return protocol.encode_integer(len(args[1:]))
         return protocol.encode_simple_error("wrong type")
 
@@ -51,7 +277,7 @@ class DataStore:
         logger.debug("LPOP with args %s", args)
         if len(args) != 1:
             return protocol.encode_simple_error("wrong number of args")
-        if args[0] in self._data.keys():
+        if self._lookup(args[0]) is not None:
             if self._data[args[0]].value_type == DataType.LIST and len(self._data[args[0]].value) > 0:
                 val = self._data[args[0]].value.popleft()
                 return protocol.encode_simple_string(val)
@@ -60,6 +286,327 @@ class DataStore:
 
 
 
+    def _handle_lrange(self, args: list):
+        if len(args) != 3:
+            return protocol.encode_simple_error("wrong number of arguments for 'lrange' command", error_prefix="ERR")
+        key = args[0]
+        try:
+            start, stop = int(args[1]), int(args[2])
+        except ValueError:
+            return protocol.encode_simple_error("value is not an integer or out of range", error_prefix="ERR")
+        entry = self._lookup(key)
+        if entry is None:
+            return protocol.encode_array([])
+        if entry.value_type != DataType.LIST:
+            return protocol.encode_simple_error("wrong type")
+        items = entry.value
+        length = len(items)
+        if start < 0:
+            start = max(length + start, 0)
+        if stop < 0:
+            stop = length + stop
+        stop = min(stop, length - 1)
+        if start > stop:
+            return protocol.encode_array([])
+        # The tuple is an immutable view the encoding can safely work on from another thread or process
+        snapshot = tuple(islice(items, start, stop + 1))
+        return self._offload(len(snapshot), protocol.encode_array, snapshot)
+
+    def _handle_keys(self, args: list):
+        if len(args) != 1:
+            return protocol.encode_simple_error("wrong number of arguments for 'keys' command", error_prefix="ERR")
+        return self._offload(self._key_count(), encode_matching_keys, args[0], self._key_snapshot())
+
+    def _handle_pfadd(self, args: list) -> bytes:
+        if not args:
+            return protocol.encode_simple_error("wrong number of arguments for 'pfadd' command", error_prefix="ERR")
+        entry = self._lookup(args[0])
+        if entry is None:
+            hll = HyperLogLog()
+            hll.add(args[1:])
+            self._set(args[0], CacheValue(DataType.HYPERLOGLOG, hll))
+            return protocol.encode_integer(1)
+        if entry.value_type != DataType.HYPERLOGLOG:
+            return protocol.encode_simple_error("wrong type")
+        return protocol.encode_integer(int(entry.value.add(args[1:])))
+
+    def _handle_pfcount(self, args: list) -> bytes:
+        if not args:
+            return protocol.encode_simple_error("wrong number of arguments for 'pfcount' command", error_prefix="ERR")
+        hlls = self._hyperloglogs(args)
+        if type(hlls) is bytes:
+            return hlls
+        if len(hlls) == 1:
+            return protocol.encode_integer(hlls[0].count())
+        union = HyperLogLog()
+        for hll in hlls:
+            union.merge(hll)
+        return protocol.encode_integer(union.count())
+
+    def _handle_pfmerge(self, args: list) -> bytes:
+        if not args:
+            return protocol.encode_simple_error("wrong number of arguments for 'pfmerge' command", error_prefix="ERR")
+        hlls = self._hyperloglogs(args)
+        if type(hlls) is bytes:
+            return hlls
+        entry = self._lookup(args[0])
+        if entry is None:
+            entry = CacheValue(DataType.HYPERLOGLOG, HyperLogLog())
+            self._set(args[0], entry)
+        for hll in hlls:
+            if hll is not entry.value:
+                entry.value.merge(hll)
+        return protocol.encode_simple_string("OK")
+
+    def _hyperloglogs(self, keys: list[str]) -> list[HyperLogLog] | bytes:
+        """Returns the HyperLogLogs stored at the existing keys, or a wrong type error."""
+        hlls = []
+        for key in keys:
+            entry = self._lookup(key)
+            if entry is None:
+                continue
+            if entry.value_type != DataType.HYPERLOGLOG:
+                return protocol.encode_simple_error("wrong type")
+            hlls.append(entry.value)
+        return hlls or [HyperLogLog()]
+
+    def _handle_bf_reserve(self, args: list) -> bytes:
+        """BF.RESERVE key error_rate capacity"""
+        if len(args) != 3:
+            return protocol.encode_simple_error(
+                "wrong number of arguments for 'bf.reserve' command", error_prefix="ERR"
+            )
+        try:
+            bloom = ScalableBloomFilter(float(args[1]), int(args[2]))
+        except ValueError as e:
+            return protocol.encode_simple_error(f"bad error rate or capacity: {e}")
+        if self._lookup(args[0]) is not None:
+            return protocol.encode_simple_error("item exists")
+        self._set(args[0], CacheValue(DataType.BLOOM, bloom))
+        return protocol.encode_simple_string("OK")
+
+    def _handle_bf_add(self, args: list) -> bytes:
+        if len(args) != 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'bf.add' command", error_prefix="ERR")
+        bloom = self._bloom(args[0], create=True)
+        if type(bloom) is bytes:
+            return bloom
+        return protocol.encode_integer(int(bloom.add(args[1:])[0]))
+
+    def _handle_bf_madd(self, args: list) -> bytes:
+        if len(args) < 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'bf.madd' command", error_prefix="ERR")
+        bloom = self._bloom(args[0], create=True)
+        if type(bloom) is bytes:
+            return bloom
+        return protocol.encode_integer_array(list(map(int, bloom.add(args[1:]))))
+
+    def _handle_bf_exists(self, args: list) -> bytes:
+        if len(args) != 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'bf.exists' command", error_prefix="ERR")
+        bloom = self._bloom(args[0], create=False)
+        if type(bloom) is bytes:
+            return bloom
+        return protocol.encode_integer(int(bloom is not None and bloom.contains(args[1:])[0]))
+
+    def _bloom(self, key: str, create: bool) -> ScalableBloomFilter | bytes | None:
+        entry = self._lookup(key)
+        if entry is None:
+            if not create:
+                return None
+            entry = CacheValue(DataType.BLOOM, ScalableBloomFilter())
+            self._set(key, entry)
+        elif entry.value_type != DataType.BLOOM:
+            return protocol.encode_simple_error("wrong type")
+        return entry.value
+
+    def _handle_xadd(self, args: list) -> bytes:
+        """XADD key [NOMKSTREAM] [MAXLEN [= | ~] threshold] <* | id> field value [field value ...]"""
+        if len(args) < 4:
+            return protocol.encode_simple_error("wrong number of arguments for 'xadd' command", error_prefix="ERR")
+        key, i = args[0], 1
+        create = True
+        maxlen = None
+        approximate = False
+        while i < len(args):
+            option = args[i].upper()
+            if option == "NOMKSTREAM":
+                create = False
+                i += 1
+            elif option == "MAXLEN" and i + 1 < len(args):
+                approximate = args[i + 1] == "~"
+                i += 2 if args[i + 1] in ("~", "=") else 1
+                try:
+                    maxlen = int(args[i])
+                except (ValueError, IndexError):
+                    return protocol.encode_simple_error("value is not an integer or out of range", error_prefix="ERR")
+                if maxlen < 0:
+                    return protocol.encode_simple_error("The MAXLEN argument must be >= 0.", error_prefix="ERR")
+                i += 1
+            else:
+                break
+        fields = args[i + 1 :]
+        if not fields or len(fields) % 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'xadd' command", error_prefix="ERR")
+
+        stream = self._stream(key)
+        if type(stream) is bytes:
+            return stream
+        if stream is None and not create:
+            return protocol.encode_bulk_string(None)
+        is_new = stream is None
+        if is_new:
+            stream = Stream()
+        try:
+            stream_id = stream.next_id(args[i])
+        except StreamError as e:
+            return protocol.encode_simple_error(str(e), error_prefix="ERR")
+        if is_new:
+            self._set(key, CacheValue(DataType.STREAM, stream))
+        stream.add(stream_id, tuple(fields))
+        if maxlen is not None:
+            stream.trim(maxlen, approximate)
+        self._wake_stream_readers(key)
+        return protocol.encode_bulk_string(format_id(stream_id))
+
+    def _handle_xlen(self, args: list) -> bytes:
+        if len(args) != 1:
+            return protocol.encode_simple_error("wrong number of arguments for 'xlen' command", error_prefix="ERR")
+        stream = self._stream(args[0])
+        if type(stream) is bytes:
+            return stream
+        return protocol.encode_integer(len(stream) if stream is not None else 0)
+
+    def _handle_xrange(self, args: list) -> bytes:
+        return self._xrange(args, "xrange", reverse=False)
+
+    def _handle_xrevrange(self, args: list) -> bytes:
+        return self._xrange(args, "xrevrange", reverse=True)
+
+    def _xrange(self, args: list, name: str, reverse: bool) -> bytes:
+        """XRANGE key start end [COUNT count], XREVRANGE takes end before start"""
+        if len(args) not in (3, 5):
+            return protocol.encode_simple_error(f"wrong number of arguments for '{name}' command", error_prefix="ERR")
+        count = None
+        if len(args) == 5:
+            if args[3].upper() != "COUNT":
+                return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+            try:
+                count = max(int(args[4]), 0)
+            except ValueError:
+                return protocol.encode_simple_error("value is not an integer or out of range", error_prefix="ERR")
+        try:
+            if reverse:
+                end, start = parse_range_bound(args[1], is_start=False), parse_range_bound(args[2], is_start=True)
+            else:
+                start, end = parse_range_bound(args[1], is_start=True), parse_range_bound(args[2], is_start=False)
+        except StreamError as e:
+            return protocol.encode_simple_error(str(e), error_prefix="ERR")
+        stream = self._stream(args[0])
+        if type(stream) is bytes:
+            return stream
+        if stream is None:
+            return protocol.encode_array([])
+        entries = stream.reverse_range(end, start, count) if reverse else stream.range(start, end, count)
+        return protocol.encode_nested(_stream_entries(entries))
+
+    def _handle_xread(self, args: list) -> bytes | Awaitable[bytes]:
+        """XREAD [COUNT count] [BLOCK milliseconds] STREAMS key [key ...] id [id ...]"""
+        count = block = None
+        i = 0
+        while i < len(args) and args[i].upper() in ("COUNT", "BLOCK"):
+            option = args[i].upper()
+            if i + 1 == len(args):
+                return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+            try:
+                value = int(args[i + 1])
+            except ValueError:
+                what = "value" if option == "COUNT" else "timeout"
+                return protocol.encode_simple_error(f"{what} is not an integer or out of range", error_prefix="ERR")
+            if option == "COUNT":
+                count = max(value, 0) or None
+            elif value < 0:
+                return protocol.encode_simple_error("timeout is negative", error_prefix="ERR")
+            else:
+                block = value
+            i += 2
+        if i >= len(args) or args[i].upper() != "STREAMS":
+            return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+        rest = args[i + 1 :]
+        if not rest or len(rest) % 2:
+            return protocol.encode_simple_error(
+                "Unbalanced 'xread' list of streams: for each stream key an ID or '$' must be specified.",
+                error_prefix="ERR",
+            )
+        keys = rest[: len(rest) // 2]
+        ids = []
+        for key, spec in zip(keys, rest[len(rest) // 2 :], strict=True):
+            stream = self._stream(key)
+            if type(stream) is bytes:
+                return stream
+            if spec == "$":
+                # Only entries added from now on
+                ids.append(stream.last_id if stream is not None else (0, 0))
+                continue
+            try:
+                ids.append(parse_id(spec))
+            except StreamError as e:
+                return protocol.encode_simple_error(str(e), error_prefix="ERR")
+
+        reply = self._xread(keys, ids, count)
+        if reply or block is None:
+            return protocol.encode_nested(reply) if reply else protocol.NULL_ARRAY
+        return self._blocking_xread(keys, ids, count, block / 1000)
+
+    def _xread(self, keys: list[str], ids: list[tuple[int, int]], count: int | None) -> list:
+        reply = []
+        for key, last_seen in zip(keys, ids, strict=True):
+            stream = self._stream(key)
+            if stream is None or type(stream) is bytes:
+                continue
+            entries = stream.after(last_seen, count)
+            if entries:
+                reply.append([key, _stream_entries(entries)])
+        return reply
+
+    async def _blocking_xread(self, keys: list[str], ids: list, count: int | None, timeout: float) -> bytes:
+        """Waits for entries newer than `ids`, for up to `timeout` seconds (0 waits forever)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+        while True:
+            waiter = loop.create_future()
+            for key in keys:
+                self._stream_waiters.setdefault(key, set()).add(waiter)
+            try:
+                remaining = deadline - loop.time() if deadline is not None else None
+                await asyncio.wait_for(waiter, remaining)
+            except TimeoutError:
+                return protocol.NULL_ARRAY
+            finally:
+                for key in keys:
+                    waiters = self._stream_waiters.get(key)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            del self._stream_waiters[key]
+            reply = self._xread(keys, ids, count)
+            if reply:
+                return protocol.encode_nested(reply)
+
+    def _wake_stream_readers(self, key: str) -> None:
+        for waiter in self._stream_waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _stream(self, key: str) -> Stream | bytes | None:
+        """Returns the stream stored at `key`, None if there is none, or a wrong type error."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        if entry.value_type != DataType.STREAM:
+            return protocol.encode_simple_error("wrong type")
+        return entry.value
+
     def _handle_ping(self, args: list) -> bytes:
         if len(args) == 0:
             return protocol.encode_simple_string("PONG")
@@ -78,41 +625,306 @@ class DataStore:
         return protocol.encode_bulk_string(message)
 
     def _handle_set(self, args: list) -> bytes:
-        if len(args) not in (2, 4):
+        """SET key value [NX | XX] [GET] [EX seconds | PX milliseconds | KEEPTTL]"""
+        if len(args) < 2:
             return protocol.encode_simple_error("wrong number of arguments for 'set' command", error_prefix="ERR")
+        key, value = args[0], args[1]
         if len(args) == 2:
-            # if args == 2 => no expiry time is set => write only to _data not to _expiry
-            key, value = args
-            self._set(key, CacheValue(DataType.STRING, value))
-        elif len(args) == 4:
-            (key, value, expire_type, expire_value) = args
-            if expire_type in ("EX", "PX") and expire_value.isdigit():
-                ttl = 0
-                if expire_type == "EX":
-                    ttl = time.monotonic() + int(expire_value)
-                elif expire_type == "PX":
-                    ttl = time.monotonic() + (int(expire_value) / 1000)  # /1000 to get s from ms
-                self._set_expiry(key, ttl)
-                self._set(key, CacheValue(DataType.STRING, value))
+            entry = CacheValue(DataType.STRING, value)
+            self._set(key, entry)
+            if self._compressor is not None and self._compressor.active:
+                self._compressor.maybe_compress(key, entry)
+            if self._notify_classes:
+                self._notify("$", "set", key)
+            return protocol.encode_simple_string("OK")
+        condition = expiry = None
+        get = keepttl = False
+        expires_at = 0.0
+        options = iter(args[2:])
+        for option in options:
+            option = option.upper()
+            if option in ("NX", "XX") and condition is None:
+                condition = option
+            elif option == "GET":
+                get = True
+            elif option == "KEEPTTL" and expiry is None:
+                keepttl = True
+            elif option in ("EX", "PX") and expiry is None and not keepttl:
+                expiry = option
+                amount = next(options, None)
+                if amount is None:
+                    return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+                try:
+                    expires_at = expire_at(option, amount)
+                except ValueError:
+                    return protocol.encode_simple_error("invalid expire time in 'set' command", error_prefix="ERR")
             else:
-                return protocol.encode_simple_error("Incorrect args")
-        return protocol.encode_simple_string("OK")
+                return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+
+        current_expiry = self._get_expiry(key) if condition or get or keepttl else None
+        reply = protocol.encode_simple_string("OK")
+        if get:
+            old = self._get(key)
+            if old is None and current_expiry is not None:
+                return protocol.encode_simple_error("wrong type")
+            if type(old) is CompressedString:
+                old = self._compressor.decompress(old)
+            reply = protocol.encode_bulk_string(old)
+        if (condition == "NX" and current_expiry is not None) or (condition == "XX" and current_expiry is None):
+            return reply if get else protocol.encode_bulk_string(None)
+        if keepttl and current_expiry:
+            expires_at = current_expiry
+
+        entry = CacheValue(DataType.STRING, value, expires_at)
+        self._set(key, entry)
+        if self._compressor is not None and self._compressor.active:
+            self._compressor.maybe_compress(key, entry)
+        if self._notify_classes:
+            self._notify("$", "set", key)
+        return reply
 
     def _handle_get(self, args: list) -> bytes:
         if len(args) != 1:
             return protocol.encode_simple_error("wrong number of arguments for 'get' command", error_prefix="ERR")
+        return self._encode_string(self._get(args[0]))
+
+    def _handle_mget(self, args: list) -> bytes:
+        if not args:
+            return protocol.encode_simple_error("wrong number of arguments for 'mget' command", error_prefix="ERR")
+        values = []
+        for key in args:
+            value = self._get(key)
+            if type(value) is CompressedString:
+                value = self._compressor.decompress(value)
+            values.append(value)
+        return protocol.encode_array(values)
+
+    def _handle_mset(self, args: list) -> bytes:
+        if not args or len(args) % 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'mset' command", error_prefix="ERR")
+        compressor = self._compressor if self._compressor is not None and self._compressor.active else None
+        for key, value in zip(args[::2], args[1::2], strict=True):
+            entry = CacheValue(DataType.STRING, value)
+            self._set(key, entry)
+            if compressor is not None:
+                compressor.maybe_compress(key, entry)
+            if self._notify_classes:
+                self._notify("$", "set", key)
+        return protocol.encode_simple_string("OK")
+
+    def _handle_setbit(self, args: list) -> bytes:
+        if len(args) != 3:
+            return protocol.encode_simple_error("wrong number of arguments for 'setbit' command", error_prefix="ERR")
+        offset = _bit_offset(args[1])
+        if offset is None:
+            return protocol.encode_simple_error("bit offset is not an integer or out of range", error_prefix="ERR")
+        if args[2] not in ("0", "1"):
+            return protocol.encode_simple_error("bit is not an integer or out of range", error_prefix="ERR")
+        data = self._writable_bitmap(args[0])
+        if data is None:
+            return protocol.encode_simple_error("wrong type")
+        return protocol.encode_integer(bitmap.set_bit(data, offset, args[2] == "1"))
+
+    def _handle_getbit(self, args: list) -> bytes:
+        if len(args) != 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'getbit' command", error_prefix="ERR")
+        offset = _bit_offset(args[1])
+        if offset is None:
+            return protocol.encode_simple_error("bit offset is not an integer or out of range", error_prefix="ERR")
+        entry = self._lookup(args[0])
+        if entry is None:
+            return protocol.encode_integer(0)
+        if entry.value_type != DataType.STRING:
+            return protocol.encode_simple_error("wrong type")
+        return protocol.encode_integer(bitmap.get_bit(self._as_bytes(entry.value), offset))
+
+    def _handle_bitcount(self, args: list) -> bytes:
+        """BITCOUNT key [start end [BYTE | BIT]]"""
+        if len(args) not in (1, 3, 4):
+            return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+        entry = self._lookup(args[0])
+        if entry is None:
+            return protocol.encode_integer(0)
+        if entry.value_type != DataType.STRING:
+            return protocol.encode_simple_error("wrong type")
+        data = self._as_bytes(entry.value)
+        bit_range = _bit_range(len(data), args[1:3], args[3] if len(args) == 4 else "BYTE")
+        if type(bit_range) is bytes:
+            return bit_range
+        start_bit, end_bit = bit_range
+        if self._executor is not None and start_bit <= end_bit:
+            # The pool counts an immutable copy of just the bytes in range
+            first = start_bit >> 3
+            data = bytes(memoryview(data)[first : (end_bit >> 3) + 1])
+            start_bit, end_bit = start_bit - first * 8, end_bit - first * 8
+        return self._offload(len(data), bitmap.encode_bit_count, data, start_bit, end_bit)
+
+    def _handle_bitpos(self, args: list) -> bytes:
+        """BITPOS key bit [start [end [BYTE | BIT]]]"""
+        if not 2 <= len(args) <= 5:
+            return protocol.encode_simple_error("wrong number of arguments for 'bitpos' command", error_prefix="ERR")
+        if args[1] not in ("0", "1"):
+            return protocol.encode_simple_error("The bit argument must be 1 or 0.", error_prefix="ERR")
+        bit = int(args[1])
+        entry = self._lookup(args[0])
+        if entry is None:
+            return protocol.encode_integer(-1 if bit else 0)
+        if entry.value_type != DataType.STRING:
+            return protocol.encode_simple_error("wrong type")
+        data = self._as_bytes(entry.value)
+        bounds = args[2:4]
+        if len(bounds) == 1:
+            bounds = [bounds[0], "-1"]
+        bit_range = _bit_range(len(data), bounds, args[4] if len(args) == 5 else "BYTE")
+        if type(bit_range) is bytes:
+            return bit_range
+        if bit_range[0] > bit_range[1]:
+            # An empty range, e.g. a start past the end of the string
+            return protocol.encode_integer(-1)
+        position = bitmap.find_bit(data, bit, *bit_range)
+        if position == -1 and not bit and len(args) < 4:
+            # Without an explicit end, the string is considered to be padded with zeros on the right
+            position = max(bit_range[1] + 1, bit_range[0])
+        return protocol.encode_integer(position)
+
+    def _handle_bitop(self, args: list) -> bytes:
+        """BITOP AND | OR | XOR | NOT destkey key [key ...]"""
+        if len(args) < 3:
+            return protocol.encode_simple_error("wrong number of arguments for 'bitop' command", error_prefix="ERR")
+        operation, destination, keys = args[0].upper(), args[1], args[2:]
+        if operation not in ("AND", "OR", "XOR", "NOT"):
+            return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+        if operation == "NOT" and len(keys) != 1:
+            return protocol.encode_simple_error(
+                "BITOP NOT must be called with a single source key.", error_prefix="ERR"
+            )
+        values = []
+        for key in keys:
+            entry = self._lookup(key)
+            if entry is None:
+                values.append(b"")
+            elif entry.value_type != DataType.STRING:
+                return protocol.encode_simple_error("wrong type")
+            else:
+                values.append(self._as_bytes(entry.value))
+        result = bitmap.bit_op(operation, values)
+        if result:
+            self._set(destination, CacheValue(DataType.STRING, result))
+        else:
+            self._remove(destination, self._lazyfree)
+        return protocol.encode_integer(len(result))
+
+    def _as_bytes(self, value: str | bytearray | CompressedString) -> bytes | bytearray:
+        if type(value) is bytearray:
+            return value
+        if type(value) is CompressedString:
+            value = self._compressor.decompress(value)
+        return value.encode()
+
+    def _writable_bitmap(self, key: str) -> bytearray | None:
+        """Returns the key's value as a bytearray that can be changed in place, None if the key is not a string."""
+        entry = self._lookup(key)
+        if entry is None:
+            data = bytearray()
+            self._set(key, CacheValue(DataType.STRING, data))
+            return data
+        if entry.value_type != DataType.STRING:
+            return None
+        if type(entry.value) is bytearray:
+            return entry.value
+        # Switching to the bytearray encoding keeps the key's TTL
+        data = bytearray(self._as_bytes(entry.value))
+        self._set(key, CacheValue(DataType.STRING, data, entry.expires_at))
+        return data
+
+    def _handle_getex(self, args: list) -> bytes:
+        """GETEX key [EX seconds | PX milliseconds | PERSIST]"""
+        if not 1 <= len(args) <= 3:
+            return protocol.encode_simple_error("wrong number of arguments for 'getex' command", error_prefix="ERR")
         key = args[0]
-        # check _expiry
-        if key in self._expiry and time.monotonic() > self._expiry[key]:
-            logger.debug("PASSIVE EVICTION: deleting expired key %s", key)
-            del self._expiry[key]
-            del self._data[key]
+        option = args[1].upper() if len(args) > 1 else None
+        expected_args = {None: 1, "PERSIST": 2, "EX": 3, "PX": 3}.get(option)
+        if len(args) != expected_args:
+            return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+        expires_at = 0.0
+        if option in ("EX", "PX"):
+            try:
+                expires_at = expire_at(option, args[2])
+            except ValueError:
+                return protocol.encode_simple_error("invalid expire time in 'getex' command", error_prefix="ERR")
+
+        value = self._get(key)
+        if value is None:
+            if self._get_expiry(key) is not None:
+                return protocol.encode_simple_error("wrong type")
             return protocol.encode_bulk_string(None)
+        if option is not None:
+            self._set_expiry(key, expires_at)
+        return self._encode_string(value)
+
+    def _handle_expire(self, args: list) -> bytes:
+        return self._expire(args, "EX", "expire")
 
-        value: str | None = self._get(key)
+    def _handle_pexpire(self, args: list) -> bytes:
+        return self._expire(args, "PX", "pexpire")
+
+    def _expire(self, args: list, unit: str, name: str) -> bytes:
+        if len(args) != 2:
+            return protocol.encode_simple_error(f"wrong number of arguments for '{name}' command", error_prefix="ERR")
+        key = args[0]
+        try:
+            ttl = int(args[1])
+        except ValueError:
+            return protocol.encode_simple_error("value is not an integer or out of range", error_prefix="ERR")
+        if self._get_expiry(key) is None:
+            return protocol.encode_integer(0)
+        if ttl <= 0:
+            # A deadline in the past deletes the key right away
+            self._remove(key, self._lazyfree)
+            if self._notify_classes:
+                self._notify("g", "del", key)
+        else:
+            self._set_expiry(key, expire_at(unit, args[1]))
+        return protocol.encode_integer(1)
+
+    def _handle_ttl(self, args: list) -> bytes:
+        return self._ttl(args, 1, "ttl")
+
+    def _handle_pttl(self, args: list) -> bytes:
+        return self._ttl(args, 1000, "pttl")
+
+    def _ttl(self, args: list, scale: int, name: str) -> bytes:
+        if len(args) != 1:
+            return protocol.encode_simple_error(f"wrong number of arguments for '{name}' command", error_prefix="ERR")
+        expires_at = self._get_expiry(args[0])
+        if expires_at is None:
+            return protocol.encode_integer(-2)
+        if not expires_at:
+            return protocol.encode_integer(-1)
+        remaining = max(expires_at - time.monotonic(), 0.0)
+        return protocol.encode_integer(round(remaining * scale))
+
+    def _handle_persist(self, args: list) -> bytes:
+        if len(args) != 1:
+            return protocol.encode_simple_error("wrong number of arguments for 'persist' command", error_prefix="ERR")
+        key = args[0]
+        if not self._get_expiry(key):
+            return protocol.encode_integer(0)
+        self._set_expiry(key, 0.0)
+        return protocol.encode_integer(1)
+
+    def _encode_string(self, value: str | CompressedString | None) -> bytes | Awaitable[bytes]:
         if value is None:
             # RESP Null
             return protocol.encode_bulk_string(None)
+        elif type(value) is CompressedString:
+            # May be a future if the value is big enough to be decompressed off the event loop
+            return self._compressor.encode_reply(value)
+        elif self._executor is not None and len(value) >= self._executor.value_threshold:
+            if type(value) is bytearray:
+                # Bitmaps are modified in place, the pool gets a copy
+                value = bytes(value)
+            return self._executor.submit_value(len(value), protocol.encode_bulk_string, value)
         else:
             return protocol.encode_bulk_string(value)
 
@@ -121,14 +933,169 @@ class DataStore:
             return protocol.encode_simple_error("wrong number of arguments for 'del' command", error_prefix="ERR")
         deleted = 0
         for key in args:
-            if key in self._data:
-                del self._data[key]
+            if self._delete(key, self._lazyfree):
                 deleted += 1
+                if self._notify_classes:
+                    self._notify("g", "del", key)
         return protocol.encode_integer(deleted)
 
-    def process(self, command: list[str]) -> bytes:
+    def _handle_unlink(self, args: list) -> bytes:
+        if len(args) == 0:
+            return protocol.encode_simple_error("wrong number of arguments for 'unlink' command", error_prefix="ERR")
+        unlinked = 0
+        for key in args:
+            if self._delete(key, True):
+                unlinked += 1
+                if self._notify_classes:
+                    self._notify("g", "del", key)
+        return protocol.encode_integer(unlinked)
+
+    def _handle_hotkeys(self, args: list) -> bytes:
+        """HOTKEYS [count]: the most accessed keys with their estimated number of accesses."""
+        count = self._top_k_count(args, "hotkeys")
+        if type(count) is bytes:
+            return count
+        reply = []
+        for key, hits in self._keystats.hot.items()[:count]:
+            reply.extend((key, hits))
+        return protocol.encode_nested(reply)
+
+    def _handle_bigkeys(self, args: list) -> bytes:
+        """BIGKEYS [count]: the biggest keys seen by the sampling with their estimated size in bytes."""
+        count = self._top_k_count(args, "bigkeys")
+        if type(count) is bytes:
+            return count
+        keystats = self._keystats
+        # The sizes were taken when the keys were last sampled, refresh them
+        for key, _ in keystats.big.items():
+            entry = self._lookup(key)
+            if entry is None:
+                keystats.forget(key)
+            else:
+                keystats.record_size(key, self._memory_usage(key, entry, DEFAULT_SAMPLES))
+        reply = []
+        for key, size in keystats.big.items()[:count]:
+            reply.extend((key, size))
+        return protocol.encode_nested(reply)
+
+    def _top_k_count(self, args: list, name: str) -> int | bytes:
+        if len(args) > 1:
+            return protocol.encode_simple_error(f"wrong number of arguments for '{name}' command", error_prefix="ERR")
+        if not args:
+            return self._config.key_stats_top_k
+        try:
+            count = int(args[0])
+        except ValueError:
+            count = -1
+        if count < 0:
+            return protocol.encode_simple_error("value is out of range, must be positive", error_prefix="ERR")
+        return count
+
+    def _handle_memory(self, args: list) -> bytes:
+        """MEMORY USAGE key [SAMPLES count]"""
+        if not args:
+            return protocol.encode_simple_error("wrong number of arguments for 'memory' command", error_prefix="ERR")
+        if args[0].upper() != "USAGE":
+            return protocol.encode_simple_error(
+                f"unknown subcommand '{args[0]}' for 'memory' command", error_prefix="ERR"
+            )
+        if len(args) not in (2, 4):
+            return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+        samples = DEFAULT_SAMPLES
+        if len(args) == 4:
+            if args[2].upper() != "SAMPLES":
+                return protocol.encode_simple_error("syntax error", error_prefix="ERR")
+            try:
+                samples = int(args[3])
+            except ValueError:
+                samples = -1
+            if samples < 0:
+                return protocol.encode_simple_error("value is out of range, must be positive", error_prefix="ERR")
+        entry = self._lookup(args[1])
+        if entry is None:
+            return protocol.encode_bulk_string(None)
+        return protocol.encode_integer(self._memory_usage(args[1], entry, samples))
+
+    def _handle_publish(self, args: list) -> bytes:
+        if len(args) != 2:
+            return protocol.encode_simple_error("wrong number of arguments for 'publish' command", error_prefix="ERR")
+        return protocol.encode_integer(self.pubsub.publish(args[0], args[1]))
+
+    def _handle_info(self, args: list) -> bytes:
+        if len(args) > 1:
+            return protocol.encode_simple_error("wrong number of arguments for 'info' command", error_prefix="ERR")
+        sections = self._info_sections()
+        wanted = args[0].lower() if args else None
+        if wanted is not None and wanted not in sections:
+            return protocol.encode_bulk_string(None)
+        lines = []
+        for name, fields in sections.items():
+            if wanted is None or wanted == name:
+                lines.append(f"# {name.capitalize()}")
+                lines.extend(f"{field}:{value}" for field, value in fields().items())
+        return protocol.encode_bulk_string("\r\n".join(lines))
+
+    def _handle_config(self, args: list) -> bytes:
+        if not args:
+            return protocol.encode_simple_error("wrong number of arguments for 'config' command", error_prefix="ERR")
+        subcommand = args[0].upper()
+        config = self._config
+        if subcommand == "GET":
+            if len(args) != 2:
+                return protocol.encode_simple_error("wrong number of arguments for 'config|get' command")
+            pattern = args[1].lower()
+            reply = []
+            for name in config.names():
+                if fnmatchcase(name, pattern):
+                    reply.extend((name, config.get(name)))
+            return protocol.encode_array(reply)
+        if subcommand == "SET":
+            if len(args) < 3 or len(args) % 2 == 0:
+                return protocol.encode_simple_error("wrong number of arguments for 'config|set' command")
+            pairs = list(zip(args[1::2], args[2::2], strict=True))
+            try:
+                # All or nothing: check every pair before applying any of them
+                for name, value in pairs:
+                    config.validate(name, value)
+                for name, value in pairs:
+                    config.set(name, value)
+            except ConfigError as e:
+                return protocol.encode_simple_error(f"CONFIG SET failed: {e}")
+            return protocol.encode_simple_string("OK")
+        if subcommand == "REWRITE":
+            try:
+                config.rewrite()
+            except (ConfigError, OSError) as e:
+                return protocol.encode_simple_error(f"CONFIG REWRITE failed: {e}")
+            return protocol.encode_simple_string("OK")
+        return protocol.encode_simple_error(f"unknown subcommand '{args[0]}' for 'config' command")
+
+    def _info_sections(self) -> dict:
+        """Maps INFO section names to callables returning that section's fields."""
+        return {
+            "storage": lambda: {
+                "storage_engine": "dict",
+                "keys": str(len(self._data)),
+                "volatile_keys": str(len(self._volatile)),
+            },
+            "lazyfree": lambda: {
+                "lazyfree": "yes" if self._lazyfree else "no",
+                "lazyfree_pending_objects": str(self.lazyfree_pending()),
+            },
+            "compression": lambda: self._compressor.info() if self._compressor else {"compression_threshold": "off"},
+            "executor": lambda: self._executor.info() if self._executor else {"offload_pool": "none"},
+            "keystats": lambda: {
+                "key_stats_sample_rate": str(self._config.key_stats_sample_rate),
+                "key_stats_sampled": str(self._keystats.sampled),
+                "hot_keys_tracked": str(len(self._keystats.hot)),
+                "big_keys_tracked": str(len(self._keystats.big)),
+            },
+        }
+
+    def process(self, command: list[str]) -> bytes | Awaitable[bytes]:
         """
         Processes a parsed command and returns a RESP-formatted byte response.
+        Commands whose work is handed off the event loop return an awaitable resolving to the response instead.
         """
         if not command:
             return protocol.encode_simple_error("empty command", error_prefix="ERR")
@@ -136,34 +1103,179 @@ class DataStore:
         command_name = command[0].upper()
         args = command[1:]
 
-        if command_name in self._commands:
-            return self._commands[command_name](args)
-        else:
+        handler = self._commands.get(command_name)
+        if handler is None:
             return protocol.encode_simple_error(f"unknown command '{command_name}'", error_prefix="ERR")
+        response = handler(args)
+        # A countdown keeps the cost for the commands that aren't sampled to a decrement
+        self._key_sample_countdown -= 1
+        if not self._key_sample_countdown:
+            self._sample_keys(command_name, args)
+        return response
+
+    def _set_notify_keyspace_events(self, spec: str):
+        self._notify_keyspace, self._notify_keyevent, self._notify_classes = parse_notify_flags(spec)
+
+    def _notify(self, event_class: str, event: str, key: str):
+        """
+        Publishes a keyspace event if its class is enabled. Callers check `_notify_classes` first,
+        which keeps the cost with notifications off to an attribute lookup.
+        """
+        if event_class in self._notify_classes:
+            self.pubsub.publish_keyspace_event(event, key, self._notify_keyspace, self._notify_keyevent)
+
+    def _expired(self, key: str):
+        """Called after an expired key was deleted."""
+        if self._notify_classes:
+            self._notify("x", "expired", key)
+
+    def _set_key_stats_sample_rate(self, rate: int):
+        # A negative countdown never reaches 0, which disables sampling
+        self._key_sample_countdown = randint(1, rate) if rate > 0 else -1
+
+    def _sample_keys(self, command_name: str, args: list[str]):
+        rate = self._config.key_stats_sample_rate
+        # A random interval averaging `rate` keeps periodic traffic from dodging the sample
+        self._key_sample_countdown = randint(1, 2 * rate - 1)
+        if command_name in KEYLESS_COMMANDS:
+            return
+        keystats = self._keystats
+        read_only = command_name in READ_ONLY_COMMANDS
+        for key in args[KEY_ARGUMENTS.get(command_name, FIRST_ARGUMENT)]:
+            keystats.record_access(key, rate)
+            if read_only:
+                continue
+            entry = self._lookup(key)
+            if entry is None:
+                keystats.forget(key)
+            else:
+                keystats.record_size(key, self._memory_usage(key, entry, DEFAULT_SAMPLES))
+
+    def _memory_usage(self, key: str, entry: CacheValue, samples: int) -> int:
+        return ENTRY_BYTES + sys.getsizeof(key) + estimate_size(entry.value, samples)
+
+    def _set_lazyfree(self, enabled: bool):
+        self._lazyfree = enabled
+
+    def _offload(self, cost: int, fn, *args):
+        """Runs `fn(*args)` inline, or on the executor's pool if the command is expensive enough."""
+        if self._executor is None:
+            return fn(*args)
+        return self._executor.submit(cost, fn, *args)
 
-    def _set_expiry(self, key: str, ex: float):
-        self._expiry[key] = ex
+    def _key_count(self) -> int:
+        return len(self._data)
+
+    def _key_snapshot(self) -> KeySnapshot:
+        data = self._data
+        expiry = {key: data[key].expires_at for key in self._volatile}
+        return KeySnapshot(tuple(data), expiry, time.monotonic())
+
+    def _lookup(self, key: str) -> CacheValue | None:
+        """Returns the key's entry, deleting it instead if it has expired."""
+        entry = self._data.get(key)
+        if entry is not None and entry.expires_at and time.monotonic() > entry.expires_at:
+            logger.debug("PASSIVE EVICTION: deleting expired key %s", key)
+            self._remove(key, self._lazyfree)
+            self._expired(key)
+            return None
+        return entry
+
+    def _get_expiry(self, key: str) -> float | None:
+        """Returns the key's expiry deadline, 0.0 if it has no TTL, or None if the key does not exist."""
+        entry = self._lookup(key)
+        return entry.expires_at if entry is not None else None
+
+    def _set_expiry(self, key: str, ex: float) -> bool:
+        """Sets the key's expiry deadline, 0.0 removes its TTL. Returns False if the key does not exist."""
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        if ex:
+            self._volatile.add(key)
+        elif entry.expires_at:
+            self._volatile.discard(key)
+        entry.expires_at = ex
+        return True
 
     def _set(self, key: str, value: CacheValue):
+        """Stores `value` under `key`, replacing whatever was there including its TTL."""
+        old = self._data.get(key)
         self._data[key] = value
+        if value.expires_at:
+            self._volatile.add(key)
+        elif old is not None and old.expires_at:
+            self._volatile.discard(key)
+        if self._lazyfree and old is not None:
+            self._release(old)
+
+    def _delete(self, key: str, lazy: bool) -> bool:
+        """DEL and UNLINK: removes the key, unless it has already expired, it is then expired as on lookup."""
+        if self._get_expiry(key) is None:
+            return False
+        return self._remove(key, lazy)
+
+    def _remove(self, key: str, lazy: bool) -> bool:
+        """Detaches a key from the keyspace. Large values are queued for lazy freeing when `lazy` is set."""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        if entry.expires_at:
+            self._volatile.discard(key)
+        if lazy:
+            self._release(entry)
+        return True
+
+    def _release(self, entry: CacheValue):
+        """Queues a detached value for background freeing if dropping it inline would be expensive."""
+        if entry.value_type in (DataType.LIST, DataType.STREAM) and len(entry.value) > LAZYFREE_THRESHOLD:
+            self._lazyfree_pending.append(entry.value)
 
-    def _get(self, key: str) -> str | None:
+    def lazyfree_pending(self) -> int:
+        return len(self._lazyfree_pending)
+
+    def free_lazy(self, budget: int = LAZYFREE_BATCH_SIZE) -> int:
+        """
+        Releases up to `budget` elements of values waiting in the lazy-free queue, streams a whole
+        segment at a time. Returns the number of elements released.
+        """
+        pending = self._lazyfree_pending
+        freed = 0
+        while pending and freed < budget:
+            value = pending[0]
+            if type(value) is Stream:
+                while value and freed < budget:
+                    freed += value.release_segment()
+            else:
+                pop = value.pop
+                n = min(len(value), budget - freed)
+                for _ in range(n):
+                    pop()
+                freed += n
+            if not value:
+                pending.popleft()
+        return freed
+
+    def _get(self, key: str) -> str | CompressedString | None:
+        """Returns the key's string value, expiring the key first if its TTL has passed."""
         entry = self._data.get(key)
-        if entry is not None and entry.value_type != DataType.LIST:
-            return entry.value
-        return None
+        if entry is None or entry.value_type != DataType.STRING:
+            return None
+        if entry.expires_at and time.monotonic() > entry.expires_at:
+            logger.debug("PASSIVE EVICTION: deleting expired key %s", key)
+            self._remove(key, self._lazyfree)
+            self._expired(key)
+            return None
+        return entry.value
 
     def evict_expired_keys(self):
-        len_keys = len(self._expiry.keys())
-        if len_keys == 0:
+        if not self._volatile:
             return
-        sample_size = 10
-        keys_to_check = sample(list(self._expiry.keys()), sample_size)
-
         now = time.monotonic()
-        for key in keys_to_check:
-            expiry_time = self._expiry.get(key)
-            if expiry_time is not None and now > expiry_time:
+        data = self._data
+        for key in self._volatile.sample(self._config.active_expire_samples):
+            entry = data.get(key)
+            if entry is not None and now > entry.expires_at:
                 logger.debug("ACTIVE EVICTION: deleting expired key %s", key)
-                del self._expiry[key]
-                del self._data[key]
+                self._remove(key, self._lazyfree)
+                self._expired(key)
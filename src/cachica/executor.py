@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import re
+from collections.abc import Iterable
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from fnmatch import translate
+
+from cachica import protocol
+
+logger = logging.getLogger(__name__)
+
+# Commands estimated to touch at least this many elements (or bytes) run on the pool
+DEFAULT_COST_THRESHOLD = 10_000
+# Single values are only encoded on the pool from this many bytes: copying them is so cheap that
+# handing a smaller one over costs far more than encoding it inline
+DEFAULT_VALUE_THRESHOLD = 4 * 1024 * 1024
+
+
+@dataclass
+class ExecutorStats:
+    inline: int = 0
+    offloaded: int = 0
+
+
+class CommandExecutor:
+    """
+    Runs the expensive part of read-only commands on a thread or process pool.
+
+    Handlers estimate a command's cost and pass a function together with an immutable
+    snapshot of the data it needs. Cheap work runs inline and returns the response right
+    away; expensive work returns a future resolving to it, so the event loop keeps
+    serving other clients meanwhile. Functions and their arguments must be picklable
+    when a process pool is used.
+    """
+
+    def __init__(
+        self,
+        pool: Executor,
+        cost_threshold: int = DEFAULT_COST_THRESHOLD,
+        value_threshold: int = DEFAULT_VALUE_THRESHOLD,
+    ):
+        self._pool = pool
+        self.cost_threshold = cost_threshold
+        self.value_threshold = value_threshold
+        self.stats = ExecutorStats()
+
+    def submit(self, cost: int, fn, *args) -> bytes | asyncio.Future:
+        return self._run(cost >= self.cost_threshold, fn, args)
+
+    def submit_value(self, size: int, fn, *args) -> bytes | asyncio.Future:
+        """As `submit`, for encoding a single value of `size` bytes, e.g. a GET reply."""
+        return self._run(size >= self.value_threshold, fn, args)
+
+    def _run(self, expensive: bool, fn, args: tuple) -> bytes | asyncio.Future:
+        if expensive:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                self.stats.offloaded += 1
+                return loop.run_in_executor(self._pool, fn, *args)
+        self.stats.inline += 1
+        return fn(*args)
+
+    def info(self) -> dict[str, str]:
+        return {
+            "offload_pool": type(self._pool).__name__,
+            "offload_cost_threshold": str(self.cost_threshold),
+            "offload_value_threshold": str(self.value_threshold),
+            "commands_inline": str(self.stats.inline),
+            "commands_offloaded": str(self.stats.offloaded),
+        }
+
+
+def encode_matching_keys(pattern: str, keys: Iterable[str]) -> bytes:
+    """Encodes the keys matching a glob-style pattern as a RESP array."""
+    if pattern == "*":
+        return protocol.encode_array(list(keys))
+    match = re.compile(translate(pattern)).match
+    return protocol.encode_array(list(filter(match, keys)))
@@ -0,0 +1,179 @@
+"""
+Hot-key and big-key tracking. The datastore feeds a sample of the keys its commands touch in here:
+access counts go to a Count-Min sketch with the top keys kept aside, sizes to a top-k of their own.
+Both use a fixed amount of memory however many keys there are.
+"""
+
+import heapq
+import sys
+from array import array
+from collections import deque
+from itertools import islice
+
+from cachica.compression import CompressedString
+from cachica.probabilistic import HyperLogLog, ScalableBloomFilter
+from cachica.stream import Stream
+
+# Count-Min sketch dimensions: an estimate exceeds the true count by more than e/width of all
+# counted accesses with probability at most e**-depth
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+# Counters are halved after this many sampled accesses, so old traffic fades out
+DECAY_INTERVAL = 100_000
+# Default number of hot and big keys kept
+TOP_K = 32
+# Elements looked at to estimate the size of a container, as MEMORY USAGE's SAMPLES option
+DEFAULT_SAMPLES = 5
+# Rough cost of a key's slot in the keyspace dict: hash, key and value pointers plus the index
+DICT_ENTRY_BYTES = 32
+
+
+class CountMinSketch:
+    """Approximate counts of a stream of keys in depth x width counters. Never underestimates."""
+
+    __slots__ = ("width", "depth", "_rows")
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self._rows = [array("Q", bytes(8 * width)) for _ in range(depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Counts `key` and returns its new estimate."""
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        # Double hashing gives each row its own position from a single hash
+        position, step = h & 0xFFFFFFFF, (h >> 32) | 1
+        width = self.width
+        estimate = 1 << 64
+        for row in self._rows:
+            position = (position + step) % width
+            value = row[position] + count
+            row[position] = value
+            if value < estimate:
+                estimate = value
+        return estimate
+
+    def halve(self) -> None:
+        self._rows = [array("Q", (c >> 1 for c in row)) for row in self._rows]
+
+
+class TopK:
+    """
+    The k keys with the highest scores offered so far. The heap is only fixed up lazily: a raised score
+    leaves the key's entry behind until it surfaces at the top, a lowered one pushes a new entry and
+    the outdated one is dropped when it surfaces. The heap is rebuilt once those pile up.
+    """
+
+    __slots__ = ("k", "_scores", "_heap")
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self._scores: dict[str, int] = {}
+        self._heap: list[tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._scores
+
+    def offer(self, key: str, score: int) -> None:
+        scores = self._scores
+        current = scores.get(key)
+        if current is not None:
+            scores[key] = score
+            if score >= current:
+                return
+        elif len(scores) >= self.k:
+            minimum, weakest = self._minimum()
+            if score <= minimum:
+                return
+            heapq.heappop(self._heap)
+            del scores[weakest]
+            scores[key] = score
+        else:
+            scores[key] = score
+        heapq.heappush(self._heap, (score, key))
+        if len(self._heap) > 4 * self.k:
+            self._rebuild()
+
+    def discard(self, key: str) -> None:
+        if self._scores.pop(key, None) is not None:
+            self._rebuild()
+
+    def halve(self) -> None:
+        self._scores = {key: score >> 1 for key, score in self._scores.items()}
+        self._rebuild()
+
+    def items(self) -> list[tuple[str, int]]:
+        """(key, score) pairs, highest score first."""
+        return sorted(self._scores.items(), key=lambda item: item[1], reverse=True)
+
+    def _minimum(self) -> tuple[int, str]:
+        heap, scores = self._heap, self._scores
+        while True:
+            score, key = heap[0]
+            current = scores.get(key)
+            if current == score:
+                return heap[0]
+            if current is None or current < score:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (current, key))
+
+    def _rebuild(self) -> None:
+        self._heap = [(score, key) for key, score in self._scores.items()]
+        heapq.heapify(self._heap)
+
+
+class KeyStats:
+    """Hot keys by sampled access count and big keys by estimated size."""
+
+    def __init__(self, k: int = TOP_K, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH):
+        self._sketch = CountMinSketch(width, depth)
+        self.hot = TopK(k)
+        self.big = TopK(k)
+        self.sampled = 0
+
+    def record_access(self, key: str, weight: int = 1) -> None:
+        """Counts a sampled access. `weight` is the sample rate, so counts estimate the real number of accesses."""
+        self.hot.offer(key, self._sketch.add(key, weight))
+        self.sampled += 1
+        if self.sampled % DECAY_INTERVAL == 0:
+            self._sketch.halve()
+            self.hot.halve()
+
+    def record_size(self, key: str, size: int) -> None:
+        self.big.offer(key, size)
+
+    def forget(self, key: str) -> None:
+        """Drops a key that no longer exists from the big keys."""
+        self.big.discard(key)
+
+
+def estimate_size(value, samples: int = DEFAULT_SAMPLES) -> int:
+    """
+    Estimates the bytes a value takes. Containers are not walked: the size of up to `samples` of their
+    elements is extrapolated, 0 walks them all.
+    """
+    if type(value) is deque:
+        elements = islice(value, samples) if samples else value
+        return sys.getsizeof(value) + _sampled_size(elements, len(value), sys.getsizeof)
+    if type(value) is CompressedString:
+        return sys.getsizeof(value) + sys.getsizeof(value.payload)
+    if type(value) is Stream:
+        fields = _sampled_size(value.sample_fields(samples), len(value), _fields_size)
+        return sys.getsizeof(value) + value.nbytes + fields
+    if type(value) in (HyperLogLog, ScalableBloomFilter):
+        return sys.getsizeof(value) + value.nbytes
+    return sys.getsizeof(value)
+
+
+def _sampled_size(elements, length: int, size_of) -> int:
+    """Extrapolates the total size of `length` elements from the sampled `elements`."""
+    sizes = [size_of(element) for element in elements]
+    return sum(sizes) * length // len(sizes) if sizes else 0
+
+
+def _fields_size(fields: tuple[str, ...]) -> int:
+    return sys.getsizeof(fields) + sum(map(sys.getsizeof, fields))
@@ -0,0 +1,260 @@
+import hashlib
+import math
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable
+
+# HyperLogLog: 2**14 registers give a standard error of 1.04 / sqrt(16384) = 0.81%
+HLL_P = 14
+HLL_REGISTERS = 1 << HLL_P
+HLL_MASK = HLL_REGISTERS - 1
+HLL_RANK_BITS = 64 - HLL_P
+# Sparse HLLs hold at most this many (register, rank) pairs, 4 bytes each, before turning dense
+HLL_SPARSE_MAX = 1024
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+# LogLog-Beta bias correction for 2**14 registers (Qin et al., 2016): a polynomial in the number of
+# empty registers that replaces HyperLogLog's switch to linear counting and its bias around the switch
+HLL_BETA = (-0.370393911, 0.070471823, 0.17393686, 0.16339839, -0.09237745, 0.03738027, -0.005384159, 0.00042419)
+
+# Scalable Bloom filters start with a filter for this many items and add bigger ones as they fill
+BLOOM_ERROR_RATE = 0.01
+BLOOM_CAPACITY = 100
+BLOOM_EXPANSION = 2
+# Each added filter gets this fraction of the previous one's error rate, the first one gets
+# (1 - BLOOM_TIGHTENING) of the total: the error rates then add up to less than the total
+BLOOM_TIGHTENING = 0.5
+# In smaller filters too many items map to all the bit positions of an item added before
+BLOOM_MIN_BITS = 1024
+# BF.RESERVE refuses filters bigger than this
+BLOOM_MAX_BYTES = 128 * 1024 * 1024
+
+
+def _hll_hash(item: str) -> tuple[int, int]:
+    """Returns the register an item maps to and its rank. The keyspace is never persisted, so hash() will do."""
+    h = hash(item) & 0xFFFFFFFFFFFFFFFF
+    w = h >> HLL_P
+    # Position of the lowest set bit in the remaining bits, 1 based
+    rank = (w & -w).bit_length() if w else HLL_RANK_BITS + 1
+    return h & HLL_MASK, rank
+
+
+class HyperLogLog:
+    """
+    Cardinality estimator. Starts sparse, as a sorted array of packed (register << 6 | rank) pairs, and
+    switches to one byte per register once more than HLL_SPARSE_MAX registers are set.
+    """
+
+    __slots__ = ("_sparse", "_dense", "_cached")
+
+    def __init__(self):
+        self._sparse: array | None = array("I")
+        self._dense: bytearray | None = None
+        self._cached: int | None = 0
+
+    @property
+    def encoding(self) -> str:
+        return "sparse" if self._sparse is not None else "dense"
+
+    @property
+    def nbytes(self) -> int:
+        if self._sparse is not None:
+            return len(self._sparse) * self._sparse.itemsize
+        return len(self._dense)
+
+    def add(self, items: Iterable[str]) -> bool:
+        """Adds the items, returns whether any register changed."""
+        changed = False
+        for item in items:
+            index, rank = _hll_hash(item)
+            if self._update(index, rank):
+                changed = True
+        if changed:
+            self._cached = None
+        return changed
+
+    def count(self) -> int:
+        if self._cached is None:
+            self._cached = self._estimate()
+        return self._cached
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Makes this HLL count the union of both."""
+        if other._sparse is not None:
+            for packed in other._sparse:
+                self._update(packed >> 6, packed & 63)
+        else:
+            self._to_dense()
+            self._dense = bytearray(map(max, self._dense, other._dense))
+        self._cached = None
+
+    def copy(self) -> "HyperLogLog":
+        clone = HyperLogLog()
+        clone._sparse = array("I", self._sparse) if self._sparse is not None else None
+        clone._dense = bytearray(self._dense) if self._dense is not None else None
+        clone._cached = self._cached
+        return clone
+
+    def _update(self, index: int, rank: int) -> bool:
+        dense = self._dense
+        if dense is not None:
+            if rank > dense[index]:
+                dense[index] = rank
+                return True
+            return False
+        sparse = self._sparse
+        i = bisect_left(sparse, index << 6)
+        if i < len(sparse) and sparse[i] >> 6 == index:
+            if rank <= sparse[i] & 63:
+                return False
+            sparse[i] = index << 6 | rank
+            return True
+        sparse.insert(i, index << 6 | rank)
+        if len(sparse) > HLL_SPARSE_MAX:
+            self._to_dense()
+        return True
+
+    def _to_dense(self) -> None:
+        if self._dense is not None:
+            return
+        dense = bytearray(HLL_REGISTERS)
+        for packed in self._sparse:
+            dense[packed >> 6] = packed & 63
+        self._dense, self._sparse = dense, None
+
+    def _estimate(self) -> int:
+        if self._sparse is not None:
+            zeros = HLL_REGISTERS - len(self._sparse)
+            inverse_sum = zeros + sum(2.0 ** -(packed & 63) for packed in self._sparse)
+        else:
+            # A histogram of the register values, counted at C speed
+            histogram = [self._dense.count(rank) for rank in range(HLL_RANK_BITS + 2)]
+            zeros = histogram[0]
+            inverse_sum = sum(n * 2.0**-rank for rank, n in enumerate(histogram) if n)
+        if zeros:
+            zl = math.log(zeros + 1)
+            beta = HLL_BETA[0] * zeros + sum(b * zl**i for i, b in enumerate(HLL_BETA[1:], 1))
+        else:
+            beta = 0.0
+        return round(HLL_ALPHA * HLL_REGISTERS * (HLL_REGISTERS - zeros) / (inverse_sum + beta))
+
+
+def _bloom_hashes(item: str) -> tuple[int, int, int]:
+    # Triple rather than double hashing: two items sharing h1 and h2 modulo the filter size would share
+    # all their bit positions, which is as likely as the tighter filters' false positives
+    digest = hashlib.blake2b(item.encode(), digest_size=24).digest()
+    return (
+        int.from_bytes(digest[:8], "little"),
+        int.from_bytes(digest[8:16], "little"),
+        int.from_bytes(digest[16:], "little"),
+    )
+
+
+def _bloom_dimensions(capacity: int, error_rate: float) -> tuple[int, int]:
+    """
+    Returns the (size in bits, number of hashes) of a filter holding `capacity` items at `error_rate`.
+    The size is the exact one for a whole number of hashes, (1 - e**(-hashes * capacity / size)) ** hashes
+    is the error rate, rounded up to a power of two: a filter's actual rate varies around that one,
+    the spare bits keep it below.
+    """
+    hashes = max(1, round(-math.log2(error_rate)))
+    bits = math.ceil(-hashes * capacity / math.log1p(-(error_rate ** (1 / hashes))))
+    return max(BLOOM_MIN_BITS, 1 << (bits - 1).bit_length()), hashes
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter holding `capacity` items at `error_rate`, using triple hashing."""
+
+    __slots__ = ("capacity", "error_rate", "count", "_bits", "_mask", "_hashes")
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+        size, self._hashes = _bloom_dimensions(capacity, error_rate)
+        self._mask = size - 1
+        self._bits = bytearray(size // 8)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def contains(self, h1: int, h2: int, h3: int) -> bool:
+        bits, mask = self._bits, self._mask
+        # Position i is h1 + i * h2 + i * i * h3, computed with additions on small ints
+        position, step, curve = h1 & mask, (h2 + h3) & mask, (2 * h3) & mask
+        for _ in range(self._hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position = (position + step) & mask
+            step = (step + curve) & mask
+        return True
+
+    def add(self, h1: int, h2: int, h3: int) -> None:
+        bits, mask = self._bits, self._mask
+        position, step, curve = h1 & mask, (h2 + h3) & mask, (2 * h3) & mask
+        for _ in range(self._hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+            position = (position + step) & mask
+            step = (step + curve) & mask
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filter that grows: once the newest filter holds its capacity, a bigger one with a tighter
+    error rate is added, so the overall false positive rate stays below `error_rate`.
+    """
+
+    __slots__ = ("error_rate", "expansion", "_filters")
+
+    def __init__(
+        self, error_rate: float = BLOOM_ERROR_RATE, capacity: int = BLOOM_CAPACITY, expansion: int = BLOOM_EXPANSION
+    ):
+        if not 0 < error_rate < 1:
+            raise ValueError("error rate must be between 0 and 1")
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        if _bloom_dimensions(capacity, error_rate * (1 - BLOOM_TIGHTENING))[0] // 8 > BLOOM_MAX_BYTES:
+            raise ValueError(f"capacity too large for the error rate, the filter would exceed {BLOOM_MAX_BYTES} bytes")
+        self.error_rate = error_rate
+        self.expansion = expansion
+        self._filters = [BloomFilter(capacity, error_rate * (1 - BLOOM_TIGHTENING))]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(f.nbytes for f in self._filters)
+
+    @property
+    def count(self) -> int:
+        return sum(f.count for f in self._filters)
+
+    @property
+    def capacity(self) -> int:
+        return sum(f.capacity for f in self._filters)
+
+    @property
+    def filters(self) -> int:
+        return len(self._filters)
+
+    def add(self, items: Iterable[str]) -> list[bool]:
+        """Adds the items, returns for each whether it was new (i.e. not possibly seen before)."""
+        added = []
+        for item in items:
+            hashes = _bloom_hashes(item)
+            if self._contains(*hashes):
+                added.append(False)
+                continue
+            current = self._filters[-1]
+            if current.count >= current.capacity:
+                current = BloomFilter(current.capacity * self.expansion, current.error_rate * BLOOM_TIGHTENING)
+                self._filters.append(current)
+            current.add(*hashes)
+            added.append(True)
+        return added
+
+    def contains(self, items: Iterable[str]) -> list[bool]:
+        return [self._contains(*_bloom_hashes(item)) for item in items]
+
+    def _contains(self, h1: int, h2: int, h3: int) -> bool:
+        # Newest first: it is the biggest and holds the most recent items
+        return any(f.contains(h1, h2, h3) for f in reversed(self._filters))
@@ -3,12 +3,18 @@ from collections import deque
 
 CRLF = b"\r\n"  # Standard RESP terminator
 CRLF_LEN = 2
+NULL_BULK_STRING = b"$-1\r\n"
+NULL_ARRAY = b"*-1\r\n"
 
 
 class ProtocolError(Exception):
     pass
 
 
+class ResponseError(Exception):
+    """An error reply sent by the server, e.g. "ERR wrong type"."""
+
+
 class Parser:
     """A synchronous, stateful RESP parser."""
 
@@ -18,13 +24,26 @@ class Parser:
         self._commands = deque()
         self._try_parse = self._try_parse_client if self._is_client else self._try_parse_server
 
+    @property
+    def buffered(self) -> int:
+        """Number of received bytes not yet parsed into a command."""
+        return len(self._buffer)
+
     def feed(self, data: bytes) -> None:
         """Adds raw network data to the internal buffer."""
         self._buffer.extend(data)
         self._try_parse()
 
+    @property
+    def ready(self) -> int:
+        """Number of fully parsed commands (replies, for client parsers) waiting to be taken."""
+        return len(self._commands)
+
     def get_command(self) -> list[str] | None:
-        """Returns a fully parsed command, or None if none are ready."""
+        """
+        Returns a fully parsed command, or None if none are ready.
+        Client parsers also return None for null replies, check `ready` first to tell them apart.
+        """
         if self._commands:
             return self._commands.popleft()
         return None
@@ -41,12 +60,18 @@ class Parser:
 
             first_byte = self._buffer[0:1]
             match bytes(first_byte):
+                case b"*" if self._buffer.startswith(NULL_ARRAY):
+                    self._commands.append(None)
+                    self._buffer = self._buffer[len(NULL_ARRAY) :]
                 case b"*":
                     command, consumed_bytes = self._parse_array(self._buffer)
                     if command is None:
                         break
                     self._commands.append(command)
                     self._buffer = self._buffer[consumed_bytes:]
+                case b"$" if self._buffer.startswith(NULL_BULK_STRING):
+                    self._commands.append(None)
+                    self._buffer = self._buffer[len(NULL_BULK_STRING) :]
                 case b"$":  # Bulk string
                     parsed_bulk_string, consumed_bytes = self._parse_bulk_string(self._buffer)
                     if parsed_bulk_string is None:
@@ -63,14 +88,16 @@ class Parser:
                     parsed_simple_error, consumed_bytes = self._parse_simple_error(self._buffer)
                     if parsed_simple_error is None:
                         break
-                    self._commands.append(parsed_simple_error)
+                    self._commands.append(ResponseError(parsed_simple_error))
                     self._buffer = self._buffer[consumed_bytes:]
                 case b":":  # Integer
-                    parsed_integer, consumed_bytes = self._parse_simple_error(self._buffer)
+                    parsed_integer, consumed_bytes = self._parse_integer(self._buffer)
                     if parsed_integer is None:
                         break
-                    self._commands.append(parsed_integer)
+                    self._commands.append(int(parsed_integer))
                     self._buffer = self._buffer[consumed_bytes:]
+                case _:
+                    raise ProtocolError(f"Unsupported reply type: {bytes(first_byte)!r}")
 
     def _try_parse_server(self):
         """
@@ -128,6 +155,27 @@ class Parser:
         current_pos = first_crlf_pos + crlf_len
 
         for _ in range(array_len):
+            if self._is_client and buffer.startswith(NULL_BULK_STRING, current_pos):
+                # Replies like MGET's hold nulls for missing keys
+                command_parts.append(None)
+                current_pos += len(NULL_BULK_STRING)
+                continue
+            if self._is_client and buffer.startswith(b"*", current_pos):
+                # Nested arrays, e.g. XRANGE's entries
+                element, consumed = self._parse_array(buffer[current_pos:])
+                if element is None:
+                    return None, 0
+                command_parts.append(element)
+                current_pos += consumed
+                continue
+            if self._is_client and buffer.startswith(b":", current_pos):
+                # Replies like BF.MADD's are arrays of integers
+                element, consumed = self._parse_integer(buffer[current_pos:])
+                if element is None:
+                    return None, 0
+                command_parts.append(int(element))
+                current_pos += consumed
+                continue
             # Try to parse one bulk string for each element in the array.
             element, consumed = self._parse_bulk_string(buffer[current_pos:])
             if element is None:
@@ -140,7 +188,7 @@ class Parser:
         # If we get here, the full command was parsed successfully.
         return command_parts, current_pos
 
-    def _parse_bulk_string(self, buffer: bytearray) -> tuple[str | None, int]:
+    def _parse_bulk_string(self, buffer: bytearray) -> tuple[str | bytes | None, int]:
         """
         Parses a single RESP Bulk String.
         Returns the string and the number of bytes consumed.
@@ -151,12 +199,18 @@ class Parser:
         if first_crlf_pos == -1:
             return None, 0
 
+        if buffer[0] != 36:  # b"$"
+            # Requests only hold bulk strings, other types are only allowed in replies
+            raise ProtocolError(f"Expected a bulk string, got {bytes(buffer[:first_crlf_pos])!r}")
         line = buffer[1:first_crlf_pos]
 
         try:
             str_len = int(line)
         except ValueError:
             raise ProtocolError(f"Invalid bulk string length: {line!r}") from None
+        if str_len < 0:
+            # Null bulk strings are only valid in replies, where they are handled before getting here
+            raise ProtocolError(f"Invalid bulk string length: {line!r}")
 
         # The bulk string data starts after the CRLF of its length prefix
         str_start = first_crlf_pos + crlf_len
@@ -167,7 +221,13 @@ class Parser:
             return None, 0
 
         # Extract the bulk string and decode it
-        bulk_str = buffer[str_start:str_end].decode("utf-8")
+        try:
+            bulk_str = buffer[str_start:str_end].decode("utf-8")
+        except UnicodeDecodeError:
+            if not self._is_client:
+                raise
+            # Binary values, e.g. bitmaps, are returned as they are
+            bulk_str = bytes(buffer[str_start:str_end])
 
         # Total bytes consumed is the end of the string + its final CRLF
         consumed_bytes = str_end + crlf_len
@@ -180,7 +240,7 @@ class Parser:
             return None, 0
 
         sstring = buffer[1:first_crlf_pos].decode("utf-8")
-        return sstring, len(sstring) + CRLF_LEN + 1
+        return sstring, first_crlf_pos + CRLF_LEN
 
     def _parse_simple_error(self, buffer: bytearray) -> tuple[str | None, int]:
         first_crlf_pos = buffer.find(CRLF)
@@ -188,7 +248,7 @@ class Parser:
             return None, 0
 
         serror = buffer[1:first_crlf_pos].decode("utf-8")
-        return serror, len(serror) + CRLF_LEN + 1
+        return serror, first_crlf_pos + CRLF_LEN
 
     def _parse_integer(self, buffer: bytearray) -> tuple[str | None, int]:
         first_crlf_pos = buffer.find(CRLF)
@@ -196,29 +256,67 @@ class Parser:
             return None, 0
 
         parsed_int = buffer[1:first_crlf_pos].decode("utf-8")
-        return parsed_int, len(parsed_int) + CRLF_LEN + 1
+        return parsed_int, first_crlf_pos + CRLF_LEN
 
 
 def encode_simple_string(string: str) -> bytes:
     return f"+{string}\r\n".encode()
 
 
-def encode_bulk_string(string: str | None) -> bytes:
+def encode_bulk_string(string: str | bytes | bytearray | None) -> bytes:
     if not string:
         return b"$-1\r\n"
-    return f"${len(string)}\r\n{string}\r\n".encode()
+    if type(string) is not str:
+        return b"$%d\r\n%b\r\n" % (len(string), string)
+    out = f"${len(string)}\r\n{string}\r\n"
+    encoded = out.encode()
+    if len(encoded) != len(out):
+        # Non-ASCII: the length has to count bytes, not characters
+        return _encode_array_element(string)
+    return encoded
 
 
 def encode_integer(integer: int) -> bytes:
     return f":{integer}\r\n".encode()
 
 
+def encode_integer_array(integers: list[int]) -> bytes:
+    return b"*%d\r\n" % len(integers) + b"".join(b":%d\r\n" % integer for integer in integers)
+
+
 def encode_simple_error(error_message, error_prefix="ERR") -> bytes:
     return f"-{error_prefix} {error_message}\r\n".encode()
 
 
-def encode_array(strings: list[str]):
+def encode_array(strings: list[str | bytes | bytearray | None]):
     out = f"*{len(strings)}\r\n"
-    for string in strings:
+    for i, string in enumerate(strings):
+        if string is None:
+            out += "$-1\r\n"
+            continue
+        if type(string) is not str:
+            # Binary values (e.g. bitmaps) can't be formatted into a str, encode the rest element by element
+            return out.encode() + b"".join(_encode_array_element(element) for element in strings[i:])
         out += f"${len(string)}\r\n{string}\r\n"
-    return out.encode()
+    encoded = out.encode()
+    if len(encoded) != len(out):
+        # Non-ASCII strings: the lengths have to count bytes, not characters
+        return b"*%d\r\n" % len(strings) + b"".join(map(_encode_array_element, strings))
+    return encoded
+
+
+def encode_nested(value) -> bytes:
+    """Encodes nested lists/tuples of strings, bytes, integers and Nones (null bulk strings) as RESP arrays."""
+    if type(value) is list or type(value) is tuple:
+        return b"*%d\r\n" % len(value) + b"".join(map(encode_nested, value))
+    if type(value) is int:
+        return b":%d\r\n" % value
+    return _encode_array_element(value)
+
+
+def _encode_array_element(element: str | bytes | bytearray | None) -> bytes:
+    if element is None:
+        return b"$-1\r\n"
+    if type(element) is str:
+        element = element.encode()
+    return b"$%d\r\n%b\r\n" % (len(element), element)
@@ -0,0 +1,177 @@
+"""
+Publish/subscribe and keyspace notifications.
+
+Messages are not written to subscribers as they are published. They are queued per subscriber and
+written once per event loop iteration, so a burst of notifications (e.g. an active expiry cycle
+deleting thousands of keys) costs every subscriber one write instead of one per message.
+"""
+
+import asyncio
+import logging
+from asyncio import StreamWriter
+from fnmatch import fnmatchcase
+
+from cachica import protocol
+
+logger = logging.getLogger(__name__)
+
+KEYSPACE_PREFIX = "__keyspace@0__:"
+KEYEVENT_PREFIX = "__keyevent@0__:"
+# Keyspace event classes, as in Redis' notify-keyspace-events: generic (del), string (set),
+# list (lpush), expired and evicted. "A" enables all of them, "K" and "E" pick the channels.
+EVENT_CLASSES = "g$lxe"
+# Subscribers with more unsent bytes than this are disconnected rather than buffered without bound
+PUBSUB_OUTPUT_LIMIT = 32 * 1024 * 1024
+
+SUBSCRIPTION_COMMANDS = frozenset(("SUBSCRIBE", "UNSUBSCRIBE", "PSUBSCRIBE", "PUNSUBSCRIBE"))
+# Commands a connection with subscriptions may still send
+SUBSCRIBED_COMMANDS = SUBSCRIPTION_COMMANDS | {"PING"}
+
+
+def parse_notify_flags(spec: str) -> tuple[bool, bool, frozenset[str]]:
+    """
+    Parses notify-keyspace-events flags into (keyspace, keyevent, event classes).
+    No classes are enabled unless at least one of the keyspace (K) or keyevent (E) channels is.
+    """
+    flags = set()
+    for flag in spec:
+        if flag == "A":
+            flags.update(EVENT_CLASSES)
+        elif flag in "KE" or flag in EVENT_CLASSES:
+            flags.add(flag)
+        else:
+            raise ValueError(f"invalid keyspace event flag {flag!r}, expected some of 'KEg$lxeA'")
+    keyspace, keyevent = "K" in flags, "E" in flags
+    classes = frozenset(flags.intersection(EVENT_CLASSES)) if keyspace or keyevent else frozenset()
+    return keyspace, keyevent, classes
+
+
+class Subscriber:
+    """A client connection's subscriptions and the messages waiting to be written to it."""
+
+    __slots__ = ("writer", "channels", "patterns", "pending")
+
+    def __init__(self, writer: StreamWriter):
+        self.writer = writer
+        self.channels: set[str] = set()
+        self.patterns: set[str] = set()
+        self.pending: list[bytes] = []
+
+    @property
+    def subscriptions(self) -> int:
+        return len(self.channels) + len(self.patterns)
+
+
+class PubSub:
+    def __init__(self):
+        self._channels: dict[str, set[Subscriber]] = {}
+        self._patterns: dict[str, set[Subscriber]] = {}
+        # Subscribers with pending messages, written out at the end of the loop iteration
+        self._dirty: list[Subscriber] = []
+
+    def handle(self, subscriber: Subscriber, command_name: str, args: list[str]) -> bytes:
+        """Runs one of SUBSCRIPTION_COMMANDS for the subscriber's connection."""
+        if command_name == "SUBSCRIBE":
+            if not args:
+                return protocol.encode_simple_error(
+                    "wrong number of arguments for 'subscribe' command", error_prefix="ERR"
+                )
+            return self._subscribe(subscriber, args, subscriber.channels, self._channels, "subscribe")
+        if command_name == "PSUBSCRIBE":
+            if not args:
+                return protocol.encode_simple_error(
+                    "wrong number of arguments for 'psubscribe' command", error_prefix="ERR"
+                )
+            return self._subscribe(subscriber, args, subscriber.patterns, self._patterns, "psubscribe")
+        if command_name == "UNSUBSCRIBE":
+            return self._unsubscribe(subscriber, args, subscriber.channels, self._channels, "unsubscribe")
+        return self._unsubscribe(subscriber, args, subscriber.patterns, self._patterns, "punsubscribe")
+
+    def remove(self, subscriber: Subscriber) -> None:
+        """Drops all of a disconnected subscriber's subscriptions."""
+        for name in subscriber.channels:
+            self._leave(self._channels, name, subscriber)
+        for pattern in subscriber.patterns:
+            self._leave(self._patterns, pattern, subscriber)
+        subscriber.channels.clear()
+        subscriber.patterns.clear()
+
+    def publish(self, channel: str, message: str) -> int:
+        """Queues the message for the channel's subscribers, returns how many will receive it."""
+        receivers = 0
+        subscribers = self._channels.get(channel)
+        if subscribers:
+            payload = protocol.encode_nested(["message", channel, message])
+            for subscriber in subscribers:
+                self._deliver(subscriber, payload)
+            receivers = len(subscribers)
+        for pattern, subscribers in self._patterns.items():
+            if fnmatchcase(channel, pattern):
+                payload = protocol.encode_nested(["pmessage", pattern, channel, message])
+                for subscriber in subscribers:
+                    self._deliver(subscriber, payload)
+                receivers += len(subscribers)
+        return receivers
+
+    def publish_keyspace_event(self, event: str, key: str, keyspace: bool, keyevent: bool) -> None:
+        if not self._channels and not self._patterns:
+            return
+        if keyspace:
+            self.publish(KEYSPACE_PREFIX + key, event)
+        if keyevent:
+            self.publish(KEYEVENT_PREFIX + event, key)
+
+    def _subscribe(
+        self, subscriber: Subscriber, names: list[str], joined: set[str], registry: dict, kind: str
+    ) -> bytes:
+        replies = []
+        for name in names:
+            if name not in joined:
+                joined.add(name)
+                registry.setdefault(name, set()).add(subscriber)
+            replies.append(protocol.encode_nested([kind, name, subscriber.subscriptions]))
+        return b"".join(replies)
+
+    def _unsubscribe(
+        self, subscriber: Subscriber, names: list[str], joined: set[str], registry: dict, kind: str
+    ) -> bytes:
+        if not names:
+            if not joined:
+                return protocol.encode_nested([kind, None, subscriber.subscriptions])
+            names = list(joined)
+        replies = []
+        for name in names:
+            if name in joined:
+                joined.discard(name)
+                self._leave(registry, name, subscriber)
+            replies.append(protocol.encode_nested([kind, name, subscriber.subscriptions]))
+        return b"".join(replies)
+
+    @staticmethod
+    def _leave(registry: dict[str, set[Subscriber]], name: str, subscriber: Subscriber) -> None:
+        subscribers = registry.get(name)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del registry[name]
+
+    def _deliver(self, subscriber: Subscriber, payload: bytes) -> None:
+        if not subscriber.pending:
+            if not self._dirty:
+                asyncio.get_running_loop().call_soon(self._flush)
+            self._dirty.append(subscriber)
+        subscriber.pending.append(payload)
+
+    def _flush(self) -> None:
+        dirty, self._dirty = self._dirty, []
+        for subscriber in dirty:
+            data = b"".join(subscriber.pending)
+            subscriber.pending.clear()
+            writer = subscriber.writer
+            if writer.is_closing():
+                continue
+            if writer.transport.get_write_buffer_size() > PUBSUB_OUTPUT_LIMIT:
+                logger.warning("Disconnecting a subscriber that isn't reading its messages")
+                writer.close()
+                continue
+            writer.write(data)
@@ -1,38 +1,94 @@
-import os
-from dotenv import load_dotenv
-load_dotenv()
-import uvloop
 import asyncio
 import functools
+import itertools
 import logging
-import logging.config
+import os
+import socket
+import stat
+import sys
 from asyncio import StreamReader, StreamWriter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from cachica.config import get_logging_config
-from cachica.datastore import DataStore
-from cachica.protocol import Parser, ProtocolError
+import uvloop
+from dotenv import load_dotenv
 
-# --- LOGGING CONFIG ---
-log_level_from_env = os.getenv("LOG_LEVEL", "INFO")
-logging_config = get_logging_config(log_level_from_env)
-logging.config.dictConfig(logging_config)
+from cachica.capture import CommandCapture
+from cachica.compact import CompactDataStore
+from cachica.compression import Compressor, ZlibCodec, parse_rules
+from cachica.config import CommandLogSampler, Config, NetworkConfig, setup_logging
+from cachica.datastore import DataStore
+from cachica.executor import CommandExecutor
+from cachica.protocol import Parser, ProtocolError, encode_simple_error
+from cachica.pubsub import SUBSCRIBED_COMMANDS, SUBSCRIPTION_COMMANDS, Subscriber
 
 logger = logging.getLogger(__name__)
 
+# Identifies connections in captures
+_connection_ids = itertools.count(1)
+
+
+def build_command_log(config: Config) -> CommandLogSampler:
+    command_log = CommandLogSampler(logger, config.command_log_sample_rate, config.command_log_max_per_second)
+
+    def set_sample_rate(rate: int):
+        command_log.sample_rate = rate
+        command_log.refresh()
+
+    config.on_change("command-log-sample-rate", set_sample_rate)
+    config.on_change("command-log-max-per-second", lambda limit: setattr(command_log, "max_per_second", limit))
+    config.on_change("log-level", lambda level: command_log.refresh())
+    return command_log
 
-async def handle_client(datastore: DataStore, reader: StreamReader, writer: StreamWriter):
-    addr = writer.get_extra_info("peername")
+
+def build_capture(config: Config) -> CommandCapture:
+    """
+    Built even when capturing is off, so it can be turned on with CONFIG SET capture-file. The file
+    is always in capture-dir, which can't be changed at runtime.
+    """
+    capture = CommandCapture(config.capture_buffer_size)
+
+    def set_file(name: str):
+        capture.set_path(os.path.join(config.capture_dir, name) if name else "")
+
+    if config.capture_file:
+        set_file(config.capture_file)
+    config.on_change("capture-file", set_file)
+    config.on_change("capture-buffer-size", lambda size: setattr(capture, "buffer_size", size))
+    return capture
+
+
+async def handle_client(
+    datastore: DataStore,
+    reader: StreamReader,
+    writer: StreamWriter,
+    config: Config | None = None,
+    command_log: CommandLogSampler | None = None,
+    capture: CommandCapture | None = None,
+):
+    config = config or Config()
+    if command_log is None:
+        # Not registered with the config: it would outlive the connection. start_listeners shares one that is.
+        command_log = CommandLogSampler(logger, config.command_log_sample_rate, config.command_log_max_per_second)
+    capture = capture or CommandCapture()
+    connection_id = next(_connection_ids)
+    # Unix socket peers are unnamed, identify them by the socket path instead
+    addr = writer.get_extra_info("peername") or writer.get_extra_info("sockname")
     logger.info("Client connected from: %s", addr)
 
     parser = Parser()
+    # The connection's (pattern) subscriptions, handled here since they outlive a single command
+    pubsub = datastore.pubsub
+    subscriber = Subscriber(writer)
 
     try:
         while not reader.at_eof():
-            data = await reader.read(1024)
+            data = await reader.read(config.read_buffer_size)
             if not data:
                 break
 
             parser.feed(data)
+            if parser.buffered > config.client_query_buffer_limit:
+                raise ProtocolError("client query buffer limit exceeded")
             # pdb.set_trace()
 
             while True:
@@ -40,9 +96,25 @@ async def handle_client(datastore: DataStore, reader: StreamReader, writer: Stre
                 if command is None:
                     break
 
-                logger.debug("Processing command: %s", command)
+                if command_log.enabled:
+                    command_log.log(addr, command)
+                if capture.enabled:
+                    capture.record(connection_id, command)
 
-                response = datastore.process(command)
+                command_name = command[0].upper() if command else ""
+                if command_name in SUBSCRIPTION_COMMANDS:
+                    response = pubsub.handle(subscriber, command_name, command[1:])
+                elif subscriber.subscriptions and command_name not in SUBSCRIBED_COMMANDS:
+                    response = encode_simple_error(
+                        f"Can't execute '{command[0].lower()}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING "
+                        "are allowed in this context",
+                        error_prefix="ERR",
+                    )
+                else:
+                    response = datastore.process(command)
+                if type(response) is not bytes:
+                    # The command's work was offloaded, wait for its result without blocking other clients
+                    response = await response
 
                 writer.write(response)
                 await writer.drain()
@@ -56,34 +128,192 @@ async def handle_client(datastore: DataStore, reader: StreamReader, writer: Stre
     except Exception as e:
         logger.exception("An unexpected error occurred with client %s: %s", addr, e)
     finally:
+        pubsub.remove(subscriber)
         logger.info("Closing the connection with %s", addr)
         writer.close()
         await writer.wait_closed()
 
 
-async def eviction_loop(datastore: DataStore):
+async def eviction_loop(datastore: DataStore, config: Config):
+    while True:
+        await asyncio.sleep(config.active_expire_interval)
+        try:
+            datastore.evict_expired_keys()
+        except Exception:
+            # A failed cycle must not stop active expiry for good
+            logger.exception("Active expiry cycle failed")
+
+
+async def lazyfree_loop(datastore: DataStore):
     while True:
-        await asyncio.sleep(0.1)
-        datastore.evict_expired_keys()
+        if datastore.lazyfree_pending():
+            # One bounded slice per loop iteration, yielding to clients in between
+            datastore.free_lazy()
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(0.1)
+
 
+def build_executor(config: Config) -> CommandExecutor | None:
+    if config.offload_pool == "none":
+        return None
+    if config.offload_pool == "process":
+        pool = ProcessPoolExecutor()
+    else:
+        pool = ThreadPoolExecutor(thread_name_prefix="cachica-offload")
+    executor = CommandExecutor(pool, config.offload_threshold, config.offload_value_threshold)
+    config.on_change("offload-threshold", lambda threshold: setattr(executor, "cost_threshold", threshold))
+    config.on_change("offload-value-threshold", lambda threshold: setattr(executor, "value_threshold", threshold))
+    return executor
 
-async def run_server():
-    datastore = DataStore()
-    client_handler = functools.partial(handle_client, datastore)
 
-    server = await asyncio.start_server(client_handler, "0.0.0.0", 8888)
-    asyncio.create_task(eviction_loop(datastore))
-    addr = server.sockets[0].getsockname()
-    logger.info("Serving on %s", addr)
+def build_compressor(config: Config) -> Compressor:
+    """Built even when compression is off, so it can be turned on with CONFIG SET."""
+    compressor = Compressor(
+        threshold=config.compression_threshold,
+        rules=parse_rules(config.compression_rules),
+        codec=ZlibCodec(config.compression_level),
+        executor=ThreadPoolExecutor(thread_name_prefix="cachica-compression"),
+    )
+    config.on_change("compression-threshold", compressor.set_threshold)
+    config.on_change("compression-rules", lambda rules: compressor.set_rules(parse_rules(rules)))
+    config.on_change("compression-level", lambda level: compressor.set_codec(ZlibCodec(level)))
+    return compressor
+
+
+async def defrag_loop(datastore: CompactDataStore):
+    while True:
+        if datastore.defragment():
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(1)
 
-    async with server:
-        await server.serve_forever()
+
+def build_datastore(config: Config) -> DataStore:
+    executor = build_executor(config)
+    if config.storage_engine == "compact":
+        if config.compression_threshold is not None or config.compression_rules:
+            logger.warning("Compression is not supported by the compact storage engine, ignoring it.")
+        return CompactDataStore(lazyfree=config.lazyfree, executor=executor, config=config)
+    return DataStore(lazyfree=config.lazyfree, compressor=build_compressor(config), executor=executor, config=config)
+
+
+def _set_buffer_sizes(sock: socket.socket, network: NetworkConfig):
+    if network.send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, network.send_buffer)
+    if network.receive_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, network.receive_buffer)
+
+
+def create_tcp_socket(host: str, port: int, network: NetworkConfig) -> socket.socket:
+    family, type_, proto, _, sockaddr = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )[0]
+    sock = socket.socket(family, type_, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Set before listen() so accepted connections inherit them and the TCP window scale fits
+    _set_buffer_sizes(sock, network)
+    sock.bind(sockaddr)
+    sock.setblocking(False)
+    return sock
+
+
+def create_unix_socket(path: str, network: NetworkConfig) -> socket.socket:
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)  # left behind by a previous run
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    _set_buffer_sizes(sock, network)
+    sock.bind(path)
+    if network.unix_socket_permissions is not None:
+        os.chmod(path, network.unix_socket_permissions)
+    sock.setblocking(False)
+    return sock
+
+
+def configure_connection(writer: StreamWriter, network: NetworkConfig):
+    sock = writer.get_extra_info("socket")
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(network.tcp_nodelay))
+    if network.tcp_keepalive:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, network.tcp_keepalive)
+
+
+async def start_listeners(
+    datastore: DataStore, network: NetworkConfig, config: Config | None = None, capture: CommandCapture | None = None
+) -> list[asyncio.Server]:
+    config = config or Config()
+    client_handler = functools.partial(
+        handle_client,
+        datastore,
+        config=config,
+        command_log=build_command_log(config),
+        capture=capture or build_capture(config),
+    )
+
+    async def tcp_client_handler(reader: StreamReader, writer: StreamWriter):
+        configure_connection(writer, network)
+        await client_handler(reader, writer)
+
+    servers = []
+    for host, port in network.bind:
+        sock = create_tcp_socket(host, port, network)
+        servers.append(await asyncio.start_server(tcp_client_handler, sock=sock, backlog=network.backlog))
+    for path in network.unix_sockets:
+        sock = create_unix_socket(path, network)
+        servers.append(await asyncio.start_unix_server(client_handler, sock=sock, backlog=network.backlog))
+    if not servers:
+        raise ValueError("No listen addresses configured, set BIND and/or UNIX_SOCKET")
+    for server in servers:
+        logger.info("Serving on %s", server.sockets[0].getsockname())
+    return servers
+
+
+def apply_log_level(level: str):
+    logging.getLogger().setLevel(level)
+
+
+async def run_server(config: Config | None = None):
+    config = config or Config.load(os.getenv("CONFIG_FILE"))
+    apply_log_level(config.log_level)
+    # Registered first, so the level is applied before dependants (the command log) re-read it
+    config.on_change("log-level", apply_log_level)
+
+    network = NetworkConfig.from_config(config)
+    # Picked up by connections accepted after the change
+    config.on_change("tcp-nodelay", lambda enabled: setattr(network, "tcp_nodelay", enabled))
+    config.on_change("tcp-keepalive", lambda seconds: setattr(network, "tcp_keepalive", seconds))
+
+    datastore = build_datastore(config)
+    capture = build_capture(config)
+    servers = await start_listeners(datastore, network, config, capture)
+
+    asyncio.create_task(eviction_loop(datastore, config))
+    asyncio.create_task(lazyfree_loop(datastore))
+    if isinstance(datastore, CompactDataStore):
+        asyncio.create_task(defrag_loop(datastore))
+
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        # Writes out the commands still buffered, off the loop
+        capture.stop()
+        await asyncio.to_thread(capture.wait)
+        for path in network.unix_sockets:
+            if os.path.exists(path):
+                os.unlink(path)
 
 
 def main():
-    """The synchronous entry point for the application script."""
+    """The synchronous entry point for the application script. Takes an optional config file path."""
+    load_dotenv()
+    config_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("CONFIG_FILE")
+    config = Config.load(config_path)
+    setup_logging(config.log_level, config.log_queue_size)
     try:
-        uvloop.run(run_server())
+        uvloop.run(run_server(config))
         # asyncio.run(run_server())
     except KeyboardInterrupt:
         logger.info("Server shutting down.")
@@ -0,0 +1,241 @@
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+# Entries per segment. Trimming drops whole segments, range reads bisect the segment index and then one segment
+SEGMENT_ENTRIES = 128
+MAX_ID_PART = (1 << 64) - 1
+
+StreamID = tuple[int, int]
+
+
+class StreamError(ValueError):
+    pass
+
+
+def parse_id(spec: str, missing_seq: int = 0) -> StreamID:
+    """Parses "ms-seq" or "ms", in which case the sequence number is `missing_seq`."""
+    ms, sep, seq = spec.partition("-")
+    try:
+        parsed = (int(ms), int(seq) if sep else missing_seq)
+    except ValueError:
+        raise StreamError("Invalid stream ID specified as stream command argument") from None
+    if not 0 <= parsed[0] <= MAX_ID_PART or not 0 <= parsed[1] <= MAX_ID_PART:
+        raise StreamError("Invalid stream ID specified as stream command argument")
+    return parsed
+
+
+def parse_range_bound(spec: str, is_start: bool) -> StreamID:
+    """Parses an XRANGE bound: "-", "+", an ID, or an ID prefixed with "(" to exclude it."""
+    if spec == "-":
+        return 0, 0
+    if spec == "+":
+        return MAX_ID_PART, MAX_ID_PART
+    exclusive = spec.startswith("(")
+    stream_id = parse_id(spec[1:] if exclusive else spec, 0 if is_start else MAX_ID_PART)
+    if not exclusive:
+        return stream_id
+    # Step to the neighbouring ID
+    ms, seq = stream_id
+    if is_start:
+        if seq < MAX_ID_PART:
+            return ms, seq + 1
+        if ms < MAX_ID_PART:
+            return ms + 1, 0
+    else:
+        if seq > 0:
+            return ms, seq - 1
+        if ms > 0:
+            return ms - 1, MAX_ID_PART
+    raise StreamError("invalid start or end ID for exclusive range")
+
+
+def format_id(stream_id: StreamID) -> str:
+    return f"{stream_id[0]}-{stream_id[1]}"
+
+
+class _Segment:
+    """Up to SEGMENT_ENTRIES entries, their IDs packed in two arrays."""
+
+    __slots__ = ("ms", "seq", "fields")
+
+    def __init__(self):
+        self.ms = array("Q")
+        self.seq = array("Q")
+        self.fields: list[tuple[str, ...]] = []
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes taken by the packed IDs and the entry list, not counting the fields themselves."""
+        return len(self.ms) * 16 + sys.getsizeof(self.fields)
+
+    def id_at(self, i: int) -> StreamID:
+        return self.ms[i], self.seq[i]
+
+    def position(self, stream_id: StreamID, right: bool = False) -> int:
+        find = bisect_right if right else bisect_left
+        return find(range(len(self.fields)), stream_id, key=self.id_at)
+
+
+class Stream:
+    """
+    Append-only log of field/value entries with strictly increasing IDs.
+    Entries before `_head` in the first segment have been trimmed.
+    """
+
+    __slots__ = ("_segments", "_index", "_head", "_length", "last_id", "entries_added")
+
+    def __init__(self):
+        self._segments: list[_Segment] = []
+        self._index: list[StreamID] = []  # first ID of every segment
+        self._head = 0
+        self._length = 0
+        self.last_id: StreamID = (0, 0)
+        self.entries_added = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes taken by the segments, not counting the entries' fields."""
+        return len(self._segments) * self._segments[0].nbytes if self._segments else 0
+
+    def sample_fields(self, k: int):
+        """Fields of up to `k` live entries (all of them when `k` is 0), oldest first."""
+        entries = (
+            fields
+            for s, segment in enumerate(self._segments)
+            for fields in segment.fields[self._head if s == 0 else 0 :]
+        )
+        return islice(entries, k) if k else entries
+
+    def next_id(self, spec: str) -> StreamID:
+        """Resolves an XADD ID argument, "*" or "ms-*" for generated ones, checking it comes after the last entry."""
+        last_ms, last_seq = self.last_id
+        if spec == "*":
+            ms = max(int(time.time() * 1000), last_ms)
+            if ms > last_ms:
+                stream_id = (ms, 0)
+            elif last_seq < MAX_ID_PART:
+                stream_id = (ms, last_seq + 1)
+            elif ms < MAX_ID_PART:
+                # This millisecond's sequence numbers are used up, borrow the next millisecond
+                stream_id = (ms + 1, 0)
+            else:
+                raise StreamError("The stream has exhausted the last possible ID, unable to add more items")
+        elif spec.endswith("-*"):
+            ms = parse_id(spec[:-2])[0]
+            if ms != last_ms:
+                stream_id = (ms, 0)
+            elif last_seq < MAX_ID_PART:
+                stream_id = (ms, last_seq + 1)
+            else:
+                raise StreamError("The ID specified in XADD is equal or smaller than the target stream top item")
+        else:
+            stream_id = parse_id(spec)
+        if stream_id == (0, 0):
+            raise StreamError("The ID specified in XADD must be greater than 0-0")
+        if stream_id <= self.last_id:
+            raise StreamError("The ID specified in XADD is equal or smaller than the target stream top item")
+        return stream_id
+
+    def add(self, stream_id: StreamID, fields: tuple[str, ...]) -> None:
+        if not self._segments or len(self._segments[-1]) >= SEGMENT_ENTRIES:
+            self._segments.append(_Segment())
+            self._index.append(stream_id)
+        segment = self._segments[-1]
+        segment.ms.append(stream_id[0])
+        segment.seq.append(stream_id[1])
+        segment.fields.append(fields)
+        self._length += 1
+        self.entries_added += 1
+        self.last_id = stream_id
+
+    def trim(self, maxlen: int, approximate: bool = False) -> int:
+        """
+        Trims the oldest entries until at most `maxlen` remain. Whole segments are dropped, within the
+        first segment only the head moves. Approximate trimming stops at segment boundaries.
+        """
+        trimmed = 0
+        while self._length > maxlen and self._segments:
+            first_live = len(self._segments[0]) - self._head
+            excess = self._length - maxlen
+            if excess >= first_live:
+                del self._segments[0]
+                del self._index[0]
+                self._head = 0
+                self._length -= first_live
+                trimmed += first_live
+            elif approximate:
+                break
+            else:
+                self._head += excess
+                self._length -= excess
+                trimmed += excess
+        return trimmed
+
+    def release_segment(self) -> int:
+        """Drops the newest segment, for freeing a deleted stream bit by bit. Returns the entries it held."""
+        segment = self._segments.pop()
+        self._index.pop()
+        released = len(segment) - (self._head if not self._segments else 0)
+        self._length -= released
+        if not self._segments:
+            self._head = 0
+        return released
+
+    def range(self, start: StreamID, end: StreamID, count: int | None = None) -> list[tuple[StreamID, tuple]]:
+        """Entries with start <= ID <= end, oldest first."""
+        entries = []
+        if not self._segments or start > end or count == 0:
+            return entries
+        first_segment = max(bisect_right(self._index, start) - 1, 0)
+        start_pos = max(self._segments[first_segment].position(start), self._head if first_segment == 0 else 0)
+        for s in range(first_segment, len(self._segments)):
+            segment = self._segments[s]
+            for i in range(start_pos, len(segment)):
+                stream_id = segment.id_at(i)
+                if stream_id > end:
+                    return entries
+                entries.append((stream_id, segment.fields[i]))
+                if len(entries) == count:
+                    return entries
+            start_pos = 0
+        return entries
+
+    def reverse_range(self, end: StreamID, start: StreamID, count: int | None = None) -> list[tuple[StreamID, tuple]]:
+        """Entries with start <= ID <= end, newest first."""
+        entries = []
+        if not self._segments or start > end or count == 0:
+            return entries
+        last_segment = bisect_right(self._index, end) - 1
+        if last_segment < 0:
+            return entries
+        start_pos = self._segments[last_segment].position(end, right=True) - 1
+        for s in range(last_segment, -1, -1):
+            segment = self._segments[s]
+            floor = self._head if s == 0 else 0
+            for i in range(start_pos, floor - 1, -1):
+                stream_id = segment.id_at(i)
+                if stream_id < start:
+                    return entries
+                entries.append((stream_id, segment.fields[i]))
+                if len(entries) == count:
+                    return entries
+            if s:
+                start_pos = len(self._segments[s - 1]) - 1
+        return entries
+
+    def after(self, stream_id: StreamID, count: int | None = None) -> list[tuple[StreamID, tuple]]:
+        """Entries with an ID greater than `stream_id`, as XREAD returns them."""
+        if stream_id >= self.last_id:
+            return []
+        ms, seq = stream_id
+        start = (ms, seq + 1) if seq < MAX_ID_PART else (ms + 1, 0)
+        return self.range(start, (MAX_ID_PART, MAX_ID_PART), count)
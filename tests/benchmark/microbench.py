@@ -0,0 +1,361 @@
+"""
+Micro-benchmarks for the hot path: the RESP parser, the encoders and every
+DataStore command handler.
+
+Runs fully offline (no server, no sockets). Each case is timed several times
+and the best run is kept, reported as nanoseconds per operation.
+
+Usage:
+    python tests/benchmark/microbench.py                    # compare against the stored baseline
+    python tests/benchmark/microbench.py --save-baseline    # (re)record the baseline
+    python tests/benchmark/microbench.py -k parser          # only cases whose name contains "parser"
+
+The comparison exits with status 1 when any case is slower than the baseline
+by more than --threshold percent (5% by default). Baselines are only meaningful
+on the machine that recorded them, so re-record before comparing elsewhere.
+"""
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+from cachica import protocol
+from cachica.datastore import DataStore
+from cachica.protocol import Parser
+
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+DEFAULT_THRESHOLD = 5.0
+DEFAULT_REPEAT = 7
+OPS_PER_RUN = 5000
+
+
+# --- Helpers ---
+def frame(*parts: str) -> bytes:
+    return protocol.encode_array(list(parts))
+
+
+def populated(n: int, value: str = "v" * 16, prefix: str = "key") -> tuple[DataStore, list[str]]:
+    ds = DataStore()
+    keys = [f"{prefix}:{i}" for i in range(n)]
+    for key in keys:
+        ds.process(["SET", key, value])
+    return ds, keys
+
+
+def expired(n: int) -> tuple[DataStore, list[str]]:
+    ds = DataStore()
+    keys = [f"exp:{i}" for i in range(n)]
+    for key in keys:
+        ds.process(["SET", key, "v", "PX", "1"])
+    time.sleep(0.005)
+    return ds, keys
+
+
+# --- Cases ---
+# Every case takes the number of operations to perform and returns a zero-argument
+# callable doing them. All setup happens outside the callable. A callable may return
+# the number of operations it actually performed when that differs from the request.
+def parser_single(payload_size: int):
+    def make(n):
+        data = frame("SET", "key", "x" * payload_size)
+        parser = Parser()
+
+        def run():
+            feed, get_command = parser.feed, parser.get_command
+            for _ in range(n):
+                feed(data)
+                get_command()
+
+        return run
+
+    return make
+
+
+def parser_pipelined(depth: int, payload_size: int = 16):
+    def make(n):
+        data = b"".join(frame("SET", f"key:{i}", "x" * payload_size) for i in range(depth))
+        parser = Parser()
+        batches = max(1, n // depth)
+
+        def run():
+            feed, get_command = parser.feed, parser.get_command
+            for _ in range(batches):
+                feed(data)
+                while get_command() is not None:
+                    pass
+            return batches * depth
+
+        return run
+
+    return make
+
+
+def bulk_string(size: int):
+    def make(n):
+        value = "x" * size
+        encode = protocol.encode_bulk_string
+
+        def run():
+            for _ in range(n):
+                encode(value)
+
+        return run
+
+    return make
+
+
+def array(length: int):
+    def make(n):
+        values = [f"element:{i}" for i in range(length)]
+        encode = protocol.encode_array
+
+        def run():
+            for _ in range(n):
+                encode(values)
+
+        return run
+
+    return make
+
+
+def commands(build):
+    """Wraps a `build(n) -> (datastore, [command, ...])` setup into a case."""
+
+    def make(n):
+        ds, cmds = build(n)
+
+        def run():
+            process = ds.process
+            for cmd in cmds:
+                process(cmd)
+
+        return run
+
+    return make
+
+
+def evict_cycle(make_n: int):
+    def make(n):
+        ds, _ = expired(make_n)
+        cycles = max(1, n // 10)
+
+        def run():
+            for _ in range(cycles):
+                ds.evict_expired_keys()
+            return cycles
+
+        return run
+
+    return make
+
+
+def bitcount(size: int):
+    """BITCOUNT over a `size` byte bitmap. Each call is long running, so only a few are timed."""
+
+    def make(n):
+        ds = DataStore()
+        ds.process(["SETBIT", "bits", str(8 * size - 1), "1"])
+        # Dense bits: mostly-zero bitmaps convert to small ints and would flatter the result
+        ds.process(["BITOP", "NOT", "bits", "bits"])
+        calls = max(1, min(n, 5))
+
+        def run():
+            process = ds.process
+            for _ in range(calls):
+                process(["BITCOUNT", "bits"])
+            return calls
+
+        return run
+
+    return make
+
+
+# --- DataStore command builders ---
+def build_set(n):
+    return DataStore(), [["SET", f"key:{i}", "v" * 16] for i in range(n)]
+
+
+def build_set_ex(n):
+    return DataStore(), [["SET", f"key:{i}", "v" * 16, "EX", "60"] for i in range(n)]
+
+
+def build_set_overwrite(n):
+    ds, keys = populated(n)
+    return ds, [["SET", key, "w" * 16] for key in keys]
+
+
+def build_get_hit(n):
+    ds, keys = populated(n)
+    return ds, [["GET", key] for key in keys]
+
+
+def build_get_hit_with_ttl(n):
+    ds, keys = DataStore(), [f"key:{i}" for i in range(n)]
+    for key in keys:
+        ds.process(["SET", key, "v" * 16, "EX", "60"])
+    return ds, [["GET", key] for key in keys]
+
+
+def build_get_miss(n):
+    return DataStore(), [["GET", f"missing:{i}"] for i in range(n)]
+
+
+def build_get_expired(n):
+    ds, keys = expired(n)
+    return ds, [["GET", key] for key in keys]
+
+
+def build_del(n):
+    ds, keys = populated(n)
+    return ds, [["DEL", key] for key in keys]
+
+
+def build_del_miss(n):
+    return DataStore(), [["DEL", f"missing:{i}"] for i in range(n)]
+
+
+def build_setbit(n):
+    return DataStore(), [["SETBIT", "bits", str(i * 7), "1"] for i in range(n)]
+
+
+def build_lpush(n):
+    return DataStore(), [["LPUSH", "list", f"item:{i}"] for i in range(n)]
+
+
+def build_lpop(n):
+    ds = DataStore()
+    for i in range(n):
+        ds.process(["LPUSH", "list", f"item:{i}"])
+    return ds, [["LPOP", "list"]] * n
+
+
+CASES = {
+    "parser.feed_single.16b": parser_single(16),
+    "parser.feed_single.1kb": parser_single(1024),
+    "parser.feed_single.64kb": parser_single(64 * 1024),
+    "parser.feed_pipelined.10x16b": parser_pipelined(10),
+    "parser.feed_pipelined.100x16b": parser_pipelined(100),
+    "parser.feed_pipelined.10x1kb": parser_pipelined(10, 1024),
+    "encode.bulk_string.16b": bulk_string(16),
+    "encode.bulk_string.1kb": bulk_string(1024),
+    "encode.bulk_string.64kb": bulk_string(64 * 1024),
+    "encode.array.3": array(3),
+    "encode.array.100": array(100),
+    "datastore.ping": commands(lambda n: (DataStore(), [["PING"]] * n)),
+    "datastore.echo": commands(lambda n: (DataStore(), [["ECHO", "hello"]] * n)),
+    "datastore.unknown": commands(lambda n: (DataStore(), [["NOPE", "x"]] * n)),
+    "datastore.set": commands(build_set),
+    "datastore.set_ex": commands(build_set_ex),
+    "datastore.set_overwrite": commands(build_set_overwrite),
+    "datastore.get_hit": commands(build_get_hit),
+    "datastore.get_hit_with_ttl": commands(build_get_hit_with_ttl),
+    "datastore.get_miss": commands(build_get_miss),
+    "datastore.get_expired": commands(build_get_expired),
+    "datastore.del": commands(build_del),
+    "datastore.del_miss": commands(build_del_miss),
+    "datastore.lpush": commands(build_lpush),
+    "datastore.lpop": commands(build_lpop),
+    "datastore.evict_expired_keys.10k": evict_cycle(10_000),
+    "datastore.setbit": commands(build_setbit),
+    "datastore.bitcount.16mb": bitcount(16 << 20),
+}
+
+
+# --- Runner ---
+def measure(make, ops: int, repeat: int) -> float:
+    """Returns the best observed time per operation, in nanoseconds."""
+    make(ops)()  # warm-up, not timed
+    best = float("inf")
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            run = make(ops)
+            start = time.perf_counter_ns()
+            performed = run() or ops
+            elapsed = time.perf_counter_ns() - start
+            best = min(best, elapsed / performed)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best
+
+
+def run_cases(pattern: str | None, ops: int, repeat: int) -> dict[str, float]:
+    results = {}
+    for name, make in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(make, ops, repeat)
+    return results
+
+
+def compare(baseline: dict[str, float], current: dict[str, float], threshold: float) -> tuple[list[str], list[str]]:
+    """Builds the report lines and returns them together with the names of regressed cases."""
+    lines = [f"{'case':<36} {'baseline ns/op':>15} {'current ns/op':>15} {'change':>9}"]
+    regressions = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if before is None:
+            lines.append(f"{name:<36} {'-':>15} {now:>15.1f} {'new':>9}")
+            continue
+        change = (now - before) / before * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  improved"
+        lines.append(f"{name:<36} {before:>15.1f} {now:>15.1f} {change:>+8.1f}%{flag}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for cachica's hot path.")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline file to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Record the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Regression threshold in percent.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per case; the best one is kept.")
+    parser.add_argument("--ops", type=int, default=OPS_PER_RUN, help="Operations per run.")
+    parser.add_argument("-k", dest="pattern", help="Only run cases whose name contains this substring.")
+    args = parser.parse_args()
+
+    current = run_cases(args.pattern, args.ops, args.repeat)
+
+    if args.save_baseline:
+        stored = {}
+        if args.baseline.exists():
+            stored = json.loads(args.baseline.read_text()).get("results", {})
+        stored.update(current)
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": dict(sorted(stored.items())),
+        }
+        args.baseline.write_text(json.dumps(payload, indent=2) + "\n")
+        for name, ns in current.items():
+            print(f"{name:<36} {ns:>15.1f} ns/op")
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline first.")
+        sys.exit(2)
+
+    baseline = json.loads(args.baseline.read_text())
+    lines, regressions = compare(baseline["results"], current, args.threshold)
+    print("\n".join(lines))
+    if baseline.get("python") != platform.python_version():
+        print(f"\nNote: baseline recorded on Python {baseline.get('python')}, running {platform.python_version()}.")
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.1f}%: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\nNo regressions above {args.threshold:.1f}%.")
+
+
+if __name__ == "__main__":
+    main()
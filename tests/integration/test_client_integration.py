@@ -0,0 +1,263 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import pytest_asyncio
+
+from cachica.client import LEASE_PREFIX, AsyncClient, Client, ShardedClient, should_refresh_early
+from cachica.config import NetworkConfig
+from cachica.datastore import DataStore
+from cachica.protocol import ResponseError
+from cachica.server import start_listeners
+
+
+@pytest_asyncio.fixture
+async def port():
+    network = NetworkConfig(bind=[("127.0.0.1", 0)], unix_sockets=[])
+    servers = await start_listeners(DataStore(), network)
+    yield servers[0].sockets[0].getsockname()[1]
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest_asyncio.fixture
+async def cluster():
+    """Three servers with their own datastores, keyed by node address."""
+    network = NetworkConfig(bind=[("127.0.0.1", 0)], unix_sockets=[])
+    nodes = {}
+    for _ in range(3):
+        datastore = DataStore()
+        servers = await start_listeners(datastore, network)
+        nodes[f"127.0.0.1:{servers[0].sockets[0].getsockname()[1]}"] = (datastore, servers)
+    yield {node: datastore for node, (datastore, _) in nodes.items()}
+    for _, servers in nodes.values():
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+
+
+def test_should_refresh_early():
+    assert not should_refresh_early(-1, 10.0)
+    assert not should_refresh_early(1000, 0.0)
+    assert should_refresh_early(0, 0.001)
+    assert not should_refresh_early(60_000, 0.001)
+
+
+@pytest.mark.asyncio
+async def test_client_replies(port):
+    def talk():
+        client = Client(port=port)
+        assert client.GET("missing") is None
+        client.LPUSH(["list", "a"])
+        with pytest.raises(ResponseError):
+            client.SET("list", "a", "GET")
+        assert client.PTTL("missing") == -2
+
+    await asyncio.to_thread(talk)
+
+
+@pytest.mark.asyncio
+async def test_client_returns_binary_values_as_bytes(port):
+    def talk():
+        client = Client(port=port)
+        assert client._call(["SETBIT", "bitmap", "0", "1"]) == 0
+        assert client.GET("bitmap") == b"\x80"
+        assert client.PING() == "PONG"
+
+    await asyncio.to_thread(talk)
+
+
+@pytest.mark.asyncio
+async def test_get_or_set_coalesces_threads(port):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return "computed"
+
+    def stampede():
+        client = Client(port=port)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(client.get_or_set("hot", loader, ttl=60))) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, client.PTTL("hot"), client.GET(LEASE_PREFIX + "hot")
+
+    results, pttl, lease = await asyncio.to_thread(stampede)
+    assert results == ["computed"] * 8
+    assert len(calls) == 1
+    assert 59_000 < pttl <= 60_000
+    assert lease is None
+
+
+@pytest.mark.asyncio
+async def test_get_or_set_waits_for_lease_holder(port):
+    def wait_for_other_process():
+        client = Client(port=port)
+        # Another process holds the lease and will store the value shortly
+        client.SET(LEASE_PREFIX + "hot", "other", "NX", "PX", "5000")
+        threading.Timer(0.05, lambda: Client(port=port).SET("hot", "theirs")).start()
+        return client.get_or_set("hot", lambda: "ours", ttl=60)
+
+    assert await asyncio.to_thread(wait_for_other_process) == "theirs"
+
+
+@pytest.mark.asyncio
+async def test_get_or_set_keeps_a_lease_taken_over_by_another_process(port):
+    def slow_load():
+        client = Client(port=port)
+
+        def loader():
+            # Our lease ran out and another process took it
+            Client(port=port).SET(LEASE_PREFIX + "hot", "other")
+            return "ours"
+
+        assert client.get_or_set("hot", loader, ttl=60) == "ours"
+        return client.GET(LEASE_PREFIX + "hot")
+
+    assert await asyncio.to_thread(slow_load) == "other"
+
+
+@pytest.mark.asyncio
+async def test_async_get_or_set_keeps_a_lease_taken_over_by_another_process(port):
+    client = await AsyncClient.connect(port=port)
+    try:
+
+        async def loader():
+            await client.SET(LEASE_PREFIX + "hot", "other")
+            return "ours"
+
+        assert await client.get_or_set("hot", loader, ttl=60) == "ours"
+        assert await client.GET(LEASE_PREFIX + "hot") == "other"
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_async_get_or_set_coalesces_tasks(port):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "computed"
+
+    client = await AsyncClient.connect(port=port)
+    try:
+        results = await asyncio.gather(*(client.get_or_set("hot", loader, ttl=60) for _ in range(8)))
+        assert results == ["computed"] * 8
+        assert len(calls) == 1
+        assert await client.get_or_set("hot", loader, ttl=60) == "computed"
+        assert len(calls) == 1
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_sharded_client_splits_multi_key_commands(cluster):
+    keys = [f"key:{i}" for i in range(100)]
+
+    def talk():
+        client = ShardedClient(list(cluster))
+        try:
+            assert client.MSET({key: key.upper() for key in keys}) == "OK"
+            assert client.MGET([*keys, "missing"]) == [key.upper() for key in keys] + [None]
+            assert client.GET("key:7") == "KEY:7"
+            assert client.DEL(keys[:10]) == 10
+            return {key: client.node_for(key) for key in keys}
+        finally:
+            client.close()
+
+    owners = await asyncio.to_thread(talk)
+    # Every server holds only the keys the ring assigns to it
+    for node, datastore in cluster.items():
+        stored = {key for key in keys[10:] if datastore._get(key) is not None}
+        assert stored == {key for key in keys[10:] if owners[key] == node}
+        assert stored
+
+
+@pytest.mark.asyncio
+async def test_sharded_client_node_removal(cluster):
+    keys = [f"key:{i}" for i in range(100)]
+
+    def talk():
+        client = ShardedClient(list(cluster))
+        try:
+            client.MSET({key: "v" for key in keys})
+            removed = client.nodes[0]
+            client.remove_node(removed)
+            # Keys of the remaining nodes are still hits, the removed node's keys are misses
+            values = client.MGET(keys)
+            return removed, values, {key: client.node_for(key) for key in keys}
+        finally:
+            client.close()
+
+    removed, values, owners = await asyncio.to_thread(talk)
+    lost = {key for key, value in zip(keys, values, strict=True) if value is None}
+    assert lost == {key for key in keys if cluster[removed]._get(key) is not None}
+    assert removed not in owners.values()
+
+
+@pytest.mark.asyncio
+async def test_sharded_client_drops_connections_that_failed(cluster):
+    def talk():
+        client = ShardedClient(list(cluster))
+        try:
+            client._call_on("bitmap", [["SETBIT", "bitmap", "0", "1"]])
+            assert client.GET("bitmap") == b"\x80"
+            pool = client._pools[client.node_for("bitmap")]
+            with pytest.raises(ResponseError):
+                client._call_on("bitmap", [["LPUSH", "bitmap", "a"]])
+            # An error reply leaves the connection usable
+            assert pool._idle.qsize() == 1
+            with pytest.raises(RuntimeError), pool.connection():
+                raise RuntimeError("interrupted mid-reply")
+            assert pool._idle.qsize() == 0
+            assert client.GET("bitmap") == b"\x80"
+        finally:
+            client.close()
+
+    await asyncio.to_thread(talk)
+
+
+@pytest.mark.asyncio
+async def test_sharded_client_get_or_set_coalesces_threads(cluster):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("backend down")
+
+    def stampede():
+        # More threads than pooled connections: misses on every connection share the one load, and its error
+        client = ShardedClient(list(cluster), pool_size=2)
+        errors = []
+
+        def get():
+            try:
+                client.get_or_set("hot", loader, ttl=60)
+            except RuntimeError as e:
+                errors.append(e)
+
+        try:
+            threads = [threading.Thread(target=get) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return errors, client.node_for("hot")
+        finally:
+            client.close()
+
+    errors, node = await asyncio.to_thread(stampede)
+    assert len(errors) == 8
+    assert len(calls) == 1
+    assert cluster[node]._get(LEASE_PREFIX + "hot") is None
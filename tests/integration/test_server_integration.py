@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import os
+import stat
+
+import pytest
+import pytest_asyncio
+
+from cachica.capture import read_capture
+from cachica.client import Client
+from cachica.config import Config, NetworkConfig
+from cachica.datastore import DataStore
+from cachica.protocol import Parser, ResponseError, encode_array
+from cachica.server import build_capture, handle_client, start_listeners
+
+
+@pytest_asyncio.fixture
+async def listeners(tmp_path):
+    network = NetworkConfig(
+        bind=[("127.0.0.1", 0)],
+        unix_sockets=[str(tmp_path / "cachica.sock")],
+        unix_socket_permissions=0o700,
+        send_buffer=65536,
+        receive_buffer=65536,
+    )
+    servers = await start_listeners(DataStore(), network)
+    yield network, servers
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_tcp_and_unix_listeners_share_the_datastore(listeners):
+    network, servers = listeners
+    port = servers[0].sockets[0].getsockname()[1]
+
+    def talk():
+        tcp_client = Client(port=port)
+        unix_client = Client(unix_socket_path=network.unix_sockets[0])
+        assert tcp_client.SET("name", "cachica") == "OK"
+        return unix_client.GET("name")
+
+    assert await asyncio.to_thread(talk) == "cachica"
+
+
+@pytest.mark.asyncio
+async def test_unix_socket_permissions(listeners):
+    network, _ = listeners
+    mode = os.stat(network.unix_sockets[0]).st_mode
+    assert stat.S_ISSOCK(mode)
+    assert stat.S_IMODE(mode) == 0o700
+
+
+@pytest.mark.asyncio
+async def test_connections_do_not_register_config_callbacks():
+    config = Config()
+    server = await asyncio.start_server(functools.partial(handle_client, DataStore(), config=config), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    def talk():
+        for _ in range(3):
+            client = Client(port=port)
+            assert client.PING() == "PONG"
+            client.close()
+
+    await asyncio.to_thread(talk)
+    server.close()
+    await server.wait_closed()
+    assert not config._callbacks
+
+
+@pytest.mark.asyncio
+async def test_capture_records_commands_per_connection(tmp_path):
+    config = Config()
+    config.capture_dir = str(tmp_path)
+    config.set("capture-file", "traffic.cap")
+    network = NetworkConfig(bind=[("127.0.0.1", 0)], unix_sockets=[])
+    capture = build_capture(config)
+    servers = await start_listeners(DataStore(), network, config, capture)
+    port = servers[0].sockets[0].getsockname()[1]
+
+    def talk():
+        first, second = Client(port=port), Client(port=port)
+        first.SET("name", "cachica")
+        second.GET("name")
+        first.close()
+        second.close()
+
+    await asyncio.to_thread(talk)
+    config.set("capture-file", "")
+    await asyncio.to_thread(capture.wait)
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+    records = list(read_capture(str(tmp_path / "traffic.cap")))
+    assert [r.payload for r in records] == [encode_array(["SET", "name", "cachica"]), encode_array(["GET", "name"])]
+    assert records[0].connection_id != records[1].connection_id
+
+
+@pytest.mark.asyncio
+async def test_keyspace_notifications_reach_subscribers():
+    datastore = DataStore()
+    datastore.process(["CONFIG", "SET", "notify-keyspace-events", "KEA"])
+    network = NetworkConfig(bind=[("127.0.0.1", 0)], unix_sockets=[])
+    servers = await start_listeners(datastore, network)
+    port = servers[0].sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    parser = Parser(is_client=True)
+
+    async def next_reply():
+        while not parser.ready:
+            parser.feed(await asyncio.wait_for(reader.read(4096), 5))
+        return parser.get_command()
+
+    writer.write(encode_array(["SUBSCRIBE", "__keyevent@0__:set"]))
+    assert await next_reply() == ["subscribe", "__keyevent@0__:set", 1]
+    writer.write(encode_array(["GET", "name"]))
+    assert isinstance(await next_reply(), ResponseError)
+
+    await asyncio.to_thread(lambda: Client(port=port).SET("name", "cachica"))
+    assert await next_reply() == ["message", "__keyevent@0__:set", "name"]
+
+    writer.close()
+    await writer.wait_closed()
+    for server in servers:
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,123 @@
+"""
+Replays a traffic capture against a server and reports the reply latencies.
+
+Record one with the capture-file setting (e.g. `CONFIG SET capture-file traffic.cap`, which writes
+to the capture-dir directory, then `CONFIG SET capture-file ""` to stop), then:
+
+    python tests/load_test/replay.py traffic.cap --speed 2 --pipeline 16
+
+Every captured connection gets its own connection, which sends the commands in their original order
+and, unless --speed is 0, at their original pace divided by --speed. Up to --pipeline commands are sent
+before their replies arrive.
+"""
+
+import argparse
+import asyncio
+import time
+from collections import defaultdict, deque
+
+from cachica.capture import read_capture
+from cachica.protocol import Parser, ResponseError
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class ReplayStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors = 0
+
+
+async def replay_connection(
+    host: str,
+    port: int,
+    commands: list[tuple[int, bytes]],
+    start: float,
+    speed: float,
+    pipeline: int,
+    stats: ReplayStats,
+):
+    reader, writer = await asyncio.open_connection(host, port)
+    in_flight = asyncio.Semaphore(pipeline)
+    sent_at: deque[float] = deque()
+
+    async def read_replies():
+        parser = Parser(is_client=True)
+        for _ in range(len(commands)):
+            while not parser.ready:
+                data = await reader.read(65536)
+                if not data:
+                    raise ConnectionError("server closed the connection")
+                parser.feed(data)
+            reply = parser.get_command()
+            stats.latencies.append(time.perf_counter() - sent_at.popleft())
+            if isinstance(reply, ResponseError):
+                stats.errors += 1
+            in_flight.release()
+
+    replies = asyncio.create_task(read_replies())
+    try:
+        for offset_ns, payload in commands:
+            if speed:
+                delay = start + offset_ns / 1e9 / speed - time.perf_counter()
+                if delay > 0:
+                    await writer.drain()
+                    await asyncio.sleep(delay)
+            if replies.done():
+                # Lost the connection, surface the error instead of waiting on the semaphore forever
+                await replies
+            await in_flight.acquire()
+            sent_at.append(time.perf_counter())
+            writer.write(payload)
+        await writer.drain()
+        await replies
+    finally:
+        replies.cancel()
+        writer.close()
+        await writer.wait_closed()
+
+
+async def replay(path: str, host: str, port: int, speed: float, pipeline: int) -> tuple[ReplayStats, float]:
+    connections = defaultdict(list)
+    for command in read_capture(path):
+        connections[command.connection_id].append((command.offset_ns, command.payload))
+    stats = ReplayStats()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(replay_connection(host, port, commands, start, speed, pipeline, stats) for commands in connections.values())
+    )
+    return stats, time.perf_counter() - start
+
+
+def percentile(ordered: list[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def report(stats: ReplayStats, elapsed: float):
+    ordered = sorted(stats.latencies)
+    print(f"Replayed {len(ordered)} commands in {elapsed:.2f}s ({len(ordered) / elapsed:.0f} commands/s)")
+    print(f"Error replies: {stats.errors}")
+    if not ordered:
+        return
+    for p in PERCENTILES:
+        print(f"p{p:<5} {percentile(ordered, p) * 1e6:10.1f} us")
+    print(f"max    {ordered[-1] * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays a cachica traffic capture and reports latency percentiles.")
+    parser.add_argument("capture", help="Capture file written by the server's capture-file setting.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Multiple of the original pace, 0 sends as fast as the pipeline allows.",
+    )
+    parser.add_argument("--pipeline", type=int, default=1, help="Commands in flight per connection.")
+    args = parser.parse_args()
+
+    stats, elapsed = asyncio.run(replay(args.capture, args.host, args.port, args.speed, args.pipeline))
+    report(stats, elapsed)
@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cachica import bitmap
+from cachica.datastore import DataStore
+from cachica.executor import CommandExecutor
+
+
+@pytest.fixture
+def datastore():
+    return DataStore()
+
+
+def test_set_and_get_bit():
+    data = bytearray()
+    assert bitmap.set_bit(data, 7, 1) == 0
+    assert data == bytearray(b"\x01")
+    assert bitmap.set_bit(data, 7, 0) == 1
+    assert bitmap.set_bit(data, 100, 1) == 0
+    assert len(data) == 13
+    assert bitmap.get_bit(data, 100) == 1
+    assert bitmap.get_bit(data, 10_000) == 0
+
+
+def test_count_bits_spans_chunks():
+    data = bytearray(b"\xff") * (bitmap.CHUNK_SIZE * 3 + 5)
+    assert bitmap.count_bits(data) == len(data) * 8
+    assert bitmap.count_bits(data, 3, 10) == 56
+
+
+@pytest.mark.parametrize("bit", [0, 1])
+def test_find_bit_respects_range(bit):
+    fill = b"\x00" if bit else b"\xff"
+    data = bytearray(fill) * (bitmap.CHUNK_SIZE + 10)
+    for offset in (3, 8 * bitmap.CHUNK_SIZE + 9, 8 * len(data) - 1):
+        bitmap.set_bit(data, offset, bit)
+    assert bitmap.find_bit(data, bit, 0, 8 * len(data) - 1) == 3
+    assert bitmap.find_bit(data, bit, 4, 8 * len(data) - 1) == 8 * bitmap.CHUNK_SIZE + 9
+    assert bitmap.find_bit(data, bit, 4, 8 * bitmap.CHUNK_SIZE + 8) == -1
+    assert bitmap.find_bit(data, bit, 8 * bitmap.CHUNK_SIZE + 10, 8 * len(data) - 1) == 8 * len(data) - 1
+
+
+def test_bit_op_pads_shorter_values():
+    assert bitmap.bit_op("AND", [b"\xff\xff", b"\x0f"]) == bytearray(b"\x0f\x00")
+    assert bitmap.bit_op("OR", [b"\xf0", b"\x0f\x01"]) == bytearray(b"\xff\x01")
+    assert bitmap.bit_op("XOR", [b"\xff", b"\x0f"]) == bytearray(b"\xf0")
+    assert bitmap.bit_op("NOT", [b"\x0f"]) == bytearray(b"\xf0")
+    assert bitmap.bit_op("OR", [b"", b""]) == bytearray()
+
+
+def test_setbit_getbit(datastore):
+    assert datastore.process(["SETBIT", "flags", "7", "1"]) == b":0\r\n"
+    assert datastore.process(["SETBIT", "flags", "7", "0"]) == b":1\r\n"
+    assert datastore.process(["GETBIT", "flags", "7"]) == b":0\r\n"
+    assert datastore.process(["GETBIT", "missing", "7"]) == b":0\r\n"
+    assert datastore.process(["SETBIT", "flags", "-1", "1"]).startswith(b"-ERR bit offset")
+    assert datastore.process(["SETBIT", "flags", "1", "2"]).startswith(b"-ERR bit is not")
+
+
+def test_setbit_on_plain_string_keeps_value_and_ttl(datastore):
+    datastore.process(["SET", "name", "a", "EX", "100"])
+    # "a" is 0b01100001, setting bit 6 turns it into "c"
+    assert datastore.process(["SETBIT", "name", "6", "1"]) == b":0\r\n"
+    assert datastore.process(["GET", "name"]) == b"$1\r\nc\r\n"
+    assert datastore.process(["TTL", "name"]) == b":100\r\n"
+
+
+def test_bitcount(datastore):
+    datastore.process(["SET", "key", "foobar"])
+    assert datastore.process(["BITCOUNT", "key"]) == b":26\r\n"
+    assert datastore.process(["BITCOUNT", "key", "0", "0"]) == b":4\r\n"
+    assert datastore.process(["BITCOUNT", "key", "1", "1"]) == b":6\r\n"
+    assert datastore.process(["BITCOUNT", "key", "1", "1", "BYTE"]) == b":6\r\n"
+    assert datastore.process(["BITCOUNT", "key", "5", "30", "BIT"]) == b":17\r\n"
+    assert datastore.process(["BITCOUNT", "key", "-2", "-1"]) == b":7\r\n"
+    assert datastore.process(["BITCOUNT", "missing"]) == b":0\r\n"
+    assert datastore.process(["BITCOUNT", "key", "0"]) == b"-ERR syntax error\r\n"
+
+
+def test_bitpos(datastore):
+    datastore.process(["SETBIT", "bits", "0", "0"])
+    datastore.process(["SETBIT", "bits", "20", "1"])
+    assert datastore.process(["BITPOS", "bits", "1"]) == b":20\r\n"
+    assert datastore.process(["BITPOS", "bits", "1", "3"]) == b":-1\r\n"
+    assert datastore.process(["BITPOS", "bits", "0", "2"]) == b":16\r\n"
+    assert datastore.process(["BITPOS", "bits", "1", "2", "-1", "BYTE"]) == b":20\r\n"
+    assert datastore.process(["BITPOS", "bits", "1", "7", "15", "BIT"]) == b":-1\r\n"
+    assert datastore.process(["BITPOS", "missing", "0"]) == b":0\r\n"
+    assert datastore.process(["BITPOS", "missing", "1"]) == b":-1\r\n"
+    datastore.process(["BITOP", "NOT", "ones", "bits"])
+    datastore.process(["BITOP", "OR", "ones", "ones", "bits"])
+    # All ones: without an end the value counts as padded with zeros
+    assert datastore.process(["BITPOS", "ones", "0"]) == b":24\r\n"
+    assert datastore.process(["BITPOS", "ones", "0", "0", "-1"]) == b":-1\r\n"
+    # A start past the end of the string is an empty range, no zero padding then
+    datastore.process(["SET", "short", "AAA"])
+    assert datastore.process(["BITPOS", "short", "0", "10"]) == b":-1\r\n"
+    assert datastore.process(["BITPOS", "short", "1", "10"]) == b":-1\r\n"
+    assert datastore.process(["BITPOS", "short", "0", "24", "-1", "BIT"]) == b":-1\r\n"
+
+
+def test_bitop(datastore):
+    datastore.process(["SETBIT", "a", "0", "1"])
+    datastore.process(["SETBIT", "a", "9", "1"])
+    datastore.process(["SETBIT", "b", "0", "1"])
+    assert datastore.process(["BITOP", "AND", "dest", "a", "b"]) == b":2\r\n"
+    assert datastore.process(["BITCOUNT", "dest"]) == b":1\r\n"
+    assert datastore.process(["BITOP", "XOR", "dest", "a", "b", "missing"]) == b":2\r\n"
+    assert datastore.process(["GETBIT", "dest", "9"]) == b":1\r\n"
+    assert datastore.process(["BITOP", "NOT", "dest", "a", "b"]).startswith(b"-ERR BITOP NOT")
+    assert datastore.process(["BITOP", "OR", "dest", "missing"]) == b":0\r\n"
+    assert datastore.process(["GET", "dest"]) == b"$-1\r\n"
+
+
+def test_bitmap_commands_check_type(datastore):
+    datastore.process(["LPUSH", "list", "a"])
+    for command in (["SETBIT", "list", "0", "1"], ["GETBIT", "list", "0"], ["BITCOUNT", "list"]):
+        assert datastore.process(command) == b"-ERR wrong type\r\n"
+
+
+def test_binary_values_in_replies(datastore):
+    datastore.process(["SETBIT", "bits", "0", "1"])
+    assert datastore.process(["GET", "bits"]) == b"$1\r\n\x80\r\n"
+    assert datastore.process(["MGET", "bits", "missing"]) == b"*2\r\n$1\r\n\x80\r\n$-1\r\n"
+
+
+@pytest.mark.asyncio
+async def test_large_bitcount_is_offloaded():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        executor = CommandExecutor(pool, cost_threshold=1024)
+        datastore = DataStore(executor=executor)
+        datastore.process(["SETBIT", "bits", str(8 * 4096 - 1), "1"])
+        datastore.process(["SETBIT", "bits", "3", "1"])
+        response = datastore.process(["BITCOUNT", "bits"])
+        assert type(response) is not bytes
+        assert await response == b":2\r\n"
+        assert executor.stats.offloaded == 1
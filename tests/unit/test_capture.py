@@ -0,0 +1,92 @@
+import pytest
+
+from cachica.capture import MAGIC, CommandCapture, read_capture
+from cachica.protocol import Parser, encode_array
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / "traffic.cap")
+    capture = CommandCapture()
+    capture.start(path)
+    capture.record(1, ["SET", "key", "value"])
+    capture.record(2, ["GET", "key"])
+    capture.record(1, ["DEL", "key"])
+    capture.stop()
+    capture.wait()
+    assert not capture.enabled
+    records = list(read_capture(path))
+    assert [(r.connection_id, r.payload) for r in records] == [
+        (1, encode_array(["SET", "key", "value"])),
+        (2, encode_array(["GET", "key"])),
+        (1, encode_array(["DEL", "key"])),
+    ]
+    assert records[0].offset_ns <= records[1].offset_ns <= records[2].offset_ns
+
+
+def test_full_buffer_drops_commands():
+    capture = CommandCapture(buffer_size=2)
+    for i in range(5):
+        capture.record(1, ["GET", str(i)])
+    assert (capture.captured, capture.dropped) == (2, 3)
+
+
+def test_restarting_replaces_the_file(tmp_path):
+    first, second = str(tmp_path / "first.cap"), str(tmp_path / "second.cap")
+    capture = CommandCapture()
+    capture.set_path(first)
+    capture.record(1, ["PING"])
+    capture.set_path(second)
+    capture.record(1, ["ECHO", "hi"])
+    capture.set_path("")
+    capture.wait()
+    assert [r.payload for r in read_capture(first)] == [encode_array(["PING"])]
+    assert [r.payload for r in read_capture(second)] == [encode_array(["ECHO", "hi"])]
+
+
+def test_unwritable_path_leaves_capture_off(tmp_path):
+    capture = CommandCapture()
+    capture.set_path(str(tmp_path / "missing" / "traffic.cap"))
+    capture.wait()
+    assert not capture.enabled
+    capture.record(1, ["PING"])
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = tmp_path / "traffic.cap"
+    capture = CommandCapture()
+    capture.start(str(path))
+    capture.record(1, ["SET", "key", "value"])
+    capture.record(1, ["GET", "key"])
+    capture.stop()
+    capture.wait()
+    path.write_bytes(path.read_bytes()[:-3])
+    assert [r.payload for r in read_capture(str(path))] == [encode_array(["SET", "key", "value"])]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a capture" + MAGIC)
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+def test_non_ascii_commands_round_trip(tmp_path):
+    path = str(tmp_path / "traffic.cap")
+    capture = CommandCapture()
+    capture.start(path)
+    capture.record(1, ["SET", "café", "naïve ☕"])
+    capture.stop()
+    capture.wait()
+    [record] = read_capture(path)
+    parser = Parser()
+    parser.feed(record.payload)
+    assert parser.get_command() == ["SET", "café", "naïve ☕"]
+
+
+def test_writer_error_turns_capture_off(tmp_path, caplog):
+    capture = CommandCapture()
+    capture.start(str(tmp_path / "traffic.cap"))
+    capture.record(1, ["SET", object()])
+    capture.wait()
+    assert not capture.enabled
+    assert "Capturing commands to" in caplog.text
@@ -0,0 +1,54 @@
+from collections import Counter
+
+import pytest
+
+from cachica.client import HashRing
+
+KEYS = [f"key:{i}" for i in range(10_000)]
+NODES = ["10.0.0.1:8888", "10.0.0.2:8888", "10.0.0.3:8888", "10.0.0.4:8888"]
+
+
+def test_keys_are_spread_over_nodes():
+    ring = HashRing(NODES)
+    counts = Counter(ring.node_for(key) for key in KEYS)
+    assert set(counts) == set(NODES)
+    assert min(counts.values()) > len(KEYS) / len(NODES) * 0.7
+
+
+def test_weights_scale_share():
+    ring = HashRing({NODES[0]: 1, NODES[1]: 3})
+    counts = Counter(ring.node_for(key) for key in KEYS)
+    assert 2 < counts[NODES[1]] / counts[NODES[0]] < 4
+
+
+def test_removing_a_node_only_moves_its_keys():
+    ring = HashRing(NODES)
+    before = {key: ring.node_for(key) for key in KEYS}
+    ring.remove_node(NODES[1])
+    after = {key: ring.node_for(key) for key in KEYS}
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(before[key] == NODES[1] for key in moved)
+    assert NODES[1] not in after.values()
+
+
+def test_adding_a_node_moves_a_proportional_share():
+    ring = HashRing(NODES)
+    before = {key: ring.node_for(key) for key in KEYS}
+    ring.add_node("10.0.0.5:8888")
+    moved = [key for key in KEYS if ring.node_for(key) != before[key]]
+    assert all(ring.node_for(key) == "10.0.0.5:8888" for key in moved)
+    assert len(moved) < len(KEYS) / 5 * 1.3
+
+
+def test_ring_is_stable_across_instances():
+    assert [HashRing(NODES).node_for(key) for key in KEYS[:100]] == [
+        HashRing(reversed(NODES)).node_for(key) for key in KEYS[:100]
+    ]
+
+
+def test_empty_ring():
+    ring = HashRing()
+    with pytest.raises(LookupError):
+        ring.node_for("key")
+    with pytest.raises(KeyError):
+        ring.remove_node("missing")
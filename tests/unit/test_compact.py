@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+from cachica.compact import CompactDataStore, CompactKeyspace
+
+
+@pytest.fixture
+def keyspace():
+    return CompactKeyspace(capacity=8, segment_size=256)
+
+
+@pytest.fixture
+def datastore():
+    return CompactDataStore(keyspace=CompactKeyspace(capacity=8, segment_size=256))
+
+
+def test_set_and_get(keyspace):
+    keyspace.set("name", "cachica")
+    assert keyspace.get("name") == "cachica"
+    assert keyspace.get("missing") is None
+    assert len(keyspace) == 1
+
+
+def test_overwrite_keeps_single_entry(keyspace):
+    keyspace.set("name", "cachica")
+    keyspace.set("name", "redis")
+    assert keyspace.get("name") == "redis"
+    assert len(keyspace) == 1
+
+
+def test_delete(keyspace):
+    keyspace.set("name", "cachica")
+    assert keyspace.delete("name") is True
+    assert keyspace.delete("name") is False
+    assert keyspace.get("name") is None
+    assert len(keyspace) == 0
+
+
+def test_non_ascii_values(keyspace):
+    keyspace.set("ključ", "vrednost ✓")
+    assert keyspace.get("ključ") == "vrednost ✓"
+
+
+def test_index_grows(keyspace):
+    for i in range(1000):
+        keyspace.set(f"key:{i}", f"value:{i}")
+    assert len(keyspace) == 1000
+    assert all(keyspace.get(f"key:{i}") == f"value:{i}" for i in range(1000))
+    assert sorted(keyspace.keys()) == sorted(f"key:{i}" for i in range(1000))
+
+
+def test_oversized_record_gets_own_segment(keyspace):
+    value = "x" * 1000
+    keyspace.set("big", value)
+    keyspace.set("small", "v")
+    assert keyspace.get("big") == value
+    assert keyspace.get("small") == "v"
+    keyspace.delete("big")
+    assert int(keyspace.info()["compact_arena_segments"]) == 1
+
+
+def test_passive_expiry(keyspace):
+    keyspace.set("name", "cachica", expire_at=time.monotonic() - 1)
+    assert keyspace.get("name") is None
+    assert len(keyspace) == 0
+
+
+def test_overwrite_clears_expiry(keyspace):
+    keyspace.set("name", "cachica", expire_at=time.monotonic() + 10)
+    keyspace.set("name", "redis")
+    assert keyspace.get_expiry("name") == 0.0
+
+
+def test_active_expiry(keyspace):
+    past = time.monotonic() - 1
+    for i in range(100):
+        keyspace.set(f"key:{i}", "v", expire_at=past)
+    keyspace.set("keep", "v")
+    while keyspace.evict_expired(window=16):
+        pass
+    # A full sweep of the index may be needed after the last hit
+    for _ in range(32):
+        keyspace.evict_expired(window=16)
+    assert len(keyspace) == 1
+    assert keyspace.info()["compact_volatile_keys"] == "0"
+
+
+def test_defragment_releases_dead_segments(keyspace):
+    for i in range(200):
+        keyspace.set(f"key:{i}", f"value:{i}")
+    for i in range(0, 200, 4):
+        keyspace.delete(f"key:{i}")
+    for i in range(1, 200, 4):
+        keyspace.delete(f"key:{i}")
+    garbage_before = int(keyspace.info()["compact_garbage_bytes"])
+    while keyspace.defragment(budget=5):
+        pass
+    assert int(keyspace.info()["compact_garbage_bytes"]) < garbage_before
+    survivors = [i for i in range(200) if i % 4 in (2, 3)]
+    assert all(keyspace.get(f"key:{i}") == f"value:{i}" for i in survivors)
+    assert len(keyspace) == len(survivors)
+
+
+def test_datastore_string_commands(datastore):
+    assert datastore.process(["SET", "name", "cachica"]) == b"+OK\r\n"
+    assert datastore.process(["GET", "name"]) == b"$7\r\ncachica\r\n"
+    assert datastore.process(["DEL", "name", "other"]) == b":1\r\n"
+    assert datastore.process(["GET", "name"]) == b"$-1\r\n"
+
+
+def test_datastore_set_with_expiry(datastore):
+    datastore.process(["SET", "name", "cachica", "PX", "1"])
+    time.sleep(0.002)
+    assert datastore.process(["GET", "name"]) == b"$-1\r\n"
+
+
+def test_datastore_lists_live_beside_strings(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["LPUSH", "name", "a"]) == b"-ERR wrong type\r\n"
+    datastore.process(["LPUSH", "list", "a"])
+    assert datastore.process(["GET", "list"]) == b"$-1\r\n"
+    assert datastore.process(["SET", "list", "now a string"]) == b"+OK\r\n"
+    assert datastore.process(["GET", "list"]) == b"$12\r\nnow a string\r\n"
+    assert datastore.process(["LPOP", "list"]) == b"-ERR wrong type\r\n"
+
+
+def test_datastore_expired_strings_do_not_block_lists(datastore):
+    for key in ("a", "b", "c"):
+        datastore.process(["SET", key, "cachica", "PX", "1"])
+    time.sleep(0.002)
+    assert datastore.process(["LRANGE", "a", "0", "-1"]) == b"*0\r\n"
+    # As for any missing key
+    assert datastore.process(["LPOP", "b"]) == b"-ERR wrong key\r\n"
+    assert datastore.process(["LPUSH", "c", "x"]) == b":1\r\n"
+    assert datastore.process(["LRANGE", "c", "0", "-1"]) == b"*1\r\n$1\r\nx\r\n"
+
+
+def test_datastore_info_reports_compact_engine(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    info = datastore.process(["INFO", "storage"]).decode()
+    assert "storage_engine:compact" in info
+    assert "compact_keys:1" in info
+
+
+def test_datastore_expiry_commands(datastore):
+    datastore.process(["SET", "name", "cachica", "EX", "100"])
+    assert datastore.process(["TTL", "name"]) == b":100\r\n"
+    datastore.process(["SET", "name", "redis"])
+    assert datastore.process(["TTL", "name"]) == b":-1\r\n"
+    assert datastore.process(["PEXPIRE", "name", "1"]) == b":1\r\n"
+    time.sleep(0.002)
+    assert datastore.process(["TTL", "name"]) == b":-2\r\n"
+    assert datastore.process(["SET", "name", "a", "NX", "GET"]) == b"$-1\r\n"
+    assert datastore.process(["PERSIST", "name"]) == b":0\r\n"
+
+
+def test_datastore_probabilistic_types_check_compact_strings(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["PFADD", "name", "a"]) == b"-ERR wrong type\r\n"
+    assert datastore.process(["BF.ADD", "name", "a"]) == b"-ERR wrong type\r\n"
+    assert datastore.process(["PFADD", "visitors", "a", "b"]) == b":1\r\n"
+    assert datastore.process(["PFCOUNT", "visitors"]) == b":2\r\n"
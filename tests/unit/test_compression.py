@@ -0,0 +1,77 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cachica.compression import CompressedString, Compressor, parse_rules
+from cachica.datastore import DataStore
+
+BLOB = '{"user": "cachica", "items": [1, 2, 3]}' * 100
+
+
+@pytest.fixture
+def datastore():
+    return DataStore(compressor=Compressor(threshold=1024))
+
+
+def test_parse_rules():
+    assert parse_rules("html:=512, session:=off") == {"html:": 512, "session:": None}
+    assert parse_rules("") == {}
+
+
+def test_parse_rules_invalid():
+    with pytest.raises(ValueError):
+        parse_rules("html:512")
+
+
+def test_longest_prefix_rule_wins():
+    compressor = Compressor(threshold=1024, rules={"page:": 100, "page:raw:": None})
+    assert compressor.threshold_for("page:home") == 100
+    assert compressor.threshold_for("page:raw:home") is None
+    assert compressor.threshold_for("user:1") == 1024
+
+
+def test_large_value_is_stored_compressed(datastore):
+    assert datastore.process(["SET", "blob", BLOB]) == b"+OK\r\n"
+    stored = datastore._get("blob")
+    assert type(stored) is CompressedString
+    assert len(stored.payload) < len(BLOB)
+    assert datastore.process(["GET", "blob"]) == f"${len(BLOB)}\r\n{BLOB}\r\n".encode()
+
+
+def test_small_value_is_stored_as_is(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore._get("name") == "cachica"
+
+
+def test_incompressible_value_is_stored_as_is():
+    datastore = DataStore(compressor=Compressor(threshold=10))
+    value = "".join(chr(33 + (i * 7919) % 90) for i in range(64))
+    datastore.process(["SET", "noise", value])
+    assert datastore._get("noise") == value
+    assert datastore._compressor.stats.skipped == 1
+
+
+def test_compression_stats_in_info(datastore):
+    datastore.process(["SET", "blob", BLOB])
+    datastore.process(["GET", "blob"])
+    info = datastore.process(["INFO", "compression"]).decode()
+    assert "compressed_values:1" in info
+    assert "decompressed_values:1" in info
+    assert "compression_ratio:" in info
+
+
+@pytest.mark.asyncio
+async def test_large_values_are_offloaded_to_executor():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        datastore = DataStore(compressor=Compressor(threshold=1024, executor=executor, offload_threshold=2048))
+        datastore.process(["SET", "blob", BLOB])
+        # Compression runs in the background, the raw value is served until it completes
+        assert datastore._get("blob") == BLOB
+        while type(datastore._get("blob")) is not CompressedString:
+            await asyncio.sleep(0.001)
+
+        response = datastore.process(["GET", "blob"])
+        assert type(response) is not bytes
+        assert await response == f"${len(BLOB)}\r\n{BLOB}\r\n".encode()
+        assert datastore._compressor.stats.offloaded == 2
@@ -0,0 +1,241 @@
+import logging
+import queue
+
+import pytest
+
+from cachica.config import (
+    CommandLogSampler,
+    Config,
+    ConfigError,
+    DroppingQueueHandler,
+    NetworkConfig,
+    parse_bind_addresses,
+)
+from cachica.datastore import DataStore
+
+ENV_VARS = ("BIND", "UNIX_SOCKET", "UNIX_SOCKET_PERMISSIONS", "TCP_NODELAY", "SO_RCVBUF", "LOG_LEVEL", "LAZYFREE")
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for name in ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "cachica.conf"
+    path.write_text("# tuned for the sidecar\nread-buffer-size 65536\n\nlog-level debug\n")
+    return path
+
+
+def test_parse_bind_addresses():
+    assert parse_bind_addresses("0.0.0.0:8888, 127.0.0.1:8889,[::1]:8890") == [
+        ("0.0.0.0", 8888),
+        ("127.0.0.1", 8889),
+        ("::1", 8890),
+    ]
+    assert parse_bind_addresses(":8888") == [("0.0.0.0", 8888)]
+    assert parse_bind_addresses("") == []
+
+
+@pytest.mark.parametrize("spec", ["localhost", "localhost:http"])
+def test_parse_bind_addresses_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_bind_addresses(spec)
+
+
+def test_defaults():
+    config = Config.load()
+    assert config.active_expire_interval == 0.1
+    assert config.active_expire_samples == 10
+    assert config.read_buffer_size == 1024
+    assert config.get("lazyfree") == "no"
+    assert config.get("compression-threshold") == "off"
+
+
+def test_file_then_env(config_file, monkeypatch):
+    monkeypatch.setenv("LOG_LEVEL", "warning")
+    config = Config.load(str(config_file))
+    assert config.read_buffer_size == 65536
+    assert config.log_level == "WARNING"
+
+
+def test_invalid_value_in_file(tmp_path):
+    path = tmp_path / "cachica.conf"
+    path.write_text("read-buffer-size lots\n")
+    with pytest.raises(ConfigError):
+        Config.load(str(path))
+
+
+def test_set_notifies_callbacks():
+    config = Config()
+    seen = []
+    config.on_change("active-expire-samples", seen.append)
+    config.set("active-expire-samples", "20")
+    assert config.active_expire_samples == 20
+    assert seen == [20]
+
+
+def test_immutable_parameter_cannot_be_set():
+    with pytest.raises(ConfigError):
+        Config().set("storage-engine", "compact")
+
+
+@pytest.mark.parametrize("name, value", [("lazyfree", "maybe"), ("log-level", "loud"), ("compression-rules", "x")])
+def test_validate_rejects_invalid_values(name, value):
+    with pytest.raises(ConfigError):
+        Config().validate(name, value)
+
+
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("active-expire-interval", "0"),
+        ("active-expire-interval", "nan"),
+        ("active-expire-samples", "-1"),
+        ("read-buffer-size", "0"),
+        ("compression-level", "10"),
+        ("tcp-keepalive", "-5"),
+        ("command-log-sample-rate", "-1"),
+    ],
+)
+def test_validate_rejects_out_of_range_values(name, value):
+    with pytest.raises(ConfigError, match="must be at"):
+        Config().validate(name, value)
+
+
+@pytest.mark.parametrize("value", ["/etc/passwd", "../traffic.cap", "captures/traffic.cap", ".."])
+def test_capture_file_must_be_a_bare_file_name(value):
+    config = Config()
+    with pytest.raises(ConfigError, match="without a directory"):
+        config.set("capture-file", value)
+    config.set("capture-file", "traffic.cap")
+    assert config.capture_file == "traffic.cap"
+    with pytest.raises(ConfigError, match="immutable"):
+        config.set("capture-dir", "/etc")
+
+
+def test_out_of_range_value_from_the_environment(monkeypatch):
+    monkeypatch.setenv("ACTIVE_EXPIRE_SAMPLES", "0")
+    with pytest.raises(ConfigError, match="'active-expire-samples': must be at least 1"):
+        Config.load()
+
+
+def test_rewrite_keeps_comments_and_appends_changes(config_file):
+    config = Config.load(str(config_file))
+    config.set("read-buffer-size", "4096")
+    config.set("lazyfree", "yes")
+    config.rewrite()
+    expected = "# tuned for the sidecar\nread-buffer-size 4096\n\nlog-level DEBUG\nlazyfree yes\n"
+    assert config_file.read_text() == expected
+    assert Config.load(str(config_file)).lazyfree is True
+
+
+def test_rewrite_without_file():
+    with pytest.raises(ConfigError):
+        Config().rewrite()
+
+
+def test_network_config_defaults():
+    network = NetworkConfig.from_config(Config.load())
+    assert network.bind == [("0.0.0.0", 8888)]
+    assert network.unix_sockets == []
+    assert network.tcp_nodelay is True
+
+
+def test_network_config_unix_socket_only(monkeypatch):
+    monkeypatch.setenv("UNIX_SOCKET", "/tmp/cachica.sock")
+    monkeypatch.setenv("UNIX_SOCKET_PERMISSIONS", "770")
+    monkeypatch.setenv("TCP_NODELAY", "no")
+    monkeypatch.setenv("SO_RCVBUF", "262144")
+    network = NetworkConfig.from_config(Config.load())
+    assert network.bind == []
+    assert network.unix_sockets == ["/tmp/cachica.sock"]
+    assert network.unix_socket_permissions == 0o770
+    assert network.tcp_nodelay is False
+    assert network.receive_buffer == 262144
+
+
+def test_config_get_command():
+    datastore = DataStore()
+    assert datastore.process(["CONFIG", "GET", "active-expire-*"]) == (
+        b"*4\r\n$22\r\nactive-expire-interval\r\n$3\r\n0.1\r\n$21\r\nactive-expire-samples\r\n$2\r\n10\r\n"
+    )
+    assert datastore.process(["CONFIG", "GET", "nothing"]) == b"*0\r\n"
+
+
+def test_config_set_command():
+    config = Config()
+    datastore = DataStore(config=config)
+    assert datastore.process(["CONFIG", "SET", "active-expire-samples", "50", "lazyfree", "yes"]) == b"+OK\r\n"
+    assert config.active_expire_samples == 50
+    assert datastore._lazyfree is True
+
+
+def test_config_set_command_is_all_or_nothing():
+    config = Config()
+    datastore = DataStore(config=config)
+    resp = datastore.process(["CONFIG", "SET", "active-expire-samples", "50", "read-buffer-size", "big"])
+    assert resp.startswith(b"-ERR CONFIG SET failed: invalid value for 'read-buffer-size'")
+    assert config.active_expire_samples == 10
+
+
+def test_config_set_command_rejects_out_of_range_values():
+    config = Config()
+    datastore = DataStore(config=config)
+    resp = datastore.process(["CONFIG", "SET", "compression-level", "-1"])
+    assert resp == b"-ERR CONFIG SET failed: invalid value for 'compression-level': must be at least 0, got '-1'\r\n"
+    assert config.compression_level == 6
+
+
+def test_config_set_immutable_command():
+    resp = DataStore().process(["CONFIG", "SET", "bind", "127.0.0.1:1"])
+    assert resp == b"-ERR CONFIG SET failed: can't set immutable config parameter 'bind'\r\n"
+
+
+def test_config_rewrite_command(config_file):
+    config = Config.load(str(config_file))
+    datastore = DataStore(config=config)
+    datastore.process(["CONFIG", "SET", "read-buffer-size", "2048"])
+    assert datastore.process(["CONFIG", "REWRITE"]) == b"+OK\r\n"
+    assert "read-buffer-size 2048" in config_file.read_text()
+
+
+def test_config_unknown_subcommand():
+    resp = DataStore().process(["CONFIG", "RESETSTAT"])
+    assert resp == b"-ERR unknown subcommand 'RESETSTAT' for 'config' command\r\n"
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    logger = logging.getLogger("cachica.test.queue")
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        for i in range(5):
+            logger.warning("message %d", i)
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+    # Formatting is left to the writer thread
+    assert handler.queue.get_nowait().args == (0,)
+
+
+def test_command_log_is_disabled_above_debug(caplog):
+    caplog.set_level(logging.INFO, logger="cachica.test.commands")
+    sampler = CommandLogSampler(logging.getLogger("cachica.test.commands"))
+    assert not sampler.enabled
+    caplog.set_level(logging.DEBUG, logger="cachica.test.commands")
+    sampler.refresh()
+    assert sampler.enabled
+
+
+def test_command_log_sampling_and_rate_limit(caplog):
+    caplog.set_level(logging.DEBUG, logger="cachica.test.commands")
+    sampler = CommandLogSampler(logging.getLogger("cachica.test.commands"), sample_rate=2, max_per_second=3)
+    for i in range(20):
+        sampler.log(("127.0.0.1", 1234), ["GET", f"key:{i}"])
+    assert len(caplog.records) == 3
+    assert sampler.suppressed == 7
@@ -1,6 +1,16 @@
+import time
+
 import pytest
 
-from cachica.datastore import DataStore
+from cachica import protocol
+from cachica.datastore import CacheValue, DataStore, DataType
+from cachica.protocol import Parser
+
+
+def parse_array(response: bytes) -> list[str]:
+    parser = Parser(is_client=True)
+    parser.feed(response)
+    return parser.get_command()
 
 
 @pytest.fixture
@@ -13,7 +23,7 @@ def populated_datastore_factory():
     def _create_datastore(initial_data: dict[str, str]):
         ds = DataStore()
         for key, value in initial_data.items():
-            ds._set(key, value)
+            ds._set(key, CacheValue(DataType.STRING, value))
         return ds
 
     return _create_datastore
@@ -72,9 +82,9 @@ def test_set_too_few_args_returns_error(datastore):
     assert datastore.process(command) == b"-ERR wrong number of arguments for 'set' command\r\n"
 
 
-def test_set_too_many_args_returns_error(datastore):
+def test_set_unknown_option_returns_error(datastore):
     command = ["SET", "name", "cachica", "server"]
-    assert datastore.process(command) == b"-ERR wrong number of arguments for 'set' command\r\n"
+    assert datastore.process(command) == b"-ERR syntax error\r\n"
 
 
 def test_valid_get(populated_datastore_factory):
@@ -126,3 +136,194 @@ def test_del_no_args_returns_error(datastore):
     command = ["DEL"]
     resp = datastore.process(command)
     assert resp == b"-ERR wrong number of arguments for 'del' command\r\n"
+
+
+def test_unlink_removes_keys(datastore):
+    datastore.process(["SET", "app", "redis"])
+    datastore.process(["SET", "fruit", "banana"])
+    resp = datastore.process(["UNLINK", "app", "name"])
+    assert resp == b":1\r\n"
+    assert datastore.process(["GET", "fruit"]) == b"$6\r\nbanana\r\n"
+
+
+def test_unlink_no_args_returns_error(datastore):
+    assert datastore.process(["UNLINK"]) == b"-ERR wrong number of arguments for 'unlink' command\r\n"
+
+
+def test_unlink_large_list_is_freed_in_slices(datastore):
+    datastore.process(["LPUSH", "list", *[str(i) for i in range(500)]])
+    assert datastore.process(["UNLINK", "list"]) == b":1\r\n"
+    assert datastore.lazyfree_pending() == 1
+    assert datastore.free_lazy(budget=200) == 200
+    assert datastore.free_lazy(budget=200) == 200
+    assert datastore.free_lazy(budget=200) == 100
+    assert datastore.lazyfree_pending() == 0
+
+
+def test_unlink_small_list_is_freed_inline(datastore):
+    datastore.process(["LPUSH", "list", "a", "b"])
+    datastore.process(["UNLINK", "list"])
+    assert datastore.lazyfree_pending() == 0
+
+
+def test_del_is_lazy_only_in_lazyfree_mode():
+    eager = DataStore()
+    lazy = DataStore(lazyfree=True)
+    for ds in (eager, lazy):
+        ds.process(["LPUSH", "list", *[str(i) for i in range(500)]])
+        ds.process(["DEL", "list"])
+    assert eager.lazyfree_pending() == 0
+    assert lazy.lazyfree_pending() == 1
+
+
+def test_overwrite_in_lazyfree_mode_queues_old_value():
+    datastore = DataStore(lazyfree=True)
+    datastore.process(["LPUSH", "list", *[str(i) for i in range(500)]])
+    assert datastore.process(["SET", "list", "value"]) == b"+OK\r\n"
+    assert datastore.lazyfree_pending() == 1
+    assert datastore.process(["GET", "list"]) == b"$5\r\nvalue\r\n"
+
+
+@pytest.mark.parametrize(
+    "start, stop, expected",
+    [
+        ("0", "-1", ["a", "b", "c"]),
+        ("1", "1", ["b"]),
+        ("-2", "10", ["b", "c"]),
+        ("2", "1", []),
+    ],
+)
+def test_lrange(datastore, start, stop, expected):
+    datastore.process(["LPUSH", "list", "a", "b", "c"])
+    assert datastore.process(["LRANGE", "list", start, stop]) == protocol.encode_array(expected)
+
+
+def test_lrange_missing_key_returns_empty_array(datastore):
+    assert datastore.process(["LRANGE", "list", "0", "-1"]) == b"*0\r\n"
+
+
+def test_lrange_wrong_type(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["LRANGE", "name", "0", "-1"]) == b"-ERR wrong type\r\n"
+
+
+def test_lrange_invalid_index(datastore):
+    datastore.process(["LPUSH", "list", "a"])
+    assert datastore.process(["LRANGE", "list", "a", "1"]) == b"-ERR value is not an integer or out of range\r\n"
+
+
+def test_keys(datastore):
+    datastore.process(["SET", "user:1", "a"])
+    datastore.process(["SET", "user:2", "b"])
+    datastore.process(["SET", "session:1", "c"])
+    datastore.process(["SET", "user:3", "d", "PX", "1"])
+    time.sleep(0.002)
+    assert datastore.process(["KEYS", "user:*"]) == protocol.encode_array(["user:1", "user:2"])
+    assert len(parse_array(datastore.process(["KEYS", "*"]))) == 3
+
+
+def test_plain_set_clears_ttl(datastore):
+    datastore.process(["SET", "name", "cachica", "EX", "100"])
+    datastore.process(["SET", "name", "redis"])
+    assert datastore.process(["TTL", "name"]) == b":-1\r\n"
+    assert len(datastore._volatile) == 0
+
+
+def test_del_forgets_ttl(datastore):
+    datastore.process(["SET", "name", "cachica", "EX", "100"])
+    datastore.process(["DEL", "name"])
+    assert len(datastore._volatile) == 0
+
+
+def test_set_nx_xx(datastore):
+    assert datastore.process(["SET", "lock", "a", "NX"]) == b"+OK\r\n"
+    assert datastore.process(["SET", "lock", "b", "NX"]) == b"$-1\r\n"
+    assert datastore.process(["SET", "missing", "b", "XX"]) == b"$-1\r\n"
+    assert datastore.process(["SET", "lock", "c", "XX", "GET"]) == b"$1\r\na\r\n"
+    assert datastore.process(["GET", "lock"]) == b"$1\r\nc\r\n"
+
+
+def test_set_get_on_list_returns_error(datastore):
+    datastore.process(["LPUSH", "list", "a"])
+    assert datastore.process(["SET", "list", "a", "GET"]) == b"-ERR wrong type\r\n"
+
+
+def test_set_keepttl(datastore):
+    datastore.process(["SET", "name", "cachica", "PX", "100000"])
+    datastore.process(["SET", "name", "redis", "KEEPTTL"])
+    assert int(datastore.process(["PTTL", "name"])[1:-2]) > 99_000
+
+
+@pytest.mark.parametrize(
+    "options",
+    [["EX", "0"], ["EX", "ten"], ["PX", "-1"]],
+)
+def test_set_invalid_expire_time(datastore, options):
+    assert datastore.process(["SET", "name", "cachica", *options]) == (
+        b"-ERR invalid expire time in 'set' command\r\n"
+    )
+
+
+@pytest.mark.parametrize("options", [["EX"], ["NX", "XX"], ["EX", "1", "KEEPTTL"]])
+def test_set_syntax_error(datastore, options):
+    assert datastore.process(["SET", "name", "cachica", *options]) == b"-ERR syntax error\r\n"
+
+
+def test_expire_ttl_persist(datastore):
+    assert datastore.process(["EXPIRE", "name", "10"]) == b":0\r\n"
+    assert datastore.process(["TTL", "name"]) == b":-2\r\n"
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["TTL", "name"]) == b":-1\r\n"
+    assert datastore.process(["EXPIRE", "name", "10"]) == b":1\r\n"
+    assert datastore.process(["TTL", "name"]) == b":10\r\n"
+    assert datastore.process(["PERSIST", "name"]) == b":1\r\n"
+    assert datastore.process(["PERSIST", "name"]) == b":0\r\n"
+    assert datastore.process(["TTL", "name"]) == b":-1\r\n"
+
+
+def test_pexpire_expires_key(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["PEXPIRE", "name", "1"]) == b":1\r\n"
+    time.sleep(0.002)
+    assert datastore.process(["GET", "name"]) == b"$-1\r\n"
+    assert datastore.process(["PTTL", "name"]) == b":-2\r\n"
+
+
+def test_expire_with_non_positive_ttl_deletes(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["EXPIRE", "name", "0"]) == b":1\r\n"
+    assert datastore.process(["GET", "name"]) == b"$-1\r\n"
+
+
+def test_expire_applies_to_lists(datastore):
+    datastore.process(["LPUSH", "list", "a"])
+    datastore.process(["PEXPIRE", "list", "1"])
+    time.sleep(0.002)
+    assert datastore.process(["LRANGE", "list", "0", "-1"]) == b"*0\r\n"
+
+
+def test_getex(datastore):
+    assert datastore.process(["GETEX", "name"]) == b"$-1\r\n"
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["GETEX", "name", "EX", "100"]) == b"$7\r\ncachica\r\n"
+    assert datastore.process(["TTL", "name"]) == b":100\r\n"
+    assert datastore.process(["GETEX", "name", "PERSIST"]) == b"$7\r\ncachica\r\n"
+    assert datastore.process(["TTL", "name"]) == b":-1\r\n"
+    assert datastore.process(["GETEX", "name", "EX"]) == b"-ERR syntax error\r\n"
+
+
+def test_active_expiry_samples_volatile_keys(datastore):
+    for i in range(50):
+        datastore.process(["SET", f"key:{i}", "v", "PX", "1"])
+    datastore.process(["SET", "keep", "v", "EX", "100"])
+    time.sleep(0.002)
+    while len(datastore._volatile) > 1:
+        datastore.evict_expired_keys()
+    assert datastore.process(["KEYS", "*"]) == b"*1\r\n$4\r\nkeep\r\n"
+
+
+def test_mset_mget(datastore):
+    assert datastore.process(["MSET", "a", "1", "b", "2"]) == b"+OK\r\n"
+    datastore.process(["LPUSH", "list", "x"])
+    assert parse_array(datastore.process(["MGET", "a", "missing", "b", "list"])) == ["1", None, "2", None]
+    assert datastore.process(["MSET", "a"]) == b"-ERR wrong number of arguments for 'mset' command\r\n"
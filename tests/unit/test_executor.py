@@ -0,0 +1,78 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from cachica import protocol
+from cachica.compact import CompactDataStore
+from cachica.datastore import DataStore
+from cachica.executor import CommandExecutor, encode_matching_keys
+
+
+def test_encode_matching_keys():
+    assert encode_matching_keys("user:?", ["user:1", "user:22", "page:1"]) == protocol.encode_array(["user:1"])
+    assert encode_matching_keys("*", ["a", "b"]) == protocol.encode_array(["a", "b"])
+
+
+def test_cheap_commands_run_inline():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        executor = CommandExecutor(pool, cost_threshold=100)
+        assert executor.submit(99, protocol.encode_array, ("a",)) == b"*1\r\n$1\r\na\r\n"
+        assert executor.stats.inline == 1
+
+
+def test_expensive_commands_run_inline_without_event_loop():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        executor = CommandExecutor(pool, cost_threshold=1)
+        assert executor.submit(10, protocol.encode_array, ("a",)) == b"*1\r\n$1\r\na\r\n"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("pool_type", [ThreadPoolExecutor, ProcessPoolExecutor])
+async def test_large_lrange_is_offloaded(pool_type):
+    with pool_type(max_workers=1) as pool:
+        executor = CommandExecutor(pool, cost_threshold=100)
+        datastore = DataStore(executor=executor)
+        items = [str(i) for i in range(500)]
+        datastore.process(["LPUSH", "list", *items])
+        response = datastore.process(["LRANGE", "list", "0", "-1"])
+        assert isinstance(response, asyncio.Future)
+        # The list can change while the range is being encoded
+        datastore.process(["LPOP", "list"])
+        assert await response == protocol.encode_array(items)
+        assert datastore.process(["LRANGE", "list", "0", "1"]) == protocol.encode_array(items[1:3])
+        assert executor.stats.offloaded == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("datastore_type", [DataStore, CompactDataStore])
+async def test_large_keys_is_offloaded(datastore_type):
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        datastore = datastore_type(executor=CommandExecutor(pool, cost_threshold=100))
+        for i in range(300):
+            datastore.process(["SET", f"key:{i}", "v"])
+        response = datastore.process(["KEYS", "key:1?"])
+        for i in range(300):
+            datastore.process(["DEL", f"key:{i}"])
+        assert sorted(await _array(response)) == [f"key:{i}" for i in range(10, 20)]
+
+
+@pytest.mark.asyncio
+async def test_values_are_offloaded_by_their_own_threshold():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        executor = CommandExecutor(pool, cost_threshold=100, value_threshold=100_000)
+        datastore = DataStore(executor=executor)
+        datastore.process(["SET", "medium", "v" * 10_000])
+        datastore.process(["SET", "large", "v" * 100_000])
+        assert datastore.process(["GET", "medium"]) == protocol.encode_bulk_string("v" * 10_000)
+        assert executor.stats.offloaded == 0
+        response = datastore.process(["GET", "large"])
+        assert isinstance(response, asyncio.Future)
+        assert await response == protocol.encode_bulk_string("v" * 100_000)
+        assert executor.stats.offloaded == 1
+
+
+async def _array(response) -> list[str]:
+    parser = protocol.Parser(is_client=True)
+    parser.feed(await response)
+    return parser.get_command()
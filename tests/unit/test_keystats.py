@@ -0,0 +1,147 @@
+from collections import deque
+
+import pytest
+
+from cachica.compact import CompactDataStore
+from cachica.config import Config
+from cachica.datastore import DataStore
+from cachica.keystats import CountMinSketch, KeyStats, TopK, estimate_size
+from cachica.protocol import Parser
+
+
+def parse_reply(response: bytes):
+    parser = Parser(is_client=True)
+    parser.feed(response)
+    return parser.get_command()
+
+
+def sample_everything() -> Config:
+    config = Config()
+    config.set("key-stats-sample-rate", "1")
+    return config
+
+
+@pytest.fixture(params=[DataStore, CompactDataStore])
+def datastore(request):
+    return request.param(config=sample_everything())
+
+
+def test_sketch_never_underestimates():
+    sketch = CountMinSketch(width=64, depth=4)
+    for i in range(1000):
+        sketch.add(f"key:{i % 100}")
+    assert all(sketch.add(f"key:{i}", 0) >= 10 for i in range(100))
+    assert sketch.add("hot", 500) >= 500
+    sketch.halve()
+    assert 250 <= sketch.add("hot", 0) < 500
+
+
+def test_top_k_keeps_the_highest_scores():
+    top = TopK(k=3)
+    for key, score in [("a", 1), ("b", 5), ("c", 3), ("d", 4), ("e", 2), ("a", 6)]:
+        top.offer(key, score)
+    assert top.items() == [("a", 6), ("b", 5), ("d", 4)]
+    # Scores may drop, the key then competes with its new score
+    top.offer("b", 1)
+    top.offer("f", 2)
+    assert top.items() == [("a", 6), ("d", 4), ("f", 2)]
+    top.discard("a")
+    assert top.items() == [("d", 4), ("f", 2)]
+
+
+def test_top_k_heap_stays_bounded():
+    top = TopK(k=4)
+    for i in range(1000):
+        top.offer(f"key:{i % 10}", i)
+    assert len(top) == 4
+    assert len(top._heap) <= 16
+    assert [key for key, _ in top.items()] == ["key:9", "key:8", "key:7", "key:6"]
+
+
+def test_hot_keys_are_found_among_noise():
+    stats = KeyStats(k=5)
+    for i in range(20_000):
+        stats.record_access(f"cold:{i}")
+        if i % 10 == 0:
+            stats.record_access("hot")
+    key, hits = stats.hot.items()[0]
+    assert key == "hot"
+    assert hits >= 2000
+
+
+def test_estimate_size_extrapolates_from_samples():
+    items = deque(["x" * 100] * 10_000)
+    estimate = estimate_size(items, samples=5)
+    assert estimate == estimate_size(items, samples=0)
+    assert estimate > 10_000 * 100
+    assert estimate_size("x" * 1000) > estimate_size("x")
+
+
+def test_hotkeys_command(datastore):
+    for _ in range(50):
+        datastore.process(["GET", "popular"])
+    datastore.process(["SET", "other", "v"])
+    datastore.process(["MGET", "popular", "other"])
+    reply = parse_reply(datastore.process(["HOTKEYS"]))
+    assert reply[:2] == ["popular", 51]
+    assert parse_reply(datastore.process(["HOTKEYS", "1"])) == ["popular", 51]
+    assert datastore.process(["HOTKEYS", "-1"]).startswith(b"-ERR")
+
+
+def test_bigkeys_command(datastore):
+    datastore.process(["SET", "small", "v"])
+    datastore.process(["SET", "big", "v" * 10_000])
+    datastore.process(["LPUSH", "list", *(["item"] * 100)])
+    reply = parse_reply(datastore.process(["BIGKEYS"]))
+    assert reply[0::2] == ["big", "list", "small"]
+    assert reply[1] > 10_000
+    datastore.process(["DEL", "big"])
+    assert parse_reply(datastore.process(["BIGKEYS", "1"])) == ["list", reply[3]]
+
+
+def test_bigkeys_drops_keys_deleted_without_sampling():
+    datastore = DataStore(config=sample_everything())
+    datastore.process(["SET", "big", "v" * 10_000])
+    datastore.process(["CONFIG", "SET", "key-stats-sample-rate", "0"])
+    datastore.process(["DEL", "big"])
+    assert parse_reply(datastore.process(["BIGKEYS"])) == []
+
+
+def test_memory_usage(datastore):
+    datastore.process(["SET", "small", "v"])
+    datastore.process(["SET", "big", "v" * 10_000])
+    small = datastore.process(["MEMORY", "USAGE", "small"])
+    big = datastore.process(["MEMORY", "USAGE", "big"])
+    assert small.startswith(b":")
+    assert int(big[1:-2]) - int(small[1:-2]) >= 9_990
+    assert datastore.process(["MEMORY", "USAGE", "missing"]) == b"$-1\r\n"
+    assert datastore.process(["MEMORY", "USAGE", "big", "SAMPLES", "0"]) == big
+    assert datastore.process(["MEMORY", "USAGE", "big", "SAMPLES"]) == b"-ERR syntax error\r\n"
+    assert datastore.process(["MEMORY", "DOCTOR"]).startswith(b"-ERR unknown subcommand")
+
+
+def test_sampling_can_be_disabled():
+    config = Config()
+    config.set("key-stats-sample-rate", "0")
+    datastore = DataStore(config=config)
+    for _ in range(100):
+        datastore.process(["GET", "key"])
+    assert parse_reply(datastore.process(["HOTKEYS"])) == []
+
+
+def test_sample_rate_must_not_be_negative():
+    config = Config()
+    datastore = DataStore(config=config)
+    assert datastore.process(["CONFIG", "SET", "key-stats-sample-rate", "-1"]).startswith(b"-ERR CONFIG SET failed")
+    assert config.key_stats_sample_rate == 100
+
+
+def test_sampled_counts_are_scaled_by_the_rate():
+    config = Config()
+    config.set("key-stats-sample-rate", "10")
+    datastore = DataStore(config=config)
+    for _ in range(10_000):
+        datastore.process(["GET", "key"])
+    key, hits = parse_reply(datastore.process(["HOTKEYS"]))
+    assert key == "key"
+    assert 8_000 < hits < 12_000
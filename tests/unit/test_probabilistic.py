@@ -0,0 +1,122 @@
+import pytest
+
+from cachica.datastore import DataStore
+from cachica.probabilistic import HLL_REGISTERS, HLL_SPARSE_MAX, HyperLogLog, ScalableBloomFilter
+from cachica.protocol import Parser
+
+
+@pytest.fixture
+def datastore():
+    return DataStore()
+
+
+def test_hll_small_counts_are_exact_enough():
+    hll = HyperLogLog()
+    assert hll.count() == 0
+    assert hll.add(["a", "b", "c"])
+    assert not hll.add(["a"])
+    assert hll.count() == 3
+
+
+def test_hll_turns_dense_and_stays_accurate():
+    hll = HyperLogLog()
+    hll.add(f"visitor:{i}" for i in range(HLL_SPARSE_MAX))
+    assert hll.encoding == "sparse"
+    hll.add(f"visitor:{i}" for i in range(100_000))
+    assert hll.encoding == "dense"
+    assert hll.nbytes == 16384
+    assert abs(hll.count() - 100_000) < 100_000 * 0.03
+
+
+def test_hll_is_unbiased_where_linear_counting_used_to_hand_over():
+    n = 5 * HLL_REGISTERS // 2
+    errors = []
+    for trial in range(8):
+        hll = HyperLogLog()
+        hll.add(f"trial:{trial}:{i}" for i in range(n))
+        errors.append(hll.count() / n - 1)
+    assert abs(sum(errors) / len(errors)) < 0.01
+
+
+def test_hll_merge_counts_union():
+    a, b = HyperLogLog(), HyperLogLog()
+    a.add(f"item:{i}" for i in range(0, 30_000))
+    b.add(f"item:{i}" for i in range(20_000, 50_000))
+    sparse = HyperLogLog()
+    sparse.add(["item:1", "other"])
+    a.merge(b)
+    a.merge(sparse)
+    assert abs(a.count() - 50_001) < 50_001 * 0.03
+
+
+def test_bloom_has_no_false_negatives_and_bounded_false_positives():
+    bloom = ScalableBloomFilter(error_rate=0.01, capacity=1000)
+    # An item colliding with earlier ones is reported as possibly seen
+    assert sum(bloom.add(f"seen:{i}" for i in range(10_000))) > 10_000 * 0.99
+    assert bloom.filters > 1
+    assert all(bloom.contains(f"seen:{i}" for i in range(10_000)))
+    false_positives = sum(bloom.contains(f"unseen:{i}" for i in range(10_000)))
+    assert false_positives < 10_000 * 0.015
+
+
+@pytest.mark.parametrize("error_rate, capacity", [(0.01, 100), (0.01, 37), (0.001, 10)])
+def test_bloom_false_positive_rate_stays_below_error_rate(error_rate, capacity):
+    bloom = ScalableBloomFilter(error_rate=error_rate, capacity=capacity)
+    # The worst case: the newest filter is full too
+    i = 0
+    while bloom.filters < 5 or bloom.count < bloom.capacity:
+        bloom.add([f"seen:{i}"])
+        i += 1
+    false_positives = sum(bloom.contains(f"unseen:{i}" for i in range(50_000)))
+    assert false_positives < 50_000 * error_rate
+
+
+def test_bloom_rejects_bad_parameters():
+    with pytest.raises(ValueError):
+        ScalableBloomFilter(error_rate=1.5)
+    with pytest.raises(ValueError):
+        ScalableBloomFilter(capacity=0)
+    with pytest.raises(ValueError):
+        ScalableBloomFilter(error_rate=0.001, capacity=1 << 30)
+
+
+def test_pf_commands(datastore):
+    assert datastore.process(["PFADD", "visits:mon", "a", "b", "c"]) == b":1\r\n"
+    assert datastore.process(["PFADD", "visits:mon", "a"]) == b":0\r\n"
+    datastore.process(["PFADD", "visits:tue", "c", "d"])
+    assert datastore.process(["PFCOUNT", "visits:mon"]) == b":3\r\n"
+    assert datastore.process(["PFCOUNT", "visits:mon", "visits:tue", "missing"]) == b":4\r\n"
+    assert datastore.process(["PFMERGE", "visits:week", "visits:mon", "visits:tue"]) == b"+OK\r\n"
+    assert datastore.process(["PFCOUNT", "visits:week"]) == b":4\r\n"
+    assert datastore.process(["PFCOUNT", "missing"]) == b":0\r\n"
+
+
+def test_pf_commands_check_type(datastore):
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["PFADD", "name", "a"]) == b"-ERR wrong type\r\n"
+    assert datastore.process(["PFCOUNT", "name"]) == b"-ERR wrong type\r\n"
+    datastore.process(["PFADD", "hll", "a"])
+    assert datastore.process(["GET", "hll"]) == b"$-1\r\n"
+
+
+def parse_array(response: bytes) -> list:
+    parser = Parser(is_client=True)
+    parser.feed(response)
+    return parser.get_command()
+
+
+def test_bf_commands(datastore):
+    assert datastore.process(["BF.EXISTS", "seen", "a"]) == b":0\r\n"
+    assert datastore.process(["BF.ADD", "seen", "a"]) == b":1\r\n"
+    assert datastore.process(["BF.ADD", "seen", "a"]) == b":0\r\n"
+    assert parse_array(datastore.process(["BF.MADD", "seen", "a", "b", "c"])) == [0, 1, 1]
+    assert datastore.process(["BF.EXISTS", "seen", "c"]) == b":1\r\n"
+
+
+def test_bf_reserve(datastore):
+    assert datastore.process(["BF.RESERVE", "seen", "0.001", "1000000"]) == b"+OK\r\n"
+    assert datastore.process(["BF.RESERVE", "seen", "0.001", "1000"]) == b"-ERR item exists\r\n"
+    assert datastore.process(["BF.RESERVE", "other", "2", "1000"]).startswith(b"-ERR bad error rate")
+    assert datastore.process(["BF.RESERVE", "other", "0.001", str(1 << 30)]).startswith(b"-ERR bad error rate")
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["BF.ADD", "name", "a"]) == b"-ERR wrong type\r\n"
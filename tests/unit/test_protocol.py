@@ -1,7 +1,7 @@
 import pytest
 
 from cachica import protocol
-from cachica.protocol import Parser
+from cachica.protocol import Parser, ProtocolError, ResponseError
 
 
 @pytest.fixture
@@ -77,3 +77,59 @@ def test_parse_set_with_ttl_fields(parser):
     parser.feed(request)
     resp = parser.get_command()
     assert resp == ["SET", "key", "val", "EX", "60"]
+
+
+def test_client_parser_reply_types():
+    parser = Parser(is_client=True)
+    parser.feed(b"$-1\r\n:42\r\n-ERR wrong type\r\n+OK\r\n$2\r\nhi\r\n")
+    assert parser.ready == 5
+    assert parser.get_command() is None
+    assert parser.get_command() == 42
+    error = parser.get_command()
+    assert isinstance(error, ResponseError) and str(error) == "ERR wrong type"
+    assert parser.get_command() == "OK"
+    assert parser.get_command() == "hi"
+    assert parser.ready == 0
+
+
+def test_client_parser_waits_for_complete_reply():
+    parser = Parser(is_client=True)
+    parser.feed(b"$5\r\nhel")
+    assert parser.ready == 0
+    parser.feed(b"lo\r\n")
+    assert parser.get_command() == "hello"
+
+
+def test_client_parser_rejects_unknown_reply_type():
+    with pytest.raises(ProtocolError):
+        Parser(is_client=True).feed(b"?what\r\n")
+
+
+def test_array_with_null_elements_round_trips():
+    encoded = protocol.encode_array(["a", None, "b"])
+    assert encoded == b"*3\r\n$1\r\na\r\n$-1\r\n$1\r\nb\r\n"
+    parser = Parser(is_client=True)
+    parser.feed(encoded)
+    assert parser.get_command() == ["a", None, "b"]
+
+
+@pytest.mark.parametrize(
+    "req",
+    [
+        b"*1\r\n$-1\r\n",
+        b"*2\r\n$3\r\nGET\r\n$-1\r\n",
+        b"*2\r\n$3\r\nGET\r\n+key\r\n",
+        b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n:5\r\n",
+    ],
+)
+def test_server_parser_rejects_reply_only_elements(parser, req):
+    with pytest.raises(ProtocolError):
+        parser.feed(req)
+
+
+def test_non_ascii_strings_are_encoded_with_byte_lengths():
+    assert protocol.encode_bulk_string("café") == b"$5\r\ncaf\xc3\xa9\r\n"
+    assert protocol.encode_array(["GET", "café"]) == b"*2\r\n$3\r\nGET\r\n$5\r\ncaf\xc3\xa9\r\n"
+    parser = Parser(is_client=True)
+    parser.feed(protocol.encode_array(["naïve", None, "☕"]))
+    assert parser.get_command() == ["naïve", None, "☕"]
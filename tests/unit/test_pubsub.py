@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+import pytest
+
+from cachica.compact import CompactDataStore
+from cachica.config import Config
+from cachica.datastore import DataStore
+from cachica.protocol import Parser
+from cachica.pubsub import PubSub, Subscriber, parse_notify_flags
+
+
+class FakeTransport:
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+
+class FakeWriter:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.writes: list[bytes] = []
+
+    def is_closing(self) -> bool:
+        return False
+
+    def write(self, data: bytes):
+        self.writes.append(data)
+
+
+def parse_replies(data: bytes) -> list:
+    parser = Parser(is_client=True)
+    parser.feed(data)
+    replies = []
+    while parser.ready:
+        replies.append(parser.get_command())
+    return replies
+
+
+def notifying(store_class, flags: str):
+    config = Config()
+    config.set("notify-keyspace-events", flags)
+    datastore = store_class(config=config)
+    writer = FakeWriter()
+    subscriber = Subscriber(writer)
+    datastore.pubsub.handle(subscriber, "PSUBSCRIBE", ["__key*__:*"])
+    return datastore, writer
+
+
+def test_parse_notify_flags():
+    assert parse_notify_flags("") == (False, False, frozenset())
+    assert parse_notify_flags("Ex") == (False, True, frozenset("x"))
+    assert parse_notify_flags("KA") == (True, False, frozenset("g$lxe"))
+    # Classes without a channel to publish to are off
+    assert parse_notify_flags("g$") == (False, False, frozenset())
+    with pytest.raises(ValueError):
+        parse_notify_flags("Kz")
+
+
+def test_subscribe_and_unsubscribe_replies():
+    pubsub = PubSub()
+    subscriber = Subscriber(FakeWriter())
+    assert parse_replies(pubsub.handle(subscriber, "SUBSCRIBE", ["a", "b"])) == [
+        ["subscribe", "a", 1],
+        ["subscribe", "b", 2],
+    ]
+    assert parse_replies(pubsub.handle(subscriber, "PSUBSCRIBE", ["c*"])) == [["psubscribe", "c*", 3]]
+    # Without arguments every channel is left, in no particular order
+    replies = parse_replies(pubsub.handle(subscriber, "UNSUBSCRIBE", []))
+    assert sorted(channel for _, channel, _ in replies) == ["a", "b"]
+    assert [count for _, _, count in replies] == [2, 1]
+    assert parse_replies(pubsub.handle(subscriber, "UNSUBSCRIBE", [])) == [["unsubscribe", None, 1]]
+    pubsub.remove(subscriber)
+    assert subscriber.subscriptions == 0
+    assert pubsub.publish("cat", "meow") == 0
+
+
+@pytest.mark.asyncio
+async def test_messages_are_batched_per_loop_iteration():
+    pubsub = PubSub()
+    writer = FakeWriter()
+    subscriber = Subscriber(writer)
+    pubsub.handle(subscriber, "SUBSCRIBE", ["news"])
+    pubsub.handle(subscriber, "PSUBSCRIBE", ["n*"])
+    assert pubsub.publish("news", "one") == 2
+    assert pubsub.publish("news", "two") == 2
+    assert writer.writes == []
+    await asyncio.sleep(0)
+    assert len(writer.writes) == 1
+    assert parse_replies(writer.writes[0]) == [
+        ["message", "news", "one"],
+        ["pmessage", "n*", "news", "one"],
+        ["message", "news", "two"],
+        ["pmessage", "n*", "news", "two"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_write_commands_notify():
+    datastore, writer = notifying(DataStore, "KEA")
+    datastore.process(["SET", "a", "1"])
+    datastore.process(["MSET", "b", "2"])
+    datastore.process(["LPUSH", "list", "x"])
+    datastore.process(["DEL", "a", "missing"])
+    datastore.process(["SET", "b", "3", "NX"])
+    await asyncio.sleep(0)
+    messages = [reply[2:] for reply in parse_replies(b"".join(writer.writes))]
+    assert messages == [
+        ["__keyspace@0__:a", "set"],
+        ["__keyevent@0__:set", "a"],
+        ["__keyspace@0__:b", "set"],
+        ["__keyevent@0__:set", "b"],
+        ["__keyspace@0__:list", "lpush"],
+        ["__keyevent@0__:lpush", "list"],
+        ["__keyspace@0__:a", "del"],
+        ["__keyevent@0__:del", "a"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_event_classes_filter_notifications():
+    datastore, writer = notifying(DataStore, "Eg")
+    datastore.process(["SET", "a", "1"])
+    datastore.process(["DEL", "a"])
+    await asyncio.sleep(0)
+    assert [reply[2:] for reply in parse_replies(b"".join(writer.writes))] == [["__keyevent@0__:del", "a"]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store_class", [DataStore, CompactDataStore])
+async def test_expired_keys_notify(store_class):
+    datastore, writer = notifying(store_class, "Ex")
+    for i in range(100):
+        datastore.process(["SET", f"active:{i}", "v", "PX", "1"])
+    datastore.process(["SET", "passive", "v", "PX", "1"])
+    time.sleep(0.01)
+    assert datastore.process(["GET", "passive"]) == b"$-1\r\n"
+    while datastore._key_count():
+        datastore.evict_expired_keys()
+    await asyncio.sleep(0)
+    # A whole expiry burst reaches the subscriber in one write
+    assert len(writer.writes) == 1
+    keys = [reply[3] for reply in parse_replies(writer.writes[0])]
+    assert keys[0] == "passive"
+    assert sorted(keys[1:]) == sorted(f"active:{i}" for i in range(100))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store_class", [DataStore, CompactDataStore])
+async def test_deleting_expired_keys_expires_them(store_class):
+    datastore, writer = notifying(store_class, "Egx")
+    datastore.process(["SET", "a", "1", "PX", "1"])
+    datastore.process(["LPUSH", "list", "x"])
+    datastore.process(["PEXPIRE", "list", "1"])
+    datastore.process(["SET", "b", "2"])
+    time.sleep(0.002)
+    assert datastore.process(["DEL", "a", "b"]) == b":1\r\n"
+    assert datastore.process(["UNLINK", "list"]) == b":0\r\n"
+    await asyncio.sleep(0)
+    assert [reply[2:] for reply in parse_replies(b"".join(writer.writes))] == [
+        ["__keyevent@0__:expired", "a"],
+        ["__keyevent@0__:del", "b"],
+        ["__keyevent@0__:expired", "list"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_notifications_can_be_turned_off():
+    datastore, writer = notifying(DataStore, "KEA")
+    datastore.process(["CONFIG", "SET", "notify-keyspace-events", ""])
+    datastore.process(["SET", "a", "1"])
+    await asyncio.sleep(0)
+    assert writer.writes == []
@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+
+from cachica.datastore import DataStore
+from cachica.protocol import Parser
+from cachica.stream import MAX_ID_PART, SEGMENT_ENTRIES, Stream, StreamError, parse_range_bound
+
+END = (MAX_ID_PART, MAX_ID_PART)
+
+
+@pytest.fixture
+def datastore():
+    return DataStore()
+
+
+def parse_reply(response: bytes):
+    parser = Parser(is_client=True)
+    parser.feed(response)
+    assert parser.ready == 1
+    return parser.get_command()
+
+
+def filled_stream(n: int) -> Stream:
+    stream = Stream()
+    for i in range(1, n + 1):
+        stream.add((i, 0), ("n", str(i)))
+    return stream
+
+
+def test_ranges_span_segments():
+    stream = filled_stream(SEGMENT_ENTRIES * 3)
+    entries = stream.range((100, 0), (300, 0))
+    assert [stream_id for stream_id, _ in entries] == [(i, 0) for i in range(100, 301)]
+    assert [stream_id for stream_id, _ in stream.range((0, 0), END, count=3)] == [(1, 0), (2, 0), (3, 0)]
+    reverse = stream.reverse_range((300, 0), (100, 0), count=5)
+    assert [stream_id for stream_id, _ in reverse] == [(i, 0) for i in range(300, 295, -1)]
+    assert stream.range((0, 0), (0, 5)) == []
+    assert stream.reverse_range((0, 5), (0, 0)) == []
+
+
+def test_exact_trim_moves_head_and_drops_segments():
+    stream = filled_stream(SEGMENT_ENTRIES * 3)
+    assert stream.trim(SEGMENT_ENTRIES * 2 - 10) == SEGMENT_ENTRIES + 10
+    assert len(stream) == SEGMENT_ENTRIES * 2 - 10
+    first = SEGMENT_ENTRIES + 11
+    assert stream.range((0, 0), END, count=1)[0][0] == (first, 0)
+    assert stream.reverse_range(END, (0, 0))[-1][0] == (first, 0)
+    assert len(stream._segments) == 2
+
+
+def test_approximate_trim_only_drops_whole_segments():
+    stream = filled_stream(SEGMENT_ENTRIES * 3)
+    assert stream.trim(SEGMENT_ENTRIES * 2 - 10, approximate=True) == SEGMENT_ENTRIES
+    assert len(stream) == SEGMENT_ENTRIES * 2
+
+
+def test_unlink_large_stream_is_freed_by_segments(datastore):
+    for i in range(SEGMENT_ENTRIES * 3 - 1):
+        datastore.process(["XADD", "events", f"{i + 1}-0", "n", str(i)])
+    # Trims the head of the first segment
+    datastore.process(["XADD", "events", "MAXLEN", str(SEGMENT_ENTRIES * 3 - 10), "*", "n", "last"])
+    assert datastore.process(["UNLINK", "events"]) == b":1\r\n"
+    assert datastore.lazyfree_pending() == 1
+    assert datastore.free_lazy(budget=SEGMENT_ENTRIES) == SEGMENT_ENTRIES
+    assert datastore.free_lazy(budget=SEGMENT_ENTRIES) == SEGMENT_ENTRIES
+    assert datastore.free_lazy(budget=SEGMENT_ENTRIES) == SEGMENT_ENTRIES - 10
+    assert datastore.lazyfree_pending() == 0
+
+
+def test_next_id():
+    stream = Stream()
+    with pytest.raises(StreamError):
+        stream.next_id("0-0")
+    stream.add(stream.next_id("5-1"), ("a", "1"))
+    assert stream.next_id("5-*") == (5, 2)
+    assert stream.next_id("6-*") == (6, 0)
+    with pytest.raises(StreamError):
+        stream.next_id("5-1")
+    assert stream.next_id("*") > (5, 1)
+
+
+def test_next_id_at_the_last_sequence_number():
+    stream = Stream()
+    stream.add((5, MAX_ID_PART), ("a", "1"))
+    with pytest.raises(StreamError):
+        stream.next_id("5-*")
+    # The clock is behind the last entry, "*" moves on to the next millisecond
+    stream = Stream()
+    stream.add((1 << 60, MAX_ID_PART), ("a", "1"))
+    assert stream.next_id("*") == ((1 << 60) + 1, 0)
+    stream = Stream()
+    stream.add(END, ("a", "1"))
+    with pytest.raises(StreamError, match="exhausted"):
+        stream.next_id("*")
+
+
+def test_exclusive_range_bounds():
+    assert parse_range_bound("(5-1", is_start=True) == (5, 2)
+    assert parse_range_bound("(5-0", is_start=False) == (4, MAX_ID_PART)
+    assert parse_range_bound("5", is_start=False) == (5, MAX_ID_PART)
+
+
+def test_xadd_xrange(datastore):
+    assert datastore.process(["XADD", "events", "1-1", "type", "login", "user", "1"]) == b"$3\r\n1-1\r\n"
+    datastore.process(["XADD", "events", "1-2", "type", "logout"])
+    datastore.process(["XADD", "events", "2-0", "type", "login"])
+    assert datastore.process(["XLEN", "events"]) == b":3\r\n"
+    assert parse_reply(datastore.process(["XRANGE", "events", "-", "+", "COUNT", "2"])) == [
+        ["1-1", ["type", "login", "user", "1"]],
+        ["1-2", ["type", "logout"]],
+    ]
+    assert parse_reply(datastore.process(["XREVRANGE", "events", "+", "(1-2"])) == [["2-0", ["type", "login"]]]
+    assert parse_reply(datastore.process(["XRANGE", "missing", "-", "+"])) == []
+
+
+def test_xadd_errors(datastore):
+    datastore.process(["XADD", "events", "5-0", "a", "1"])
+    assert datastore.process(["XADD", "events", "4-0", "a", "1"]).startswith(b"-ERR The ID specified in XADD")
+    assert datastore.process(["XADD", "events", "*", "a"]) == (b"-ERR wrong number of arguments for 'xadd' command\r\n")
+    assert datastore.process(["XADD", "missing", "NOMKSTREAM", "*", "a", "1"]) == b"$-1\r\n"
+    datastore.process(["SET", "name", "cachica"])
+    assert datastore.process(["XADD", "name", "*", "a", "1"]) == b"-ERR wrong type\r\n"
+
+
+def test_xadd_maxlen(datastore):
+    for i in range(1, 301):
+        datastore.process(["XADD", "events", "MAXLEN", "100", f"{i}-0", "n", str(i)])
+    assert datastore.process(["XLEN", "events"]) == b":100\r\n"
+    assert parse_reply(datastore.process(["XRANGE", "events", "-", "+", "COUNT", "1"]))[0][0] == "201-0"
+    datastore.process(["XADD", "events", "MAXLEN", "~", "10", "*", "n", "last"])
+    # Approximate trimming keeps whole segments
+    assert int(datastore.process(["XLEN", "events"])[1:-2]) >= 10
+
+
+def test_xread(datastore):
+    datastore.process(["XADD", "a", "1-0", "n", "1"])
+    datastore.process(["XADD", "a", "2-0", "n", "2"])
+    datastore.process(["XADD", "b", "1-0", "n", "1"])
+    assert parse_reply(datastore.process(["XREAD", "COUNT", "1", "STREAMS", "a", "b", "1-0", "0"])) == [
+        ["a", [["2-0", ["n", "2"]]]],
+        ["b", [["1-0", ["n", "1"]]]],
+    ]
+    assert datastore.process(["XREAD", "STREAMS", "a", "$"]) == b"*-1\r\n"
+    assert datastore.process(["XREAD", "STREAMS", "a"]).startswith(b"-ERR Unbalanced")
+    assert datastore.process(["XREAD", "COUNT", "x", "STREAMS", "a", "0"]) == (
+        b"-ERR value is not an integer or out of range\r\n"
+    )
+    assert datastore.process(["XREAD", "BLOCK", "x", "STREAMS", "a", "0"]) == (
+        b"-ERR timeout is not an integer or out of range\r\n"
+    )
+    assert datastore.process(["XREAD", "COUNT"]) == b"-ERR syntax error\r\n"
+
+
+@pytest.mark.asyncio
+async def test_blocking_xread_wakes_on_xadd(datastore):
+    datastore.process(["XADD", "events", "1-0", "n", "1"])
+    response = datastore.process(["XREAD", "BLOCK", "0", "STREAMS", "events", "$"])
+    assert type(response) is not bytes
+    reader = asyncio.ensure_future(response)
+    await asyncio.sleep(0)
+    assert not reader.done()
+    datastore.process(["XADD", "other", "1-0", "n", "1"])
+    datastore.process(["XADD", "events", "2-0", "n", "2"])
+    assert parse_reply(await reader) == [["events", [["2-0", ["n", "2"]]]]]
+    assert datastore._stream_waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_blocking_xread_times_out(datastore):
+    response = datastore.process(["XREAD", "BLOCK", "10", "STREAMS", "events", "$"])
+    assert await response == b"*-1\r\n"
+    assert datastore._stream_waiters == {}